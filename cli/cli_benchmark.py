@@ -0,0 +1,292 @@
+import argparse
+from os import makedirs
+from os.path import join
+
+from data_process import (BENCHMARK_FILENAME, BENCHMARK_SCHEDULERS,
+                          DASK_WORKERS, DISTRIBUTED_SCHEDULER_KEY,
+                          MODEL_THREADS, PROCESSES_SCHEDULER_KEY,
+                          RENDER_WORKERS, SHAP_MAX_PLOTS,
+                          SYNCHRONOUS_SCHEDULER_KEY, SYNTHETIC_CHUNK_SIZE,
+                          SYNTHETIC_FILENAME, THREADS_SCHEDULER_KEY, WORKDIR)
+from data_process.instrument import run_report
+
+
+def get_example_usage():
+    example_text = """example:
+        * cli_benchmark [--workdir /tmp/cas_benchmark]
+                        [--num_rows 10000 1000000]
+                        [--seed 0]
+                        [--data_src /tmp/cas_analysis_experiment/cas.csv]
+                        [--baseline /tmp/cas_benchmark_previous/benchmark.json]
+        """
+    return example_text
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the wall time and the peak memory of every stage of the CAS analysis",
+        epilog=get_example_usage(),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--workdir",
+        required=False,
+        default=WORKDIR,
+        type=str,
+        help="Where the synthetic datasets and the benchmark results will be located "
+        "(default: /tmp/cas_analysis/{unique_id})",
+    )
+
+    parser.add_argument(
+        "--num_rows",
+        required=False,
+        type=int,
+        nargs="+",
+        default=[10000],
+        help="the number of rows of each synthetic dataset to be benchmarked, e.g., 10000 1000000 50000000 "
+        "(default: 10000)",
+    )
+
+    parser.add_argument(
+        "--seed",
+        required=False,
+        type=int,
+        default=0,
+        help="the random seed of the synthetic datasets (default: 0)",
+    )
+
+    parser.add_argument(
+        "--data_src",
+        required=False,
+        type=str,
+        default=None,
+        help="benchmark this dataset instead of the synthetic datasets, e.g., /tmp/tmp/cas_test/cas.csv",
+    )
+
+    parser.add_argument(
+        "--temporal_config",
+        required=False,
+        type=str,
+        default="etc/configs/temporal_analysis_exp1.yaml",
+        help="the temporal analysis configuration (default: etc/configs/temporal_analysis_exp1.yaml)",
+    )
+
+    parser.add_argument(
+        "--spatial_config",
+        required=False,
+        type=str,
+        default="etc/configs/spatial_analysis_exp1.yaml",
+        help="the spatial analysis configuration (default: etc/configs/spatial_analysis_exp1.yaml)",
+    )
+
+    parser.add_argument(
+        "--feature_config",
+        required=False,
+        type=str,
+        default="etc/configs/feature_analysis_exp1.yaml",
+        help="the feature analysis configuration (default: etc/configs/feature_analysis_exp1.yaml)",
+    )
+
+    parser.add_argument(
+        "--output",
+        required=False,
+        type=str,
+        default=None,
+        help=f"where the benchmark results [in JSON] are written (default: <workdir>/{BENCHMARK_FILENAME})",
+    )
+
+    parser.add_argument(
+        "--baseline",
+        required=False,
+        type=str,
+        default=None,
+        help="the benchmark results [in JSON] of the baseline (e.g., the previous version) to be compared with",
+    )
+
+    parser.add_argument(
+        "--render_workers",
+        required=False,
+        type=int,
+        default=RENDER_WORKERS,
+        help="number of processes used to render the figures (default: environmental variable RENDER_WORKERS, or 1)",
+    )
+
+    parser.add_argument(
+        "--model_threads",
+        required=False,
+        type=int,
+        default=MODEL_THREADS,
+        help="number of threads used to train the model "
+        "(default: environmental variable MODEL_THREADS, or the number of CPUs)",
+    )
+
+    parser.add_argument(
+        "--max_shap_plots",
+        required=False,
+        type=int,
+        default=SHAP_MAX_PLOTS,
+        help=f"maximum number of the SHAP force plots (default: {SHAP_MAX_PLOTS})",
+    )
+
+    parser.add_argument(
+        "--schedulers",
+        required=False,
+        nargs="+",
+        default=BENCHMARK_SCHEDULERS,
+        choices=[
+            SYNCHRONOUS_SCHEDULER_KEY,
+            THREADS_SCHEDULER_KEY,
+            PROCESSES_SCHEDULER_KEY,
+            DISTRIBUTED_SCHEDULER_KEY,
+        ],
+        help="the dask schedulers to be compared, the timeseries and the spatial data are computed by "
+        f"the dask engine with each of them (default: {' '.join(BENCHMARK_SCHEDULERS)})",
+    )
+
+    parser.add_argument(
+        "--num_workers",
+        required=False,
+        type=int,
+        default=DASK_WORKERS,
+        help="number of workers of the dask schedulers "
+        "(default: environmental variable DASK_WORKERS, or the number of CPUs)",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="sample the call stacks of the instrumented stages, and dump the profile of the slowest leaf stage "
+        "(a stage without nested stages) to the working directory (next to run_report.json)",
+    )
+
+    return parser.parse_args()
+
+
+def benchmark(
+    workdir: str,
+    num_rows: list,
+    temporal_config: str,
+    spatial_config: str,
+    feature_config: str,
+    seed: int = 0,
+    data_src: str or None = None,
+    output: str or None = None,
+    baseline: str or None = None,
+    render_workers: int = RENDER_WORKERS,
+    model_threads: int = MODEL_THREADS,
+    max_shap_plots: int or None = SHAP_MAX_PLOTS,
+    schedulers: list = BENCHMARK_SCHEDULERS,
+    num_workers: int = DASK_WORKERS,
+):
+    """Benchmark every stage of the CAS analysis on the synthetic datasets (or a given dataset)
+
+    Args:
+        workdir (str): where to run the codes
+        num_rows (list): the number of rows of each synthetic dataset
+        temporal_config (str): the temporal analysis configuration
+        spatial_config (str): the spatial analysis configuration
+        feature_config (str): the feature analysis configuration
+        seed (int, optional): the random seed of the synthetic datasets. Defaults to 0.
+        data_src (str or None, optional): the dataset to be benchmarked instead of the synthetic datasets. Defaults to None.
+        output (str or None, optional): where the benchmark results are written, None for <workdir>/benchmark.json.
+            Defaults to None.
+        baseline (str or None, optional): the benchmark results to be compared with. Defaults to None.
+        render_workers (int, optional): number of rendering processes. Defaults to RENDER_WORKERS.
+        model_threads (int, optional): number of threads used by the model. Defaults to MODEL_THREADS.
+        max_shap_plots (int or None, optional): maximum number of the SHAP force plots. Defaults to SHAP_MAX_PLOTS.
+        schedulers (list, optional): the dask schedulers to be compared. Defaults to BENCHMARK_SCHEDULERS.
+        num_workers (int, optional): number of workers of the dask schedulers. Defaults to DASK_WORKERS.
+    """
+    # the analysis modules (and their dependencies) are only imported when the task is run
+    from data_process.benchmark import (compare_benchmarks, measure_startup,
+                                        run_benchmark, write_benchmark)
+    from data_process.render import init_render_worker
+    from data_process.synthetic import create_synthetic_dataset
+    from data_process.utils import read_config, setup_logging
+
+    logger = setup_logging()
+
+    init_render_worker()
+
+    makedirs(workdir, exist_ok=True)
+
+    logger.info("read configs ...")
+    temporal_cfg = read_config(temporal_config)
+    spatial_cfg = read_config(spatial_config)
+    feature_cfg = read_config(feature_config)
+
+    if data_src is None:
+        data_paths = {}
+        for proc_num_rows in num_rows:
+            logger.info(f"create the synthetic dataset with {proc_num_rows} rows ...")
+            data_paths[proc_num_rows] = create_synthetic_dataset(
+                join(workdir, SYNTHETIC_FILENAME.format(num_rows=proc_num_rows, seed=seed)),
+                proc_num_rows,
+                seed=seed,
+                chunksize=SYNTHETIC_CHUNK_SIZE,
+            )
+    else:
+        data_paths = {None: data_src}
+
+    runs = []
+    for proc_num_rows, data_path in data_paths.items():
+        logger.info(f"benchmark {data_path} ...")
+        runs.append(
+            {
+                "num_rows": proc_num_rows,
+                "data_src": data_path,
+                "stages": run_benchmark(
+                    workdir,
+                    data_path,
+                    temporal_cfg,
+                    spatial_cfg,
+                    feature_cfg,
+                    model_threads=model_threads,
+                    render_workers=render_workers,
+                    max_shap_plots=max_shap_plots,
+                    schedulers=schedulers,
+                    num_workers=num_workers,
+                ),
+            }
+        )
+
+    logger.info("benchmark the startup of the package and the CLIs ...")
+    startup = measure_startup()
+
+    benchmark_path = write_benchmark(
+        join(workdir, BENCHMARK_FILENAME) if output is None else output, runs, startup=startup
+    )
+
+    logger.info(f"benchmark results are written to {benchmark_path} ...")
+
+    if baseline is not None:
+        logger.info(f"compared with {baseline}:\n{compare_benchmarks(baseline, benchmark_path).to_string(index=False)}")
+
+    logger.info("job done ...")
+
+
+def main():
+    args = setup_parser()
+
+    with run_report(args.workdir, "benchmark", run_args=vars(args), profile=args.profile):
+        benchmark(
+            args.workdir,
+            args.num_rows,
+            args.temporal_config,
+            args.spatial_config,
+            args.feature_config,
+            seed=args.seed,
+            data_src=args.data_src,
+            output=args.output,
+            baseline=args.baseline,
+            render_workers=args.render_workers,
+            model_threads=args.model_threads,
+            max_shap_plots=args.max_shap_plots,
+            schedulers=args.schedulers,
+            num_workers=args.num_workers,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,9 @@
 import argparse
+from os import makedirs
 
-from data_process import (ANALYSIS_FILEDS_KEY, LATLON_KEY, POPULATION_KEY,
-                          REGION_KEY, WORKDIR)
-from data_process.feature import (create_feature_analysis,
-                                  extract_feature_dataset)
-from data_process.spatial import create_spatial
-from data_process.utils import read_config, read_dataset, setup_logging
-from data_process.vis import plot_spatial
+from data_process import (ANALYSIS_FILEDS_KEY, CHUNK_SIZE, MODEL_THREADS,
+                          RENDER_WORKERS, SHAP_MAX_PLOTS, WORKDIR)
+from data_process.instrument import run_report
 
 
 def get_example_usage():
@@ -46,6 +43,61 @@ def setup_parser():
         help="the path for the configuration file [in YAML]",
     )
 
+    parser.add_argument(
+        "--chunksize",
+        required=False,
+        type=int,
+        default=CHUNK_SIZE,
+        help="if it is set, the dataset is streamed in chunks of this many rows (only the columns required "
+        "by the configuration are read), so the peak memory stays bounded (default: environmental variable CHUNK_SIZE)",
+    )
+
+    parser.add_argument(
+        "--max_shap_plots",
+        required=False,
+        type=int,
+        default=SHAP_MAX_PLOTS,
+        help=f"maximum number of the SHAP force plots (one for each explained row) for each field (default: {SHAP_MAX_PLOTS})",
+    )
+
+    parser.add_argument(
+        "--shap_summary",
+        action="store_true",
+        help="render one SHAP summary plot for each field instead of the force plots",
+    )
+
+    parser.add_argument(
+        "--render_workers",
+        required=False,
+        type=int,
+        default=RENDER_WORKERS,
+        help="number of processes used to render the figures (default: environmental variable RENDER_WORKERS, or 1)",
+    )
+
+    parser.add_argument(
+        "--model_threads",
+        required=False,
+        type=int,
+        default=MODEL_THREADS,
+        help="total number of threads used to train the models (default: environmental variable MODEL_THREADS, or the number of CPUs)",
+    )
+
+    parser.add_argument(
+        "--field_workers",
+        required=False,
+        type=int,
+        default=None,
+        help="number of fields analysed at the same time, the model threads are shared by them "
+        "(default: the number of fields, up to --model_threads)",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="sample the call stacks of the instrumented stages, and dump the profile of the slowest leaf stage "
+        "(a stage without nested stages) to the working directory (next to run_report.json)",
+    )
+
     return parser.parse_args()
 
 
@@ -53,6 +105,12 @@ def feature_analysis(
     workdir: str,
     data_src: str,
     config_file: list,
+    chunksize: int or None = CHUNK_SIZE,
+    max_shap_plots: int or None = SHAP_MAX_PLOTS,
+    shap_summary: bool = False,
+    render_workers: int = RENDER_WORKERS,
+    model_threads: int = MODEL_THREADS,
+    field_workers: int or None = None,
 ):
     """Producing feature analysis (changes) based on the CAS dataset
 
@@ -60,22 +118,44 @@ def feature_analysis(
         workdir (str): where to run the codes
         data_src (str): the dataset to be used
         data_keys (list): the keys to be used, e.g., crashDirectionDescription,bicycle
+        chunksize (int or None, optional): if it is set, the dataset is streamed in chunks. Defaults to CHUNK_SIZE.
+        max_shap_plots (int or None, optional): maximum number of the SHAP force plots for each field. Defaults to SHAP_MAX_PLOTS.
+        shap_summary (bool, optional): render one SHAP summary plot instead of the force plots. Defaults to False.
+        render_workers (int, optional): number of rendering processes. Defaults to RENDER_WORKERS.
+        model_threads (int, optional): total number of threads used to train the models. Defaults to MODEL_THREADS.
+        field_workers (int or None, optional): number of fields analysed at the same time. Defaults to None.
     """
-    logger = setup_logging()
+    # the analysis modules (and their dependencies) are only imported when the task is run
+    from data_process.feature import create_feature_analysis
+    from data_process.utils import (get_feature_columns, read_config,
+                                    read_dataset, setup_logging)
 
-    logger.info("read raw dataset ...")
+    logger = setup_logging()
 
-    data = read_dataset(data_src)
+    makedirs(workdir, exist_ok=True)
 
     logger.info("read configs ...")
 
     cfg = read_config(config_file)
 
+    logger.info("read raw dataset ...")
+
+    data = read_dataset(data_src, use_cache=True, columns=get_feature_columns(cfg), chunksize=chunksize)
+
     logger.info(f"{ANALYSIS_FILEDS_KEY} analysis")
 
     logger.info("feature analysis ...")
 
-    create_feature_analysis(workdir, data, cfg)
+    create_feature_analysis(
+        workdir,
+        data,
+        cfg,
+        max_shap_plots=max_shap_plots,
+        shap_summary=shap_summary,
+        render_workers=render_workers,
+        n_jobs=model_threads,
+        field_workers=field_workers,
+    )
 
     logger.info(f"job done (data are created at {workdir})...")
 
@@ -83,7 +163,18 @@ def feature_analysis(
 def main():
     args = setup_parser()
 
-    feature_analysis(args.workdir, args.data_src, args.config_file)
+    with run_report(args.workdir, "feature_analysis", run_args=vars(args), profile=args.profile):
+        feature_analysis(
+            args.workdir,
+            args.data_src,
+            args.config_file,
+            chunksize=args.chunksize,
+            max_shap_plots=args.max_shap_plots,
+            shap_summary=args.shap_summary,
+            render_workers=args.render_workers,
+            model_threads=args.model_threads,
+            field_workers=args.field_workers,
+        )
 
 
 if __name__ == "__main__":
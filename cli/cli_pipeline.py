@@ -0,0 +1,280 @@
+import argparse
+from os import makedirs
+
+from data_process import (CHUNK_SIZE, DASK_ENGINE_KEY,
+                          DISTRIBUTED_SCHEDULER_KEY, FEATURE_KEY,
+                          GROUPBY_ENGINE_KEY, MODEL_THREADS, PIPELINE_WORKERS,
+                          PROCESSES_SCHEDULER_KEY, RENDER_WORKERS,
+                          SHAP_MAX_PLOTS, SPATIAL_KEY,
+                          SYNCHRONOUS_SCHEDULER_KEY, TEMPORAL_KEY,
+                          THREADS_SCHEDULER_KEY, WORKDIR)
+from data_process.instrument import run_report
+
+
+def get_example_usage():
+    example_text = """example:
+        * cli_pipeline --data_src /tmp/cas_analysis_experiment/cas.csv
+                       [--temporal_configs etc/configs/temporal_analysis_exp1.yaml etc/configs/temporal_analysis_exp2.yaml]
+                       [--spatial_configs etc/configs/spatial_analysis_exp1.yaml]
+                       [--feature_configs etc/configs/feature_analysis_exp1.yaml]
+        """
+    return example_text
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser(
+        description="Producing temporal, spatial and feature data analysis for the CAS dataset in one process",
+        epilog=get_example_usage(),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--workdir",
+        required=False,
+        default=WORKDIR,
+        type=str,
+        help="Where the data will be run, the outputs of each experiment are in <workdir>/<config file name> "
+        "(default: /tmp/cas_analysis/{unique_id})",
+    )
+
+    parser.add_argument(
+        "--data_src",
+        required=True,
+        type=str,
+        help="which dataset to be used, e.g., /tmp/tmp/cas_test/cas.csv",
+    )
+
+    parser.add_argument(
+        "--temporal_configs",
+        required=False,
+        nargs="+",
+        default=[],
+        help="the configuration files [in YAML] of the temporal analysis experiments",
+    )
+
+    parser.add_argument(
+        "--spatial_configs",
+        required=False,
+        nargs="+",
+        default=[],
+        help="the configuration files [in YAML] of the spatial analysis experiments",
+    )
+
+    parser.add_argument(
+        "--feature_configs",
+        required=False,
+        nargs="+",
+        default=[],
+        help="the configuration files [in YAML] of the feature analysis experiments",
+    )
+
+    parser.add_argument(
+        "--engine",
+        required=False,
+        type=str,
+        default=GROUPBY_ENGINE_KEY,
+        choices={GROUPBY_ENGINE_KEY, DASK_ENGINE_KEY},
+        help="how the timeseries and the spatial data are computed (default: groupby)",
+    )
+
+    parser.add_argument(
+        "--scheduler",
+        required=False,
+        type=str,
+        default=None,
+        choices={
+            SYNCHRONOUS_SCHEDULER_KEY,
+            THREADS_SCHEDULER_KEY,
+            PROCESSES_SCHEDULER_KEY,
+            DISTRIBUTED_SCHEDULER_KEY,
+        },
+        help="the dask scheduler used by the dask engine: synchronous, threads, processes (a local pool) "
+        "or distributed (a local cluster, requires dask distributed) "
+        "(default: scheduler in the configuration, or environmental variable DASK_SCHEDULER, or threads)",
+    )
+
+    parser.add_argument(
+        "--num_workers",
+        required=False,
+        type=int,
+        default=None,
+        help="number of workers of the dask scheduler "
+        "(default: num_workers in the configuration, or environmental variable DASK_WORKERS, or the number of CPUs)",
+    )
+
+    parser.add_argument(
+        "--chunksize",
+        required=False,
+        type=int,
+        default=CHUNK_SIZE,
+        help="if it is set, the dataset is streamed in chunks of this many rows "
+        "(default: environmental variable CHUNK_SIZE)",
+    )
+
+    parser.add_argument(
+        "--use_memo",
+        action="store_true",
+        help="memoize the aggregated cells of the dataset on disk, so the cells shared by the temporal and "
+        "spatial experiments (and the other runs) are not computed again "
+        "(directory and size: environmental variables QUERY_MEMO_DIR and QUERY_MEMO_MAX_SIZE)",
+    )
+
+    parser.add_argument(
+        "--stage_workers",
+        required=False,
+        type=int,
+        default=PIPELINE_WORKERS,
+        help="number of independent stages run at the same time "
+        "(default: environmental variable PIPELINE_WORKERS, or the number of CPUs)",
+    )
+
+    parser.add_argument(
+        "--render_workers",
+        required=False,
+        type=int,
+        default=RENDER_WORKERS,
+        help="number of processes used to render the figures (default: environmental variable RENDER_WORKERS, or 1)",
+    )
+
+    parser.add_argument(
+        "--model_threads",
+        required=False,
+        type=int,
+        default=MODEL_THREADS,
+        help="number of threads used to train the models of each feature experiment "
+        "(default: environmental variable MODEL_THREADS, or the number of CPUs)",
+    )
+
+    parser.add_argument(
+        "--max_shap_plots",
+        required=False,
+        type=int,
+        default=SHAP_MAX_PLOTS,
+        help=f"maximum number of the SHAP force plots for each feature field (default: {SHAP_MAX_PLOTS})",
+    )
+
+    parser.add_argument(
+        "--shap_summary",
+        action="store_true",
+        help="render one SHAP summary plot for each feature field instead of the force plots",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="sample the call stacks of the instrumented stages, and dump the profile of the slowest leaf stage "
+        "(a stage without nested stages) to the working directory (next to run_report.json)",
+    )
+
+    return parser.parse_args()
+
+
+def pipeline(
+    workdir: str,
+    data_src: str,
+    temporal_configs: list = [],
+    spatial_configs: list = [],
+    feature_configs: list = [],
+    engine: str = GROUPBY_ENGINE_KEY,
+    scheduler: str or None = None,
+    num_workers: int or None = None,
+    chunksize: int or None = CHUNK_SIZE,
+    use_memo: bool = False,
+    stage_workers: int = PIPELINE_WORKERS,
+    render_workers: int = RENDER_WORKERS,
+    model_threads: int = MODEL_THREADS,
+    max_shap_plots: int or None = SHAP_MAX_PLOTS,
+    shap_summary: bool = False,
+):
+    """Producing all the analysis in one process: the dataset is loaded once,
+    and the analysis stages are run as a dependency graph
+
+    Args:
+        workdir (str): where to run the codes
+        data_src (str): the dataset to be used
+        temporal_configs (list, optional): configuration files of the temporal analysis. Defaults to [].
+        spatial_configs (list, optional): configuration files of the spatial analysis. Defaults to [].
+        feature_configs (list, optional): configuration files of the feature analysis. Defaults to [].
+        engine (str, optional): the engine used to compute the timeseries and the spatial data. Defaults to groupby.
+        scheduler (str or None, optional): the dask scheduler, None for the configuration of each experiment
+            or DASK_SCHEDULER. Defaults to None.
+        num_workers (int or None, optional): number of dask workers, None for the configuration of each experiment
+            or DASK_WORKERS. Defaults to None.
+        chunksize (int or None, optional): if it is set, the dataset is streamed in chunks. Defaults to CHUNK_SIZE.
+        use_memo (bool, optional): whether to use the query memo of the dataset. Defaults to False.
+        stage_workers (int, optional): number of stages run at the same time. Defaults to PIPELINE_WORKERS.
+        render_workers (int, optional): number of rendering processes. Defaults to RENDER_WORKERS.
+        model_threads (int, optional): number of threads used by the feature models. Defaults to MODEL_THREADS.
+        max_shap_plots (int or None, optional): maximum number of the SHAP force plots for each field. Defaults to SHAP_MAX_PLOTS.
+        shap_summary (bool, optional): render one SHAP summary plot instead of the force plots. Defaults to False.
+    """
+    # the analysis modules (and their dependencies) are only imported when the task is run
+    from data_process.memo import open_query_memo
+    from data_process.pipeline import (get_experiments, get_pipeline_stages,
+                                       run_pipeline)
+    from data_process.render import init_render_worker
+    from data_process.utils import setup_logging
+
+    logger = setup_logging()
+
+    makedirs(workdir, exist_ok=True)
+
+    # the figures may be drawn out of the main thread
+    init_render_worker()
+
+    logger.info("read configs ...")
+
+    experiments = get_experiments(
+        {TEMPORAL_KEY: temporal_configs, SPATIAL_KEY: spatial_configs, FEATURE_KEY: feature_configs}
+    )
+
+    if not experiments:
+        raise Exception("at least one configuration file is required")
+
+    stages = get_pipeline_stages(
+        workdir,
+        data_src,
+        experiments,
+        chunksize=chunksize,
+        engine=engine,
+        scheduler=scheduler,
+        num_workers=num_workers,
+        memo=open_query_memo(data_src) if use_memo else None,
+        render_workers=render_workers,
+        model_threads=model_threads,
+        max_shap_plots=max_shap_plots,
+        shap_summary=shap_summary,
+    )
+
+    logger.info(f"running {len(stages)} stages for {len(experiments)} experiments ...")
+
+    run_pipeline(stages, num_workers=stage_workers)
+
+    logger.info(f"job done (data are created at {workdir})...")
+
+
+def main():
+    args = setup_parser()
+
+    with run_report(args.workdir, "pipeline", run_args=vars(args), profile=args.profile):
+        pipeline(
+            args.workdir,
+            args.data_src,
+            temporal_configs=args.temporal_configs,
+            spatial_configs=args.spatial_configs,
+            feature_configs=args.feature_configs,
+            engine=args.engine,
+            scheduler=args.scheduler,
+            num_workers=args.num_workers,
+            chunksize=args.chunksize,
+            use_memo=args.use_memo,
+            stage_workers=args.stage_workers,
+            render_workers=args.render_workers,
+            model_threads=args.model_threads,
+            max_shap_plots=args.max_shap_plots,
+            shap_summary=args.shap_summary,
+        )
+
+
+if __name__ == "__main__":
+    main()
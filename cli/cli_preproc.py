@@ -1,15 +1,17 @@
 import argparse
-from datetime import datetime
+from os import makedirs
 
-from data_process import CSV_KEY, WORKDIR
-from data_process.download import download_cas_dataset
-from data_process.utils import setup_logging
+from data_process import CSV_KEY, CUBE_DIMENSIONS, GEOJSON_KEY, WORKDIR
+from data_process.instrument import run_report
 
 
 def get_example_usage():
     example_text = """example:
         * cli_preproc [--workdir /tmp/cas_analysis_experiment]
-                      [--input_fmt csv]
+                      [--input_fmt csv/geojson]
+                      [--build_cache]
+                      [--build_cube [--cube_dimensions speedLimit urban weatherA light]]
+                      [--fingerprint_years etc/configs/temporal_analysis_exp1.yaml etc/configs/spatial_analysis_exp1.yaml]
         """
     return example_text
 
@@ -34,37 +36,125 @@ def setup_parser():
         required=False,
         type=str,
         default=CSV_KEY,
-        choices={CSV_KEY},
+        choices={CSV_KEY, GEOJSON_KEY},
         help="Input data format, by default the data (default: CSV) will be downloaded from internet. "
         "Please set environmental variable {data_fmt}_src for the source of data",
     )
 
+    parser.add_argument(
+        "--build_cache",
+        action="store_true",
+        help="Build the typed columnar cache of the dataset right after the download, "
+        "so the analysis tasks do not need to parse the raw data again",
+    )
+
+    parser.add_argument(
+        "--build_cube",
+        action="store_true",
+        help="Build the pre-aggregated crash cube (region x crashYear x dimensions) next to the dataset, "
+        "it is used by the temporal and spatial analysis when it is able to answer the analysis fields",
+    )
+
+    parser.add_argument(
+        "--cube_dimensions",
+        required=False,
+        nargs="+",
+        default=CUBE_DIMENSIONS,
+        help=f"The categorical dimensions of the crash cube (default: {' '.join(CUBE_DIMENSIONS)})",
+    )
+
+    parser.add_argument(
+        "--fingerprint_years",
+        required=False,
+        nargs="+",
+        default=None,
+        metavar="CONFIG",
+        help="Fingerprint the rows of each year of the dataset (over the columns used by the analysis fields of "
+        "these configurations), so the aggregate stores of the analysis tasks (--use_store) only aggregate "
+        "the years which are changed in the new dataset",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="sample the call stacks of the instrumented stages, and dump the profile of the slowest leaf stage "
+        "(a stage without nested stages) to the working directory (next to run_report.json)",
+    )
+
     return parser.parse_args()
 
 
 def preproc(
     workdir: str,
     input_fmt: str,
+    build_cache: bool = False,
+    build_cube: bool = False,
+    cube_dimensions: list = CUBE_DIMENSIONS,
+    fingerprint_years: list or None = None,
 ):
     """Download (if it is required) and export the CAS dataset to Dataframe
 
     Args:
         workdir (str): the working directory, e.g., where the output will be exported
-        input_fmt (datetime): input data format (currently only CSV is supported)
+        input_fmt (datetime): input data format (CSV or GeoJSON), the GeoJSON dataset is always
+            converted to the columnar cache
+        build_cache (bool, optional): whether to build the columnar cache for the dataset. Defaults to False.
+        build_cube (bool, optional): whether to build the crash cube for the dataset. Defaults to False.
+        cube_dimensions (list, optional): the categorical dimensions of the crash cube. Defaults to CUBE_DIMENSIONS.
+        fingerprint_years (list or None, optional): the configurations whose analysis fields are used to
+            fingerprint the rows of each year, None for no fingerprints. Defaults to None.
     """
+    # the analysis modules (and their dependencies) are only imported when the task is run
+    from data_process.cube import create_crash_cube
+    from data_process.download import download_cas_dataset
+    from data_process.store import (create_year_fingerprints,
+                                    get_cells_column_sets)
+    from data_process.utils import (build_dataset_cache, read_config,
+                                    setup_logging)
+
     logger = setup_logging()
 
+    makedirs(workdir, exist_ok=True)
+
     logger.info("check and download CAS dataset from NZTA")
-    if download_cas_dataset(workdir, input_fmt) is None:
+    data_path = download_cas_dataset(workdir, input_fmt)
+    if data_path is None:
         return
 
+    if build_cache or input_fmt == GEOJSON_KEY:
+        logger.info("build the dataset cache ...")
+        build_dataset_cache(data_path)
+
+    if build_cube:
+        logger.info("build the crash cube ...")
+        create_crash_cube(data_path, dimensions=cube_dimensions)
+
+    if fingerprint_years:
+        logger.info("fingerprint the rows of each year ...")
+        create_year_fingerprints(
+            data_path,
+            [
+                proc_columns
+                for proc_config in fingerprint_years
+                for proc_columns in get_cells_column_sets(read_config(proc_config))
+            ],
+        )
+
     logger.info("job done ...")
 
 
 def main():
     args = setup_parser()
 
-    preproc(args.workdir, args.input_fmt)
+    with run_report(args.workdir, "preproc", run_args=vars(args), profile=args.profile):
+        preproc(
+            args.workdir,
+            args.input_fmt,
+            build_cache=args.build_cache,
+            build_cube=args.build_cube,
+            cube_dimensions=args.cube_dimensions,
+            fingerprint_years=args.fingerprint_years,
+        )
 
 
 if __name__ == "__main__":
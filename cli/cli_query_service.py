@@ -0,0 +1,148 @@
+import argparse
+from os import makedirs
+
+from data_process import (SERVICE_CACHE_SIZE, SERVICE_HOST, SERVICE_PORT,
+                          WORKDIR)
+from data_process.instrument import run_report
+
+
+def get_example_usage():
+    example_text = """example:
+        * cli_query_service --data_src /tmp/cas_analysis_experiment/cas.csv
+                            [--port 8765]
+                            [--cache_size 1024]
+                            [--columns motorcycle bicycle speedLimit]
+          curl -d '{"field": "motorcycle", "constrains": {"speedLimit": 100}, "regions": ["Otago"],
+                    "years": {"start": 2010, "end": 2021}}' http://127.0.0.1:8765/query
+        """
+    return example_text
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser(
+        description="Answer the aggregate queries of the CAS dataset with a local HTTP/JSON service",
+        epilog=get_example_usage(),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--workdir",
+        required=False,
+        default=WORKDIR,
+        type=str,
+        help="Where the run report will be located (default: /tmp/cas_analysis/{unique_id})",
+    )
+
+    parser.add_argument(
+        "--data_src",
+        required=True,
+        type=str,
+        help="which dataset to be used, e.g., /tmp/tmp/cas_test/cas.csv",
+    )
+
+    parser.add_argument(
+        "--host",
+        required=False,
+        type=str,
+        default=SERVICE_HOST,
+        help="the host to bind (default: environmental variable SERVICE_HOST, or 127.0.0.1)",
+    )
+
+    parser.add_argument(
+        "--port",
+        required=False,
+        type=int,
+        default=SERVICE_PORT,
+        help="the port to bind (default: environmental variable SERVICE_PORT, or 8765)",
+    )
+
+    parser.add_argument(
+        "--cache_size",
+        required=False,
+        type=int,
+        default=SERVICE_CACHE_SIZE,
+        help="maximum number of the query results in the LRU cache "
+        "(default: environmental variable SERVICE_CACHE_SIZE, or 1024)",
+    )
+
+    parser.add_argument(
+        "--columns",
+        required=False,
+        nargs="+",
+        default=None,
+        help="only load these columns (region and crashYear are always loaded), "
+        "so the queries can only use them (default: all the columns)",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="sample the call stacks of the instrumented stages, and dump the profile of the slowest leaf stage "
+        "(a stage without nested stages) to the working directory (next to run_report.json)",
+    )
+
+    return parser.parse_args()
+
+
+def query_service(
+    workdir: str,
+    data_src: str,
+    host: str = SERVICE_HOST,
+    port: int = SERVICE_PORT,
+    cache_size: int = SERVICE_CACHE_SIZE,
+    columns: list or None = None,
+):
+    """Load the CAS dataset once, and answer the aggregate queries until the service is stopped (e.g., Ctrl+C)
+
+    Args:
+        workdir (str): where to run the codes
+        data_src (str): the dataset to be used
+        host (str, optional): the host to bind. Defaults to SERVICE_HOST.
+        port (int, optional): the port to bind. Defaults to SERVICE_PORT.
+        cache_size (int, optional): maximum number of the cached query results. Defaults to SERVICE_CACHE_SIZE.
+        columns (list or None, optional): only load these columns. Defaults to None (all the columns).
+    """
+    # the analysis modules (and their dependencies) are only imported when the task is run
+    from data_process import CRASH_YEAR_KEY, REGION_KEY
+    from data_process.service import create_query_server
+    from data_process.utils import read_dataset, setup_logging
+
+    logger = setup_logging()
+
+    makedirs(workdir, exist_ok=True)
+
+    logger.info("read dataset ...")
+    if columns is not None:
+        columns = list(dict.fromkeys([REGION_KEY, CRASH_YEAR_KEY] + columns))
+    data = read_dataset(data_src, use_cache=True, columns=columns)
+
+    server = create_query_server(data, host=host, port=port, cache_size=cache_size)
+
+    logger.info(f"serving {len(data)} rows at http://{server.server_address[0]}:{server.server_address[1]} ...")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("the service is stopped ...")
+    finally:
+        server.server_close()
+
+    logger.info("job done ...")
+
+
+def main():
+    args = setup_parser()
+
+    with run_report(args.workdir, "query_service", run_args=vars(args), profile=args.profile):
+        query_service(
+            args.workdir,
+            args.data_src,
+            host=args.host,
+            port=args.port,
+            cache_size=args.cache_size,
+            columns=args.columns,
+        )
+
+
+if __name__ == "__main__":
+    main()
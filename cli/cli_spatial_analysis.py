@@ -1,16 +1,21 @@
 import argparse
+from os import makedirs
+from os.path import join
 
-from data_process import (ANALYSIS_FILEDS_KEY, LATLON_KEY, POPULATION_KEY,
-                          REGION_KEY, WORKDIR)
-from data_process.spatial import create_spatial
-from data_process.utils import read_config, read_dataset, setup_logging
-from data_process.vis import plot_spatial
+from data_process import (ANALYSIS_FILEDS_KEY, CHUNK_SIZE, DASK_ENGINE_KEY,
+                          DISTRIBUTED_SCHEDULER_KEY, GROUPBY_ENGINE_KEY,
+                          LATLON_KEY, POPULATION_KEY, PROCESSES_SCHEDULER_KEY,
+                          RENDER_DIGEST_FILENAME, RENDER_WORKERS,
+                          SYNCHRONOUS_SCHEDULER_KEY, THREADS_SCHEDULER_KEY,
+                          WORKDIR)
+from data_process.instrument import run_report
 
 
 def get_example_usage():
     example_text = """example:
         * cli_temporal_analysis --data_src /tmp/cas_analysis_experiment
                                 [--config_file /tmp/temporal_analysis_exp1.yaml]
+                                [--engine dask --scheduler processes --num_workers 4]
         """
     return example_text
 
@@ -44,6 +49,81 @@ def setup_parser():
         help="the path for the configuration file [in YAML]",
     )
 
+    parser.add_argument(
+        "--chunksize",
+        required=False,
+        type=int,
+        default=CHUNK_SIZE,
+        help="if it is set, the dataset is streamed in chunks of this many rows (only the columns required "
+        "by the configuration are read), so the peak memory stays bounded (default: environmental variable CHUNK_SIZE)",
+    )
+
+    parser.add_argument(
+        "--engine",
+        required=False,
+        type=str,
+        default=GROUPBY_ENGINE_KEY,
+        choices={GROUPBY_ENGINE_KEY, DASK_ENGINE_KEY},
+        help="how the spatial data are computed: one grouped pass for each distinct set of constrains (groupby), "
+        "or one dask task for each field, region and year (dask) (default: groupby)",
+    )
+
+    parser.add_argument(
+        "--scheduler",
+        required=False,
+        type=str,
+        default=None,
+        choices={
+            SYNCHRONOUS_SCHEDULER_KEY,
+            THREADS_SCHEDULER_KEY,
+            PROCESSES_SCHEDULER_KEY,
+            DISTRIBUTED_SCHEDULER_KEY,
+        },
+        help="the dask scheduler used by the dask engine: synchronous, threads, processes (a local pool) "
+        "or distributed (a local cluster, requires dask distributed) "
+        "(default: scheduler in the configuration, or environmental variable DASK_SCHEDULER, or threads)",
+    )
+
+    parser.add_argument(
+        "--num_workers",
+        required=False,
+        type=int,
+        default=None,
+        help="number of workers of the dask scheduler "
+        "(default: num_workers in the configuration, or environmental variable DASK_WORKERS, or the number of CPUs)",
+    )
+
+    parser.add_argument(
+        "--render_workers",
+        required=False,
+        type=int,
+        default=RENDER_WORKERS,
+        help="number of processes used to render the figures (default: environmental variable RENDER_WORKERS, or 1)",
+    )
+
+    parser.add_argument(
+        "--use_store",
+        action="store_true",
+        help="keep the aggregated cells in a store in the working directory, so a new dataset only "
+        "re-aggregates the years which are changed, and only the changed figures are rendered again "
+        "(the sums are taken from the store, so --engine is not used)",
+    )
+
+    parser.add_argument(
+        "--use_memo",
+        action="store_true",
+        help="memoize the aggregated cells of the dataset on disk, so the cells shared with the other "
+        "experiments and runs are not computed again "
+        "(directory and size: environmental variables QUERY_MEMO_DIR and QUERY_MEMO_MAX_SIZE)",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="sample the call stacks of the instrumented stages, and dump the profile of the slowest leaf stage "
+        "(a stage without nested stages) to the working directory (next to run_report.json)",
+    )
+
     return parser.parse_args()
 
 
@@ -51,6 +131,13 @@ def spatial_analysis(
     workdir: str,
     data_src: str,
     config_file: list,
+    chunksize: int or None = CHUNK_SIZE,
+    render_workers: int = RENDER_WORKERS,
+    use_store: bool = False,
+    use_memo: bool = False,
+    engine: str = GROUPBY_ENGINE_KEY,
+    scheduler: str or None = None,
+    num_workers: int or None = None,
 ):
     """Producing spatial analysis (changes) based on the CAS dataset
 
@@ -58,17 +145,41 @@ def spatial_analysis(
         workdir (str): where to run the codes
         data_src (str): the dataset to be used
         data_keys (list): the keys to be used, e.g., crashDirectionDescription,bicycle
+        chunksize (int or None, optional): if it is set, the dataset is streamed in chunks. Defaults to CHUNK_SIZE.
+        render_workers (int, optional): number of rendering processes. Defaults to RENDER_WORKERS.
+        use_store (bool, optional): whether to use the aggregate store in the working directory. Defaults to False.
+        use_memo (bool, optional): whether to use the query memo of the dataset. Defaults to False.
+        engine (str, optional): the engine used to compute the spatial data. Defaults to groupby.
+        scheduler (str or None, optional): the dask scheduler, None for the configuration or DASK_SCHEDULER.
+            Defaults to None.
+        num_workers (int or None, optional): number of dask workers, None for the configuration or DASK_WORKERS.
+            Defaults to None.
     """
-    logger = setup_logging()
+    # the analysis modules (and their dependencies) are only imported when the task is run
+    from data_process.cube import read_crash_dataset
+    from data_process.memo import open_query_memo
+    from data_process.spatial import create_spatial
+    from data_process.store import update_aggregate_store
+    from data_process.utils import read_config, read_dataset, setup_logging
+    from data_process.vis import plot_spatial
 
-    logger.info("read raw dataset ...")
+    logger = setup_logging()
 
-    data = read_dataset(data_src)
+    makedirs(workdir, exist_ok=True)
 
     logger.info("read configs ...")
 
     cfg = read_config(config_file)
 
+    data = store = digest_path = None
+    if use_store:
+        logger.info("update the aggregate store ...")
+        store = update_aggregate_store(workdir, data_src, cfg, chunksize=chunksize)
+        digest_path = join(workdir, RENDER_DIGEST_FILENAME)
+    else:
+        logger.info("read raw dataset ...")
+        data = read_crash_dataset(data_src, cfg, chunksize=chunksize)
+
     logger.info("read lat and lon info ...")
     latlon = read_dataset(cfg[f"{LATLON_KEY}_data"])
 
@@ -78,14 +189,35 @@ def spatial_analysis(
         population_data = read_dataset(cfg[f"use_{POPULATION_KEY}_data"])
 
 
+    memo = None
+    if use_memo:
+        memo = open_query_memo(data_src)
+
     logger.info(f"{ANALYSIS_FILEDS_KEY} analysis")
 
     logger.info("spatial analysis ...")
 
-    spatial_data = create_spatial(data, population_data, cfg)
+    spatial_data = create_spatial(
+        data,
+        population_data,
+        cfg,
+        num_workers=num_workers,
+        store=store,
+        engine=engine,
+        scheduler=scheduler,
+        memo=memo,
+    )
 
     logger.info("temporal visualization ...")
-    plot_spatial(workdir, spatial_data, latlon, cfg["vis_scatter_factor"], cfg[f"use_{POPULATION_KEY}_data"])
+    plot_spatial(
+        workdir,
+        spatial_data,
+        latlon,
+        cfg["vis_scatter_factor"],
+        cfg[f"use_{POPULATION_KEY}_data"],
+        render_workers=render_workers,
+        digest_path=digest_path,
+    )
 
 
     logger.info(f"job done (data are created at {workdir})...")
@@ -94,7 +226,19 @@ def spatial_analysis(
 def main():
     args = setup_parser()
 
-    spatial_analysis(args.workdir, args.data_src, args.config_file)
+    with run_report(args.workdir, "spatial_analysis", run_args=vars(args), profile=args.profile):
+        spatial_analysis(
+            args.workdir,
+            args.data_src,
+            args.config_file,
+            chunksize=args.chunksize,
+            render_workers=args.render_workers,
+            use_store=args.use_store,
+            use_memo=args.use_memo,
+            engine=args.engine,
+            scheduler=args.scheduler,
+            num_workers=args.num_workers,
+        )
 
 
 if __name__ == "__main__":
@@ -1,10 +1,8 @@
 from logging import INFO
-from os import environ, makedirs
-from os.path import exists, join
+from os import cpu_count, environ
+from os.path import expanduser, join
 from uuid import uuid4
 
-from numpy import nan
-
 # --------------------------------
 # KEYS USED IN THE CODES
 # --------------------------------
@@ -26,6 +24,43 @@ RECORDS_KEY = "records"
 LAT_KEY = "lat"
 LON_KEY = "lon"
 FEATURES_KEY = "features"
+MODEL_KEY = "model"
+PROPERTIES_KEY = "properties"
+GEOMETRY_KEY = "geometry"
+COORDINATES_KEY = "coordinates"
+X_KEY = "X"
+Y_KEY = "Y"
+FINGERPRINT_KEY = "fingerprint"
+COLUMN_SETS_KEY = "column_sets"
+SOURCE_KEY = "source"
+ETAG_KEY = "etag"
+LAST_MODIFIED_KEY = "last_modified"
+CHECKSUM_KEY = "sha256"
+PARTIAL_KEY = "partial"
+GROUPBY_ENGINE_KEY = "groupby"
+DASK_ENGINE_KEY = "dask"
+SCHEDULER_KEY = "scheduler"
+NUM_WORKERS_KEY = "num_workers"
+SYNCHRONOUS_SCHEDULER_KEY = "synchronous"
+THREADS_SCHEDULER_KEY = "threads"
+PROCESSES_SCHEDULER_KEY = "processes"
+DISTRIBUTED_SCHEDULER_KEY = "distributed"
+DIMENSIONS_KEY = "dimensions"
+MEASURES_KEY = "measures"
+FIELD_KEY = "field"
+YEARS_KEY = "years"
+TEMPORAL_KEY = "temporal"
+SPATIAL_KEY = "spatial"
+FEATURE_KEY = "feature"
+FUNC_KEY = "func"
+DEPS_KEY = "deps"
+RENDER_KEY = "render"
+TREND_TOTAL_KEY = "total"
+EQUAL_CONSTRAIN_KEY = "=="
+IN_CONSTRAIN_KEY = "in"
+NOT_IN_CONSTRAIN_KEY = "not_in"
+IS_NULL_CONSTRAIN_KEY = "is_null"
+NOT_CONSTRAIN_KEY = "not"
 
 # --------------------------------
 # ENVIRONMENT VARIALBLES
@@ -42,25 +77,191 @@ DATA_API_SRC = {
     ),
 }
 LOGGER_LEVEL = environ.get("LOGGER_LEVEL", INFO)
+CHUNK_SIZE = environ.get("CHUNK_SIZE", None)
+RENDER_WORKERS = int(environ.get("RENDER_WORKERS", 1))
+RENDER_START_METHOD = environ.get("RENDER_START_METHOD", "spawn")
+MODEL_THREADS = int(environ.get("MODEL_THREADS", cpu_count() or 1))
+PIPELINE_WORKERS = int(environ.get("PIPELINE_WORKERS", cpu_count() or 1))
+DASK_SCHEDULER = environ.get("DASK_SCHEDULER", THREADS_SCHEDULER_KEY)
+DASK_WORKERS = int(environ.get("DASK_WORKERS", cpu_count() or 1))
+DASK_START_METHOD = environ.get("DASK_START_METHOD", "spawn")
+MAP_CACHE_DIR = environ.get("MAP_CACHE_DIR", join(expanduser("~"), ".cache", "cas_analysis", "map_cache"))
+SERVICE_HOST = environ.get("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(environ.get("SERVICE_PORT", 8765))
+SERVICE_CACHE_SIZE = int(environ.get("SERVICE_CACHE_SIZE", 1024))
+QUERY_MEMO_DIR = environ.get("QUERY_MEMO_DIR", join(expanduser("~"), ".cache", "cas_analysis", "query_memo"))
+QUERY_MEMO_MAX_SIZE = int(environ.get("QUERY_MEMO_MAX_SIZE", 64 * 1024 * 1024))
 
 # --------------------------------
 # CONSTANTS
 # --------------------------------
 TIMESERIES_FILENAME = "timeseries_{field_name}.png"
 SPATIAL_FILENAME = "spatial_{field_name}.png"
+TEMPORAL_TREND_FILENAME = "temporal_trend.csv"
 FEATURE_IMPORTANCE_FILENAME = "feature_importance_{field_name}.png"
 FEATURE_SHAP_FILENAME = "feature_shap_{field_name}.png"
+FEATURE_SHAP_VALUES_FILENAME = "feature_shap_{field_name}.npz"
+FEATURE_SHAP_SUMMARY_FILENAME = "feature_shap_summary_{field_name}.png"
+SHAP_BATCH_SIZE = 1024
+SHAP_MAX_PLOTS = 100
+MODEL_DIR = "models"
+FEATURE_MATRIX_DIR = "feature_matrices"
+FEATURE_MATRIX_FILENAME = "{field_name}_{matrix_name}.npy"
+MODEL_FILENAME = "xgb_{field_name}_{model_key}.json"
+MAP_CACHE_FILENAME = "basemap_{map_key}.npz"
+QUERY_MEMO_FILENAME = "query_{memo_key}.json"
+RENDER_BACKEND = "Agg"
+LOAD_STAGE = "load"
+QC_STAGE = "feature_qc"
+VIS_STAGE_SUFFIX = "_vis"
+YEAR_FINGERPRINT_FILENAME = "{data_name}.years.json"
+AGGREGATE_STORE_FILENAME = "aggregate_store.parquet"
+RENDER_DIGEST_FILENAME = "render_digests.json"
 POPULATION_MEASURE = "Census usually resident population count"
-if not exists(WORKDIR):
-    makedirs(WORKDIR)
+DATASET_CACHE_FILENAME = "{data_name}.parquet"
+DATASET_CACHE_META_FILENAME = "{data_name}.cache.json"
+FINGERPRINT_BLOCK_SIZE = 1024 * 1024
+CUBE_FILENAME = "{data_name}_cube.parquet"
+CUBE_META_FILENAME = "{data_name}_cube.json"
+DOWNLOAD_META_FILENAME = "{data_name}.download.json"
+DOWNLOAD_PART_SUFFIX = ".part"
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT = 60.0
+DOWNLOAD_BACKOFF = 0.5
+GEOJSON_BLOCK_SIZE = 1024 * 1024
+GEOJSON_BATCH_SIZE = 50000
+SYNTHETIC_CHUNK_SIZE = 1000000
+SYNTHETIC_MISSING_RATE = 0.02
+SYNTHETIC_FILENAME = "synthetic_{num_rows}_{seed}.csv"
+BENCHMARK_FILENAME = "benchmark.json"
+STARTUP_REPEATS = 3
+BENCHMARK_SCHEDULERS = [SYNCHRONOUS_SCHEDULER_KEY, THREADS_SCHEDULER_KEY, PROCESSES_SCHEDULER_KEY]
+STARTUP_COMMANDS = {
+    "import data_process": ["-c", "import data_process"],
+    "cli_preproc --help": ["-m", "cli.cli_preproc", "--help"],
+    "cli_temporal_analysis --help": ["-m", "cli.cli_temporal_analysis", "--help"],
+    "cli_spatial_analysis --help": ["-m", "cli.cli_spatial_analysis", "--help"],
+    "cli_feature_analysis --help": ["-m", "cli.cli_feature_analysis", "--help"],
+    "cli_pipeline --help": ["-m", "cli.cli_pipeline", "--help"],
+    "cli_query_service --help": ["-m", "cli.cli_query_service", "--help"],
+}
+RUN_REPORT_FILENAME = "run_report.json"
+PROFILE_FILENAME = "profile_{stage_name}.txt"
+PROFILE_INTERVAL = 0.01
+SERVICE_QUERY_PATH = "/query"
+SERVICE_STATS_PATH = "/stats"
+SERVICE_MAX_BODY_SIZE = 1024 * 1024
 
 MAP_CFG = {
+    "projection": "mill",
     "resolution": "i",
     "llcrnrlon": 165.0,
     "urcrnrlon": 180.0,
     "llcrnrlat": -48.0,
     "urcrnrlat": -33.0
 }
+# the line segments of the map background (see load_map)
+MAP_SEGMENTS = ["coastlines", "rivers"]
+
+# --------------------------------
+# CONSTRAINS (the comparison operators -> the pandas Series methods)
+# --------------------------------
+CONSTRAIN_COMPARISONS = {
+    EQUAL_CONSTRAIN_KEY: "eq",
+    "!=": "ne",
+    ">": "gt",
+    ">=": "ge",
+    "<": "lt",
+    "<=": "le",
+}
+
+# --------------------------------
+# AGGREGATE STORE (one row for each field, constrains, region and year)
+# --------------------------------
+AGGREGATE_STORE_COLUMNS = [FIELD_KEY, CONSTRAIN_KEY, REGION_KEY, CRASH_YEAR_KEY, VALUE_KEY, FINGERPRINT_KEY]
+
+# --------------------------------
+# CRASH CUBE
+# --------------------------------
+CUBE_DIMENSIONS = ["speedLimit", "urban", "weatherA", "light"]
+CUBE_MEASURES = [
+    "bicycle",
+    "bus",
+    "carStationWagon",
+    "moped",
+    "motorcycle",
+    "otherVehicleType",
+    "pedestrian",
+    "schoolBus",
+    "suv",
+    "taxi",
+    "train",
+    "truck",
+    "unknownVehicleType",
+    "vanOrUtility",
+    "vehicle",
+    "fatalCount",
+    "seriousInjuryCount",
+    "minorInjuryCount",
+]
+
+# --------------------------------
+# SYNTHETIC DATASET (the share of the crashes in each region, and the mean count of each measure)
+# --------------------------------
+SYNTHETIC_REGIONS = {
+    "Auckland": 0.33,
+    "Waikato": 0.11,
+    "Canterbury": 0.11,
+    "Wellington": 0.09,
+    "Bay of Plenty": 0.07,
+    "Manawatū-Whanganui": 0.05,
+    "Otago": 0.05,
+    "Northland": 0.04,
+    "Hawke's Bay": 0.035,
+    "Taranaki": 0.025,
+    "Southland": 0.02,
+    "Nelson": 0.015,
+    "Tasman": 0.015,
+    "Marlborough": 0.01,
+    "West Coast": 0.01,
+    "Gisborne": 0.01,
+}
+SYNTHETIC_YEARS = list(range(2000, 2022))
+SYNTHETIC_SPEED_LIMITS = [30, 50, 60, 70, 80, 100, 110]
+SYNTHETIC_MEASURE_RATES = {
+    "bicycle": 0.04,
+    "bus": 0.03,
+    "carStationWagon": 1.1,
+    "moped": 0.01,
+    "motorcycle": 0.06,
+    "otherVehicleType": 0.01,
+    "pedestrian": 0.05,
+    "schoolBus": 0.003,
+    "suv": 0.35,
+    "taxi": 0.02,
+    "train": 0.001,
+    "truck": 0.12,
+    "unknownVehicleType": 0.02,
+    "vanOrUtility": 0.25,
+    "vehicle": 0.05,
+    "fatalCount": 0.01,
+    "seriousInjuryCount": 0.06,
+    "minorInjuryCount": 0.35,
+}
+
+# --------------------------------
+# FEATURE MODEL (can be overwritten by "model" in the feature analysis configuration)
+# --------------------------------
+XGB_CFG = {
+    "max_depth": 75,
+    "eta": 0.1,
+    "subsample": 0.5,
+    "objective": "reg:squarederror",
+    "tree_method": "hist",
+    "n_estimators": 100,
+    "early_stopping_rounds": 10,
+    "random_state": 1,
+}
 
 # --------------------------------
 # FEATURE DIGITIZATION
@@ -0,0 +1,181 @@
+from json import dumps as json_dumps
+from logging import getLogger
+
+from numpy import array, ones
+from pandas import MultiIndex, Series
+from pandas.core.frame import DataFrame
+
+from data_process import (CONSTRAIN_COMPARISONS, CONSTRAIN_KEY,
+                          CRASH_YEAR_KEY, FIELD_KEY, IN_CONSTRAIN_KEY,
+                          IS_NULL_CONSTRAIN_KEY, NOT_CONSTRAIN_KEY,
+                          NOT_IN_CONSTRAIN_KEY, QUERY_KEY, REGION_KEY,
+                          VALUE_KEY)
+
+logger = getLogger()
+
+
+def get_region_name(proc_region: str) -> str:
+    """Get the region name used in the CAS dataset, e.g., Auckland -> Auckland Region
+
+    Args:
+        proc_region (str): region name used in the configuration
+
+    Returns:
+        str: region name used in the CAS dataset
+    """
+    return proc_region + " " + REGION_KEY.capitalize()
+
+
+def get_constrain_key(constrains: list) -> str:
+    """Get a canonical key for a set of constrains, so the fields
+    sharing the same constrains can be grouped together
+
+    Args:
+        constrains (list): constrains from get_query_keys, e.g., [{"speedLimit": 100}]
+
+    Returns:
+        str: the canonical key of the constrains
+    """
+    return json_dumps(
+        sorted(constrains, key=lambda proc_constrain: list(proc_constrain.keys())[0]), sort_keys=True, default=str
+    )
+
+
+def get_column_mask(column: Series, constrain_value) -> array:
+    """Evaluate the constrain of a column (see get_constrain_value) on all of its rows at once
+
+    Args:
+        column (Series): the column of the dataset
+        constrain_value (object): the canonical constrain, e.g., {">=": 80, "<": 100}
+
+    Returns:
+        array: the boolean mask of the rows which meet the constrain
+    """
+    if constrain_value is None:
+        return column.isna().to_numpy()
+
+    if not isinstance(constrain_value, dict):
+        return column.eq(constrain_value).to_numpy(dtype=bool, na_value=False)
+
+    mask = ones(len(column), dtype=bool)
+    for proc_operator, proc_operand in constrain_value.items():
+        if proc_operator == NOT_CONSTRAIN_KEY:
+            mask &= ~get_column_mask(column, proc_operand)
+        elif proc_operator == IS_NULL_CONSTRAIN_KEY:
+            mask &= column.isna().to_numpy() == proc_operand
+        else:
+            if proc_operator == IN_CONSTRAIN_KEY:
+                proc_mask = column.isin(proc_operand)
+            elif proc_operator == NOT_IN_CONSTRAIN_KEY:
+                proc_mask = ~column.isin(proc_operand)
+            else:
+                proc_mask = getattr(column, CONSTRAIN_COMPARISONS[proc_operator])(proc_operand)
+            # the missing values never meet a comparison
+            mask &= proc_mask.to_numpy(dtype=bool, na_value=False) & column.notna().to_numpy()
+
+    return mask
+
+
+def get_constrain_mask(data: DataFrame, constrains: list) -> array:
+    """Compile the constrains into one boolean mask of the rows, the columns are
+    compared in place (no filtered copies of the dataset are created)
+
+    Args:
+        data (DataFrame): CAS dataset (or the crash cube)
+        constrains (list): constrains from get_query_keys, e.g., [{"speedLimit": {">=": 80}}]
+
+    Returns:
+        array: the boolean mask of the rows which meet all the constrains
+    """
+    mask = ones(len(data), dtype=bool)
+    for proc_constrain in constrains:
+        for constrain_name, constrain_value in proc_constrain.items():
+            mask &= get_column_mask(data[constrain_name], constrain_value)
+
+    return mask
+
+
+def group_fields_by_constrains(fields_to_query: dict) -> dict:
+    """Group the fields to be queried by their constrains
+
+    Args:
+        fields_to_query (dict): {field_name: query keys from get_query_keys}
+
+    Returns:
+        dict: {constrain_key: {"constrains": [...], "fields": {field_name: query_field}}}
+    """
+    grouped_fields = {}
+    for field_name in fields_to_query:
+        proc_fields_to_query = fields_to_query[field_name]
+        constrain_key = get_constrain_key(proc_fields_to_query[CONSTRAIN_KEY])
+
+        if constrain_key not in grouped_fields:
+            grouped_fields[constrain_key] = {CONSTRAIN_KEY: proc_fields_to_query[CONSTRAIN_KEY], "fields": {}}
+
+        grouped_fields[constrain_key]["fields"][field_name] = proc_fields_to_query[QUERY_KEY][0]
+
+    return grouped_fields
+
+
+def aggregate_region_year(data: DataFrame, query_fields: list, constrains: list, regions: list, years: list) -> dict:
+    """Sum the query fields for every region and year in a single grouped pass
+
+    Args:
+        data (DataFrame): CAS dataset
+        query_fields (list): fields to be summed, e.g., ["bicycle", "truck"]
+        constrains (list): constrains shared by all query fields, e.g., [{"speedLimit": 100}]
+        regions (list): regions to be aggregated (names used in the configuration)
+        years (list): years to be aggregated
+
+    Returns:
+        dict: {query_field: 2d array (region x year)}
+    """
+    region_names = [get_region_name(proc_region) for proc_region in regions]
+
+    mask = get_constrain_mask(data, constrains)
+    mask &= data[CRASH_YEAR_KEY].isin(years).to_numpy()
+    mask &= data[REGION_KEY].isin(region_names).to_numpy()
+
+    query_fields = list(dict.fromkeys(query_fields))
+    grouped_data = (
+        data.loc[mask, query_fields + [REGION_KEY, CRASH_YEAR_KEY]]
+        .groupby([REGION_KEY, CRASH_YEAR_KEY], observed=True)[query_fields]
+        .sum()
+        .reindex(MultiIndex.from_product([region_names, years]), fill_value=0)
+    )
+
+    return {
+        proc_field: grouped_data[proc_field].to_numpy().reshape(len(regions), len(years))
+        for proc_field in query_fields
+    }
+
+
+def aggregate_region_year_from_store(
+    store: DataFrame, query_fields: list, constrains: list, regions: list, years: list
+) -> dict:
+    """Get the sums of the query fields for every region and year from the aggregate store,
+    it returns the same outputs as aggregate_region_year
+
+    Args:
+        store (DataFrame): the aggregate store (from update_aggregate_store)
+        query_fields (list): fields to be summed, e.g., ["bicycle", "truck"]
+        constrains (list): constrains shared by all query fields, e.g., [{"speedLimit": 100}]
+        regions (list): regions to be aggregated (names used in the configuration)
+        years (list): years to be aggregated
+
+    Returns:
+        dict: {query_field: 2d array (region x year)}
+    """
+    query_fields = list(dict.fromkeys(query_fields))
+
+    proc_store = store[store[CONSTRAIN_KEY] == get_constrain_key(constrains)].set_index(
+        [FIELD_KEY, REGION_KEY, CRASH_YEAR_KEY]
+    )[VALUE_KEY]
+    proc_values = proc_store.reindex(MultiIndex.from_product([query_fields, regions, years]))
+
+    if proc_values.isna().any():
+        raise Exception(f"the aggregate store does not contain all the cells of {query_fields}")
+
+    proc_values = proc_values.to_numpy().reshape(len(query_fields), len(regions), len(years))
+
+    return {proc_field: proc_values[i] for i, proc_field in enumerate(query_fields)}
@@ -0,0 +1,386 @@
+from datetime import datetime, timezone
+from json import dump as json_dump
+from json import load as json_load
+from logging import getLogger
+from os import cpu_count, replace, wait4
+from os.path import dirname, join
+from platform import platform, python_version
+from subprocess import DEVNULL, CalledProcessError, Popen, check_output
+from sys import executable
+from tempfile import TemporaryDirectory
+from time import perf_counter, process_time
+from tracemalloc import get_traced_memory, reset_peak
+from tracemalloc import start as tracemalloc_start
+from tracemalloc import stop as tracemalloc_stop
+
+from pandas.core.frame import DataFrame
+
+from data_process import (BENCHMARK_SCHEDULERS, DASK_ENGINE_KEY, DASK_WORKERS,
+                          FEATURES_KEY, LATLON_KEY, MAP_CFG, MODEL_THREADS,
+                          POPULATION_KEY, RENDER_WORKERS, SHAP_MAX_PLOTS,
+                          STARTUP_COMMANDS, STARTUP_REPEATS)
+from data_process.feature import (data_qc, extract_feature_dataset,
+                                  get_model_cfg, get_shap_render_jobs,
+                                  obtain_shap_values, split_training_test_data,
+                                  train_model)
+from data_process.render import render_figures
+from data_process.spatial import create_spatial
+from data_process.temporal import create_time_series, obtain_temporal_trend
+from data_process.utils import (build_dataset_cache, get_feature_columns,
+                                get_query_columns, read_dataset)
+from data_process.vis import _MAP_MEMO, load_map, plot_spatial, temporal_vis
+
+logger = getLogger()
+
+
+def measure_stage(stage_name: str, stage_func, *args, **kwargs) -> tuple:
+    """Run one stage and measure its wall time, CPU time and the peak memory traced by tracemalloc
+    (the memory allocated by Python and numpy, but not by the native libraries, e.g., xgboost)
+
+    Args:
+        stage_name (str): stage name
+        stage_func (function): the function of the stage
+
+    Returns:
+        tuple: the output of the stage, and the benchmark record of the stage
+    """
+    tracemalloc_start()
+    reset_peak()
+    start_wall_time = perf_counter()
+    start_cpu_time = process_time()
+
+    try:
+        stage_output = stage_func(*args, **kwargs)
+        stage_record = {
+            "stage": stage_name,
+            "wall_time": perf_counter() - start_wall_time,
+            "cpu_time": process_time() - start_cpu_time,
+            "peak_memory": get_traced_memory()[1],
+        }
+    finally:
+        tracemalloc_stop()
+
+    logger.info(
+        f"benchmark {stage_name}: {stage_record['wall_time']:.3f} s (CPU {stage_record['cpu_time']:.3f} s), "
+        f"peak memory {stage_record['peak_memory'] / 1024**2:.1f} MB ..."
+    )
+
+    return stage_output, stage_record
+
+
+def run_benchmark(
+    work_dir: str,
+    data_path: str,
+    temporal_cfg: dict,
+    spatial_cfg: dict,
+    feature_cfg: dict,
+    model_threads: int = MODEL_THREADS,
+    render_workers: int = RENDER_WORKERS,
+    max_shap_plots: int or None = SHAP_MAX_PLOTS,
+    schedulers: list = BENCHMARK_SCHEDULERS,
+    num_workers: int = DASK_WORKERS,
+) -> list:
+    """Benchmark all the stages of the analysis on one dataset: reading the dataset,
+    the temporal and spatial aggregations, the feature extraction and QC, the model
+    fitting, the SHAP values, the rendering and the map cache, and the timeseries and the spatial data
+    computed by the dask engine with each scheduler
+
+    Args:
+        work_dir (str): working directory, the outputs of the stages are written to
+            a temporary directory in it (and removed after the benchmark)
+        data_path (str): the dataset to be used
+        temporal_cfg (dict): temporal analysis configuration
+        spatial_cfg (dict): spatial analysis configuration
+        feature_cfg (dict): feature analysis configuration (only its first field is benchmarked)
+        model_threads (int, optional): number of threads used by the model. Defaults to MODEL_THREADS.
+        render_workers (int, optional): number of rendering processes. Defaults to RENDER_WORKERS.
+        max_shap_plots (int or None, optional): maximum number of the SHAP force plots. Defaults to SHAP_MAX_PLOTS.
+        schedulers (list, optional): the dask schedulers to be compared. Defaults to BENCHMARK_SCHEDULERS.
+        num_workers (int, optional): number of workers of the dask schedulers. Defaults to DASK_WORKERS.
+
+    Returns:
+        list: the benchmark record of each stage
+    """
+    columns = list(
+        dict.fromkeys(
+            get_query_columns(temporal_cfg) + get_query_columns(spatial_cfg) + get_feature_columns(feature_cfg)
+        )
+    )
+
+    population_data = None
+    if spatial_cfg[f"use_{POPULATION_KEY}_data"] is not None:
+        population_data = read_dataset(spatial_cfg[f"use_{POPULATION_KEY}_data"])
+    latlon = read_dataset(spatial_cfg[f"{LATLON_KEY}_data"])
+
+    proc_field = list(feature_cfg[FEATURES_KEY])[0]
+
+    records = []
+    with TemporaryDirectory(dir=work_dir) as run_dir:
+        data, proc_record = measure_stage("read_dataset", read_dataset, data_path, columns=columns)
+        records.append(proc_record)
+
+        _, proc_record = measure_stage("build_dataset_cache", build_dataset_cache, data_path)
+        records.append(proc_record)
+
+        data, proc_record = measure_stage(
+            "read_dataset_cache", read_dataset, data_path, use_cache=True, columns=columns
+        )
+        records.append(proc_record)
+
+        timeseries_data, proc_record = measure_stage("create_time_series", create_time_series, data, temporal_cfg)
+        records.append(proc_record)
+
+        trend_table, proc_record = measure_stage(
+            "obtain_temporal_trend", obtain_temporal_trend, timeseries_data, temporal_cfg
+        )
+        records.append(proc_record)
+
+        spatial_data, proc_record = measure_stage("create_spatial", create_spatial, data, population_data, spatial_cfg)
+        records.append(proc_record)
+
+        for proc_scheduler in schedulers:
+            _, proc_record = measure_stage(
+                f"create_time_series_dask_{proc_scheduler}",
+                create_time_series,
+                data,
+                temporal_cfg,
+                num_workers=num_workers,
+                engine=DASK_ENGINE_KEY,
+                scheduler=proc_scheduler,
+            )
+            records.append(proc_record)
+
+            _, proc_record = measure_stage(
+                f"create_spatial_dask_{proc_scheduler}",
+                create_spatial,
+                data,
+                population_data,
+                spatial_cfg,
+                num_workers=num_workers,
+                engine=DASK_ENGINE_KEY,
+                scheduler=proc_scheduler,
+            )
+            records.append(proc_record)
+
+        _, proc_record = measure_stage(
+            "data_qc", data_qc, data, [proc_field] + list(feature_cfg[FEATURES_KEY][proc_field])
+        )
+        records.append(proc_record)
+
+        feature_dataset, proc_record = measure_stage(
+            "extract_feature_dataset", extract_feature_dataset, data, feature_cfg
+        )
+        records.append(proc_record)
+
+        xy = split_training_test_data(feature_dataset[proc_field]["x"], feature_dataset[proc_field]["y"])
+        features_name = feature_dataset[proc_field]["features"]
+
+        model, proc_record = measure_stage(
+            "train_model",
+            train_model,
+            run_dir,
+            proc_field,
+            xy,
+            features_name,
+            get_model_cfg(feature_cfg),
+            n_jobs=model_threads,
+        )
+        records.append(proc_record)
+
+        shap_outputs, proc_record = measure_stage(
+            "obtain_shap_values", obtain_shap_values, run_dir, proc_field, model, xy, features_name, render_workers=None
+        )
+        records.append(proc_record)
+
+        _, proc_record = measure_stage(
+            "render_temporal",
+            temporal_vis,
+            run_dir,
+            temporal_cfg,
+            timeseries_data,
+            trend_table=trend_table,
+            render_workers=render_workers,
+        )
+        records.append(proc_record)
+
+        _, proc_record = measure_stage(
+            "render_spatial",
+            plot_spatial,
+            run_dir,
+            spatial_data,
+            latlon,
+            spatial_cfg["vis_scatter_factor"],
+            spatial_cfg[f"use_{POPULATION_KEY}_data"],
+            render_workers=render_workers,
+        )
+        records.append(proc_record)
+
+        _, proc_record = measure_stage(
+            "render_shap",
+            render_figures,
+            get_shap_render_jobs(run_dir, proc_field, shap_outputs, features_name, max_shap_plots=max_shap_plots),
+            num_workers=render_workers,
+        )
+        records.append(proc_record)
+
+        # the map background is built in an empty cache, then loaded from the disk and from the memory
+        map_cache_dir = join(run_dir, "map_cache")
+        for stage_name in ["map_cache_build", "map_cache_disk", "map_cache_memory"]:
+            if stage_name != "map_cache_memory":
+                _MAP_MEMO.clear()
+            _, proc_record = measure_stage(stage_name, load_map, MAP_CFG, cache_dir=map_cache_dir)
+            records.append(proc_record)
+
+    return records
+
+
+def measure_startup(commands: dict = STARTUP_COMMANDS, repeats: int = STARTUP_REPEATS) -> list:
+    """Measure the startup time of the package and the CLIs, each command is run
+    (from the root of the package) in a new Python process for repeats times and the fastest run is kept,
+    the peak memory is not recorded since the peak RSS of a child process includes the RSS of this process
+
+    Args:
+        commands (dict, optional): {command name: arguments of the Python interpreter}. Defaults to STARTUP_COMMANDS.
+        repeats (int, optional): number of runs of each command. Defaults to STARTUP_REPEATS.
+
+    Returns:
+        list: the benchmark record of each command (the stage is "startup <command name>")
+    """
+    records = []
+    for command_name, command_args in commands.items():
+        command_records = []
+        for _ in range(repeats):
+            start_wall_time = perf_counter()
+            proc = Popen([executable] + command_args, cwd=dirname(dirname(__file__)), stdout=DEVNULL, stderr=DEVNULL)
+            _, exit_status, proc_usage = wait4(proc.pid, 0)
+            proc.returncode = exit_status
+            if exit_status != 0:
+                raise Exception(f"the startup command {command_name} failed ({exit_status})")
+            command_records.append(
+                {
+                    "stage": f"startup {command_name}",
+                    "wall_time": perf_counter() - start_wall_time,
+                    "cpu_time": proc_usage.ru_utime + proc_usage.ru_stime,
+                    "peak_memory": None,
+                }
+            )
+
+        records.append(min(command_records, key=lambda proc_record: proc_record["wall_time"]))
+        logger.info(f"benchmark {records[-1]['stage']}: {records[-1]['wall_time']:.3f} s ...")
+
+    return records
+
+
+def get_git_commit() -> str or None:
+    """Get the git commit of the package
+
+    Returns:
+        str or None: the git commit, None if it is not in a git repository
+    """
+    try:
+        return check_output(["git", "rev-parse", "HEAD"], cwd=dirname(__file__), stderr=DEVNULL, text=True).strip()
+    except (CalledProcessError, OSError):
+        return None
+
+
+def get_benchmark_meta() -> dict:
+    """Get the metadata of the benchmark, so the results from different versions
+    (and environments) can be compared
+
+    Returns:
+        dict: the metadata
+    """
+    from matplotlib import __version__ as matplotlib_version
+    from numpy import __version__ as numpy_version
+    from pandas import __version__ as pandas_version
+    from shap import __version__ as shap_version
+    from xgboost import __version__ as xgboost_version
+
+    return {
+        "git_commit": get_git_commit(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": python_version(),
+        "platform": platform(),
+        "cpu_count": cpu_count(),
+        "packages": {
+            "numpy": numpy_version,
+            "pandas": pandas_version,
+            "xgboost": xgboost_version,
+            "shap": shap_version,
+            "matplotlib": matplotlib_version,
+        },
+    }
+
+
+def write_benchmark(benchmark_path: str, runs: list, startup: list or None = None) -> str:
+    """Write the benchmark results to a JSON file
+
+    Args:
+        benchmark_path (str): the path of the benchmark results
+        runs (list): the benchmark runs, e.g., [{"num_rows": 10000, "stages": [records from run_benchmark]}]
+        startup (list or None, optional): the startup records from measure_startup. Defaults to None.
+
+    Returns:
+        str: the path of the benchmark results
+    """
+    benchmark = {"meta": get_benchmark_meta(), "runs": runs}
+    if startup is not None:
+        benchmark["startup"] = startup
+
+    with open(benchmark_path + ".tmp", "w") as fid:
+        json_dump(benchmark, fid, indent=2)
+    replace(benchmark_path + ".tmp", benchmark_path)
+
+    return benchmark_path
+
+
+def load_benchmark_table(benchmark_path: str) -> DataFrame:
+    """Load the benchmark results as a table
+
+    Args:
+        benchmark_path (str): the path of the benchmark results
+
+    Returns:
+        DataFrame: one row for each run and stage (and one row for each startup command, without num_rows)
+    """
+    with open(benchmark_path) as fid:
+        benchmark = json_load(fid)
+
+    return DataFrame(
+        [
+            {"num_rows": proc_run["num_rows"], **proc_record}
+            for proc_run in benchmark["runs"]
+            for proc_record in proc_run["stages"]
+        ]
+        + [{"num_rows": None, **proc_record} for proc_record in benchmark.get("startup", [])]
+    )
+
+
+def compare_benchmarks(baseline_path: str, benchmark_path: str) -> DataFrame:
+    """Compare the benchmark results with the baseline (e.g., from the previous version)
+
+    Args:
+        baseline_path (str): the path of the baseline benchmark results
+        benchmark_path (str): the path of the benchmark results
+
+    Returns:
+        DataFrame: the wall time and the peak memory of each run and stage, and their ratios to the baseline
+    """
+    compared = load_benchmark_table(baseline_path).merge(
+        load_benchmark_table(benchmark_path), on=["num_rows", "stage"], suffixes=("_baseline", "")
+    )
+    for proc_key in ["wall_time", "peak_memory"]:
+        compared[f"{proc_key}_ratio"] = compared[proc_key] / compared[f"{proc_key}_baseline"]
+
+    return compared[
+        [
+            "num_rows",
+            "stage",
+            "wall_time_baseline",
+            "wall_time",
+            "wall_time_ratio",
+            "peak_memory_baseline",
+            "peak_memory",
+            "peak_memory_ratio",
+        ]
+    ]
@@ -0,0 +1,207 @@
+from json import dump as json_dump
+from json import load as json_load
+from logging import getLogger
+from os.path import basename, dirname, exists, join, splitext
+
+from pandas import read_parquet
+from pandas.core.frame import DataFrame
+
+from data_process import (ANALYSIS_FILEDS_KEY, CRASH_YEAR_KEY,
+                          CUBE_DIMENSIONS, CUBE_FILENAME, CUBE_MEASURES,
+                          CUBE_META_FILENAME, DIMENSIONS_KEY, FINGERPRINT_KEY,
+                          MEASURES_KEY, QUERY_KEY, REGION_KEY, SOURCE_KEY,
+                          YEAR_KEY)
+from data_process.aggregate import get_region_name
+from data_process.instrument import instrument
+from data_process.utils import (aggregate_dataset, get_file_fingerprint,
+                                get_query_columns, get_query_keys,
+                                read_dataset)
+
+logger = getLogger()
+
+
+def get_crash_cube_paths(data_path: str) -> dict:
+    """Get the paths of the crash cube (and its metadata) for a dataset,
+    the cube is stored next to the dataset, e.g., cas.csv -> cas_cube.parquet
+
+    Args:
+        data_path (str): the dataset path
+
+    Returns:
+        dict: the paths for the cube data and the cube metadata
+    """
+    data_name = splitext(basename(data_path))[0]
+    return {
+        "data": join(dirname(data_path), CUBE_FILENAME.format(data_name=data_name)),
+        "meta": join(dirname(data_path), CUBE_META_FILENAME.format(data_name=data_name)),
+    }
+
+
+def build_crash_cube(data: DataFrame, dimensions: list = CUBE_DIMENSIONS, measures: list = CUBE_MEASURES) -> DataFrame:
+    """Pre-aggregate the CAS dataset to a cube keyed by region, crashYear and the
+    categorical dimensions, holding the sums of the measures (e.g., vehicle counts).
+
+    The cube keeps the column names of the dataset, so it can be used in place of the
+    dataset by any query which only sums measures with constrains on the dimensions.
+
+    Args:
+        data (DataFrame): CAS dataset
+        dimensions (list, optional): categorical dimensions, e.g., speedLimit. Defaults to CUBE_DIMENSIONS.
+        measures (list, optional): columns to be summed, e.g., bicycle. Defaults to CUBE_MEASURES.
+
+    Returns:
+        DataFrame: the crash cube
+    """
+    dimensions = [proc_dimension for proc_dimension in dimensions if proc_dimension in data.columns]
+    measures = [proc_measure for proc_measure in measures if proc_measure in data.columns]
+
+    cube_keys = [REGION_KEY, CRASH_YEAR_KEY] + dimensions
+
+    # rows with missing dimensions are kept, so the queries without constrains are still complete
+    return aggregate_dataset(data[cube_keys + measures], cube_keys)
+
+
+def write_crash_cube(data_path: str, cube: DataFrame, measures: list) -> str:
+    """Write the crash cube next to the dataset
+
+    Args:
+        data_path (str): the dataset path the cube is built from
+        cube (DataFrame): the crash cube from build_crash_cube
+        measures (list): the measures used to build the cube
+
+    Returns:
+        str: the path of the cube
+    """
+    cube_paths = get_crash_cube_paths(data_path)
+
+    cube.to_parquet(cube_paths["data"], index=False)
+
+    with open(cube_paths["meta"], "w") as fout:
+        json_dump(
+            {
+                FINGERPRINT_KEY: get_file_fingerprint(data_path),
+                SOURCE_KEY: data_path,
+                DIMENSIONS_KEY: [proc_col for proc_col in cube.columns if proc_col not in measures],
+                MEASURES_KEY: [proc_col for proc_col in cube.columns if proc_col in measures],
+            },
+            fout,
+        )
+
+    return cube_paths["data"]
+
+
+def create_crash_cube(data_path: str, dimensions: list = CUBE_DIMENSIONS, measures: list = CUBE_MEASURES) -> str:
+    """Build the crash cube from a dataset and store it next to the dataset
+
+    Args:
+        data_path (str): the dataset path
+        dimensions (list, optional): categorical dimensions. Defaults to CUBE_DIMENSIONS.
+        measures (list, optional): columns to be summed. Defaults to CUBE_MEASURES.
+
+    Returns:
+        str: the path of the cube
+    """
+    cube = build_crash_cube(read_dataset(data_path, use_cache=True), dimensions=dimensions, measures=measures)
+
+    logger.info(f"crash cube is created with {len(cube)} cells ...")
+
+    return write_crash_cube(data_path, cube, measures)
+
+
+def cube_can_answer(cube_meta: dict, cfg: dict) -> bool:
+    """Check if the crash cube can answer all the analysis fields in a configuration,
+    e.g., the queried field must be a measure and the constrains must be dimensions
+
+    Args:
+        cube_meta (dict): the cube metadata
+        cfg (dict): analysis configuration
+
+    Returns:
+        bool: whether the cube can be used
+    """
+    for field_name in cfg[ANALYSIS_FILEDS_KEY]:
+        query_keys = get_query_keys(cfg[ANALYSIS_FILEDS_KEY][field_name])[QUERY_KEY]
+
+        if query_keys[0] not in cube_meta[MEASURES_KEY]:
+            return False
+
+        if not set(query_keys[1:]).issubset(cube_meta[DIMENSIONS_KEY]):
+            return False
+
+    return True
+
+
+def load_crash_cube(data_path: str, cfg: dict) -> DataFrame or None:
+    """Load the crash cube for a dataset
+
+    Args:
+        data_path (str): the dataset path the cube is built from
+        cfg (dict): analysis configuration, e.g., the queries to be answered by the cube
+
+    Returns:
+        DataFrame or None: the crash cube, or None if the cube is missing, outdated
+            or not able to answer the queries
+    """
+    cube_paths = get_crash_cube_paths(data_path)
+
+    if not (exists(cube_paths["data"]) and exists(cube_paths["meta"])):
+        return None
+
+    with open(cube_paths["meta"], "r") as fin:
+        cube_meta = json_load(fin)
+
+    if cube_meta[FINGERPRINT_KEY] != get_file_fingerprint(data_path):
+        logger.info(f"the crash cube for {data_path} is outdated ...")
+        return None
+
+    if not cube_can_answer(cube_meta, cfg):
+        logger.info("the crash cube is not able to answer the analysis fields ...")
+        return None
+
+    return read_parquet(cube_paths["data"])
+
+
+@instrument("read_crash_dataset", rows=lambda inputs, output: len(output))
+def read_crash_dataset(data_path: str, cfg: dict, chunksize: int or None = None) -> DataFrame:
+    """Read the data for the temporal/spatial analysis: the crash cube is used if it
+    is able to answer all the analysis fields, otherwise only the columns, regions and years
+    required by the configuration are read (and aggregated) from the dataset
+
+    Args:
+        data_path (str): the dataset path
+        cfg (dict): analysis configuration
+        chunksize (int or None, optional): if it is defined, the dataset is streamed in chunks. Defaults to None.
+
+    Returns:
+        DataFrame: the crash cube or the dataset
+    """
+    data = load_crash_cube(data_path, cfg)
+
+    if data is not None:
+        logger.info("the analysis fields are answered from the crash cube ...")
+        return data
+
+    query_columns = get_query_columns(cfg)
+
+    constrain_columns = [REGION_KEY, CRASH_YEAR_KEY]
+    for field_name in cfg[ANALYSIS_FILEDS_KEY]:
+        constrain_columns.extend(get_query_keys(cfg[ANALYSIS_FILEDS_KEY][field_name])[QUERY_KEY][3:])
+    constrain_columns = list(dict.fromkeys(constrain_columns))
+
+    # the rows can only be aggregated if none of the queried fields is used as a constrain
+    aggregate_by = constrain_columns
+    for field_name in cfg[ANALYSIS_FILEDS_KEY]:
+        if get_query_keys(cfg[ANALYSIS_FILEDS_KEY][field_name])[QUERY_KEY][0] in constrain_columns:
+            aggregate_by = None
+
+    return read_dataset(
+        data_path,
+        use_cache=True,
+        columns=query_columns,
+        chunksize=chunksize,
+        filters={
+            CRASH_YEAR_KEY: cfg[YEAR_KEY],
+            REGION_KEY: [get_region_name(proc_region) for proc_region in cfg[REGION_KEY]],
+        },
+        aggregate_by=aggregate_by,
+    )
@@ -1,17 +1,30 @@
+from hashlib import sha256
+from http.client import HTTPException, IncompleteRead
+from json import dump as json_dump
+from json import load as json_load
 from logging import getLogger
-from os import makedirs
-from os.path import exists, join
+from os import makedirs, remove, replace
+from os.path import exists, getsize, join
 from shutil import copyfile
-from urllib.error import URLError
-from urllib.request import urlretrieve
+from time import sleep
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
 
-from data_process import CAS_KEY, DATA_API_SRC
+from data_process import (CAS_KEY, CHECKSUM_KEY, DATA_API_SRC,
+                          DOWNLOAD_BACKOFF, DOWNLOAD_CHUNK_SIZE,
+                          DOWNLOAD_META_FILENAME, DOWNLOAD_PART_SUFFIX,
+                          DOWNLOAD_TIMEOUT, ETAG_KEY, LAST_MODIFIED_KEY,
+                          PARTIAL_KEY, SOURCE_KEY)
 
 logger = getLogger()
 
 
 def download_cas_dataset(
-    workdir: str, input_fmt: str, overwrite_api_src: str or None = None, max_tries: int = 3
+    workdir: str,
+    input_fmt: str,
+    overwrite_api_src: str or None = None,
+    max_tries: int = 3,
+    backoff_factor: float = DOWNLOAD_BACKOFF,
 ) -> str or None:
     """Check and download CAS dataset from NZTA open data server
 
@@ -20,6 +33,8 @@ def download_cas_dataset(
         input_fmt (str): the input data format, e.g., csv
         overwrite_api_src (str or None, optional): if it is defined, the API data source will be read from here
         max_tries (int, optional): If we need to download the data from internet, how many times maximum we want to try. Defaults to 3.
+        backoff_factor (float, optional): the waiting time before the n-th retry is backoff_factor * 2 ** (n - 1) seconds.
+            Defaults to DOWNLOAD_BACKOFF.
 
     Returns:
         str or None: the downloaded dataset path, or None if the download fails
@@ -32,7 +47,7 @@ def download_cas_dataset(
     data_destination = join(workdir, f"{CAS_KEY}.{input_fmt}")
 
     # if the data_source is downloaded, there is no need to download it again
-    if not data_source.startswith("https"):
+    if not data_source.startswith(("https://", "http://")):
         if not exists(data_destination):
             copyfile(data_source, data_destination)
         logger.info("The requested file exists ...")
@@ -42,13 +57,175 @@ def download_cas_dataset(
     tried_times = 0
     while tried_times <= max_tries:
         try:
-            urlretrieve(data_source, data_destination)
+            download_file(data_source, data_destination)
             return data_destination
-        except URLError:
+        except (URLError, HTTPException, OSError) as download_error:
             tried_times += 1
-            pass
+            logger.warning(f"download attempt {tried_times} failed: {download_error}")
+            if tried_times <= max_tries:
+                sleep(backoff_factor * 2 ** (tried_times - 1))
 
     logger.error(
         f"Failed to download file from {data_source} after {max_tries} tries, check the data_source URL ..."
     )
     return None
+
+
+def get_download_meta_path(data_destination: str) -> str:
+    """Get the path of the download metadata (the validators and checksum of the download)
+
+    Args:
+        data_destination (str): the downloaded file, e.g., /tmp/cas_analysis/cas.csv
+
+    Returns:
+        str: the path of the download metadata, e.g., /tmp/cas_analysis/cas.csv.download.json
+    """
+    return DOWNLOAD_META_FILENAME.format(data_name=data_destination)
+
+
+def read_download_meta(data_destination: str) -> dict:
+    """Read the download metadata
+
+    Args:
+        data_destination (str): the downloaded file
+
+    Returns:
+        dict: the download metadata (empty if there is no download metadata)
+    """
+    download_meta_path = get_download_meta_path(data_destination)
+
+    if not exists(download_meta_path):
+        return {}
+
+    with open(download_meta_path, "r") as fin:
+        return json_load(fin)
+
+
+def write_download_meta(data_destination: str, download_meta: dict):
+    """Write the download metadata (the metadata is replaced atomically)
+
+    Args:
+        data_destination (str): the downloaded file
+        download_meta (dict): the download metadata
+    """
+    download_meta_path = get_download_meta_path(data_destination)
+
+    with open(download_meta_path + DOWNLOAD_PART_SUFFIX, "w") as fout:
+        json_dump(download_meta, fout)
+
+    replace(download_meta_path + DOWNLOAD_PART_SUFFIX, download_meta_path)
+
+
+def get_file_checksum(file_path: str) -> str:
+    """Get the sha256 checksum of a file
+
+    Args:
+        file_path (str): the file to be checked
+
+    Returns:
+        str: the checksum
+    """
+    hasher = sha256()
+    with open(file_path, "rb") as fin:
+        for proc_block in iter(lambda: fin.read(DOWNLOAD_CHUNK_SIZE), b""):
+            hasher.update(proc_block)
+
+    return hasher.hexdigest()
+
+
+def download_file(data_source: str, data_destination: str, timeout: float = DOWNLOAD_TIMEOUT) -> bool:
+    """Download a file with a streaming HTTP request:
+        - the data is streamed to a temporary file, which is renamed to the destination once it is complete
+        - an interrupted transfer is resumed from the temporary file with a HTTP Range request
+        - the file is only downloaded again if it is changed on the server (ETag/Last-Modified)
+        - the sha256 checksum of the file is kept with the validators in the download metadata
+
+    Args:
+        data_source (str): the URL to be downloaded
+        data_destination (str): where to save the file
+        timeout (float, optional): timeout for the HTTP connection. Defaults to DOWNLOAD_TIMEOUT.
+
+    Returns:
+        bool: True if a new file is downloaded, False if the existing file is still up to date
+    """
+    download_meta = read_download_meta(data_destination)
+    data_part = data_destination + DOWNLOAD_PART_SUFFIX
+
+    headers = {}
+
+    # conditional request: only when the existing file is the one described by the metadata
+    if (
+        download_meta.get(SOURCE_KEY) == data_source
+        and exists(data_destination)
+        and download_meta.get(CHECKSUM_KEY) == get_file_checksum(data_destination)
+    ):
+        if download_meta.get(ETAG_KEY):
+            headers["If-None-Match"] = download_meta[ETAG_KEY]
+        if download_meta.get(LAST_MODIFIED_KEY):
+            headers["If-Modified-Since"] = download_meta[LAST_MODIFIED_KEY]
+
+    # resume request: only when the partial file is from the same version of the source
+    partial_meta = download_meta.get(PARTIAL_KEY, {})
+    partial_size = 0
+    if exists(data_part) and partial_meta.get(SOURCE_KEY) == data_source:
+        partial_validator = partial_meta.get(ETAG_KEY) or partial_meta.get(LAST_MODIFIED_KEY)
+        if partial_validator:
+            partial_size = getsize(data_part)
+            headers["Range"] = f"bytes={partial_size}-"
+            headers["If-Range"] = partial_validator
+
+    try:
+        response = urlopen(Request(data_source, headers=headers), timeout=timeout)
+    except HTTPError as http_error:
+        if http_error.code == 304:
+            logger.info("The requested file is not modified on the server ...")
+            return False
+        if http_error.code == 416:
+            # the partial file is not valid for the source anymore
+            remove(data_part)
+        raise
+
+    with response:
+        if response.status != 206:
+            partial_size = 0
+
+        download_meta[PARTIAL_KEY] = {
+            SOURCE_KEY: data_source,
+            ETAG_KEY: response.headers.get("ETag"),
+            LAST_MODIFIED_KEY: response.headers.get("Last-Modified"),
+        }
+        write_download_meta(data_destination, download_meta)
+
+        expected_size = response.headers.get("Content-Length")
+        expected_size = None if expected_size is None else partial_size + int(expected_size)
+
+        hasher = sha256()
+        if partial_size > 0:
+            logger.info(f"resume the download from {partial_size} bytes ...")
+            with open(data_part, "rb") as fin:
+                for proc_block in iter(lambda: fin.read(DOWNLOAD_CHUNK_SIZE), b""):
+                    hasher.update(proc_block)
+
+        received_size = partial_size
+        with open(data_part, "ab" if partial_size > 0 else "wb") as fout:
+            for proc_block in iter(lambda: response.read(DOWNLOAD_CHUNK_SIZE), b""):
+                fout.write(proc_block)
+                hasher.update(proc_block)
+                received_size += len(proc_block)
+
+    if expected_size is not None and received_size < expected_size:
+        raise IncompleteRead(b"", expected_size - received_size)
+
+    replace(data_part, data_destination)
+
+    write_download_meta(
+        data_destination,
+        {
+            SOURCE_KEY: data_source,
+            ETAG_KEY: download_meta[PARTIAL_KEY][ETAG_KEY],
+            LAST_MODIFIED_KEY: download_meta[PARTIAL_KEY][LAST_MODIFIED_KEY],
+            CHECKSUM_KEY: hasher.hexdigest(),
+        },
+    )
+
+    return True
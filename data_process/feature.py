@@ -1,17 +1,32 @@
 
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b
+from json import dumps as json_dumps
 from logging import getLogger
-from os.path import join
-
-from matplotlib.pyplot import close, savefig
-from numpy import array, asarray, isnan, nan, ones, where
+from os import makedirs, replace
+from os.path import dirname, exists, join
+from typing import TYPE_CHECKING
+
+from numpy import (append, arange, array, ascontiguousarray, asarray, empty,
+                   float32, isin, isnan, load, logical_and, nan, ones, save,
+                   savez_compressed, where)
+from pandas import CategoricalDtype, Index, Series, to_numeric
 from pandas.core.frame import DataFrame
-from shap import Explainer, KernelExplainer, summary_plot
-from shap.plots import force as shap_force_plot
-from sklearn.model_selection import train_test_split
-from xgboost import XGBRegressor, plot_importance
 
-from data_process import (FEATURE_IMPORTANCE_FILENAME, FEATURE_SHAP_FILENAME,
-                          FEATURES_KEY, MISSING_DATA, STR2DIGIT_MAPPING)
+from data_process import (FEATURE_IMPORTANCE_FILENAME, FEATURE_MATRIX_DIR,
+                          FEATURE_MATRIX_FILENAME, FEATURE_SHAP_FILENAME,
+                          FEATURE_SHAP_SUMMARY_FILENAME,
+                          FEATURE_SHAP_VALUES_FILENAME, FEATURES_KEY,
+                          MISSING_DATA, MODEL_DIR, MODEL_FILENAME, MODEL_KEY,
+                          MODEL_THREADS, RENDER_WORKERS, SHAP_BATCH_SIZE,
+                          SHAP_MAX_PLOTS, STR2DIGIT_MAPPING, XGB_CFG)
+from data_process.instrument import inherit_stages, instrument
+from data_process.render import render_figures
+from data_process.utils import get_feature_columns
+from data_process.vis import plot_shap_force, plot_shap_summary
+
+if TYPE_CHECKING:
+    from xgboost import XGBRegressor
 
 logger = getLogger()
 
@@ -25,6 +40,9 @@ def obtain_importance(work_dir: str, proc_field: str, model, feature_dataset: di
         xy (dict): xy dataset
         feature_dataset (dict): processed feature dataset
     """
+    from matplotlib.pyplot import savefig
+    from xgboost import plot_importance
+
     logger.info("processing importance ...")
 
     model.get_booster().feature_names = feature_dataset[proc_field]["features"]
@@ -32,7 +50,76 @@ def obtain_importance(work_dir: str, proc_field: str, model, feature_dataset: di
     savefig(join(work_dir, FEATURE_IMPORTANCE_FILENAME.format(field_name=proc_field)), bbox_inches="tight")
 
 
-def obtain_shap_values(work_dir: str, proc_field: str, model, xy: dict, features_name: list, crash_index = [1,3,5]):
+def select_shap_index(xy: dict, proc_type: str = "training", weather_codes: list = [2.0, 3.0]) -> array:
+    """Select the rows to be explained: the crashes (y > 1) happened with the
+    weather codes in weather_codes (the weather is the last feature)
+
+    Args:
+        xy (dict): xy dataset
+        proc_type (str, optional): training or test. Defaults to "training".
+        weather_codes (list, optional): weather codes to be selected. Defaults to [2.0, 3.0].
+
+    Returns:
+        array: the index of the selected rows
+    """
+    split_index = xy[proc_type]["index"]
+    return where((xy["y"][split_index] > 1.0) & isin(xy["x"][split_index, -1], weather_codes))[0]
+
+
+def compute_shap_values(model, x: array, batch_size: int = SHAP_BATCH_SIZE) -> dict:
+    """Compute SHAP values in batches, so all the rows are explained with a bounded memory
+
+    Args:
+        model ([type]): training model
+        x (array): the rows to be explained
+        batch_size (int, optional): number of rows in each batch. Defaults to SHAP_BATCH_SIZE.
+
+    Returns:
+        dict: SHAP values and base values for each row
+    """
+    from shap import Explainer
+
+    explainer = Explainer(model)
+
+    shap_values = empty(x.shape, dtype=float32)
+    base_values = empty(x.shape[0], dtype=float32)
+
+    for start_index in range(0, x.shape[0], batch_size):
+        end_index = min(start_index + batch_size, x.shape[0])
+        proc_explanation = explainer(x[start_index:end_index])
+        shap_values[start_index:end_index] = proc_explanation.values
+        base_values[start_index:end_index] = proc_explanation.base_values
+
+    return {"values": shap_values, "base_values": base_values}
+
+
+def load_shap_values(work_dir: str, proc_field: str) -> dict:
+    """Load the SHAP values saved by obtain_shap_values
+
+    Args:
+        work_dir (str): working directory
+        proc_field (str): field to be studied
+
+    Returns:
+        dict: SHAP values, base values, data, the row index and the feature names
+    """
+    with load(join(work_dir, FEATURE_SHAP_VALUES_FILENAME.format(field_name=proc_field))) as fin:
+        return {proc_key: fin[proc_key] for proc_key in fin.files}
+
+
+@instrument("obtain_shap_values", field="proc_field", rows=lambda inputs, output: len(output["index"]))
+def obtain_shap_values(
+    work_dir: str,
+    proc_field: str,
+    model,
+    xy: dict,
+    features_name: list,
+    crash_index=[1, 3, 5],
+    batch_size: int = SHAP_BATCH_SIZE,
+    max_shap_plots: int or None = SHAP_MAX_PLOTS,
+    shap_summary: bool = False,
+    render_workers: int = RENDER_WORKERS,
+) -> dict:
     """Obtain SHAP values
 
     Args:
@@ -42,85 +129,385 @@ def obtain_shap_values(work_dir: str, proc_field: str, model, xy: dict, features
         xy (dict): [description]
         features_name (list): [description]
         crash_index (list, optional): [description]. Defaults to [1,3,5].
+        batch_size (int, optional): number of rows in each SHAP batch. Defaults to SHAP_BATCH_SIZE.
+        max_shap_plots (int or None, optional): maximum number of the force plots (one for each row),
+            None for all the rows. Defaults to SHAP_MAX_PLOTS.
+        shap_summary (bool, optional): render one summary plot for all the rows instead of the force plots. Defaults to False.
+        render_workers (int or None, optional): number of rendering processes, None to skip the rendering
+            (e.g., the plots are rendered later with get_shap_render_jobs). Defaults to RENDER_WORKERS.
+
+    Returns:
+        dict: SHAP values, base values, data, the row index and the feature names
     """
     proc_type = "training"
 
-    all_index = []
-    for i in range(len(xy[proc_type]["y"])):
-        proc_weather = xy[proc_type]["x"][i][-1]
-        proc_crash = xy[proc_type]["y"][i]
-
-        if i == 113609:
-            x = 3
-
-        if proc_crash > 1.0 and (proc_weather == 2.0 or proc_weather == 3.0):
-            all_index.append(i)
-
-    explainer = Explainer(model)
+    all_index = select_shap_index(xy, proc_type=proc_type)
 
-    len_index = len(all_index)
+    logger.info(f"total data to be plotted: {len(all_index)}")
 
-    logger.info(f"total data to be plotted: {len_index}")
+    shap_data = xy["x"][xy[proc_type]["index"][all_index]]
+    shap_outputs = compute_shap_values(model, shap_data, batch_size=batch_size)
+    shap_outputs.update({"data": shap_data, "index": all_index, "features": asarray(features_name)})
 
-    for i in all_index:
+    savez_compressed(join(work_dir, FEATURE_SHAP_VALUES_FILENAME.format(field_name=proc_field)), **shap_outputs)
 
-        shap_values = explainer(asarray([xy[proc_type]["x"][i]]))
+    if render_workers is not None:
+        render_figures(
+            get_shap_render_jobs(
+                work_dir, proc_field, shap_outputs, features_name, max_shap_plots=max_shap_plots, shap_summary=shap_summary
+            ),
+            num_workers=render_workers,
+        )
 
-        shap_force_plot(shap_values[0], show=False, matplotlib=True, feature_names=features_name)
+    return shap_outputs
 
-        savefig(join(work_dir, FEATURE_SHAP_FILENAME.format(field_name=proc_field + f"_{i}")), bbox_inches="tight")
 
-        close()
+def get_shap_render_jobs(
+    work_dir: str,
+    proc_field: str,
+    shap_outputs: dict,
+    features_name: list,
+    max_shap_plots: int or None = SHAP_MAX_PLOTS,
+    shap_summary: bool = False,
+) -> list:
+    """Get the jobs to render the SHAP plots
 
+    Args:
+        work_dir (str): working directory
+        proc_field (str): field to be studied
+        shap_outputs (dict): SHAP values, base values, data and the row index (from obtain_shap_values)
+        features_name (list): feature names
+        max_shap_plots (int or None, optional): maximum number of the force plots (one for each row),
+            None for all the rows. Defaults to SHAP_MAX_PLOTS.
+        shap_summary (bool, optional): render one summary plot for all the rows instead of the force plots. Defaults to False.
 
-def get_weight(xy: dict) -> array:
+    Returns:
+        list: the render jobs for render_figures
+    """
+    all_index = shap_outputs["index"]
+    shap_data = shap_outputs["data"]
+
+    if shap_summary:
+        render_jobs = [
+            (
+                plot_shap_summary,
+                {
+                    "filename": join(work_dir, FEATURE_SHAP_SUMMARY_FILENAME.format(field_name=proc_field)),
+                    "shap_values": shap_outputs["values"],
+                    "data": shap_data,
+                    "feature_names": features_name,
+                },
+            )
+        ]
+    else:
+        plot_index = all_index if max_shap_plots is None else all_index[:max_shap_plots]
+        if len(plot_index) < len(all_index):
+            logger.info(f"only the first {len(plot_index)} force plots are rendered ...")
+
+        render_jobs = [
+            (
+                plot_shap_force,
+                {
+                    "filename": join(work_dir, FEATURE_SHAP_FILENAME.format(field_name=proc_field + f"_{i}")),
+                    "base_value": shap_outputs["base_values"][j],
+                    "shap_values": shap_outputs["values"][j],
+                    "data": shap_data[j],
+                    "feature_names": features_name,
+                },
+            )
+            for j, i in enumerate(plot_index)
+        ]
+
+    return render_jobs
+
+
+def get_weight(xy: dict, proc_type: str = "training") -> array:
     """Get training weights
 
     Args:
         xy (dict): xy dataset
+        proc_type (str, optional): training or test. Defaults to "training".
 
     Returns:
         array: weights for training
     """
-    y_data = xy["training"]["y"]
+    y_data = get_split_data(xy, proc_type, "y")
     weight = ones(y_data.shape)
     weight[y_data > 0.0] = 3.0
     return weight
 
 
-def create_feature_analysis(work_dir: str, data: DataFrame, cfg: dict) -> dict:
+def get_model_cfg(cfg: dict) -> dict:
+    """Get the model hyperparameters, XGB_CFG updated by "model" in the configuration
 
-    feature_dataset = extract_feature_dataset(data, cfg)
+    Args:
+        cfg (dict): feature analysis configuration
 
-    for proc_field in cfg[FEATURES_KEY]:
+    Returns:
+        dict: the model hyperparameters
+    """
+    model_cfg = dict(XGB_CFG)
+    model_cfg.update(cfg.get(MODEL_KEY) or {})
+    return model_cfg
 
-        logger.info(f"feature analysis {proc_field}")
 
-        xy = split_training_test_data(feature_dataset[proc_field]["x"], feature_dataset[proc_field]["y"])
+def get_model_key(xy: dict, features_name: list, model_cfg: dict) -> str:
+    """Get the key of a model, which is made from the training/test data,
+    the feature list and the hyperparameters
 
-        model = XGBRegressor(max_depth=75, eta=0.1, subsample=0.5, objective="reg:squarederror", verbose=1)
+    Args:
+        xy (dict): xy dataset
+        features_name (list): feature names
+        model_cfg (dict): model hyperparameters
 
-        model.fit(
-            xy["training"]["x"],
-            xy["training"]["y"],
-            sample_weight=get_weight(xy)
-        )
+    Returns:
+        str: the model key
+    """
+    hasher = blake2b(digest_size=16)
+    # the buffers are hashed in place (the memory-mapped matrices are not loaded to the memory at once)
+    hasher.update(ascontiguousarray(xy["x"]))
+    hasher.update(ascontiguousarray(xy["y"]))
+    for proc_type in ["training", "test"]:
+        hasher.update(ascontiguousarray(xy[proc_type]["index"]))
+    hasher.update(json_dumps({FEATURES_KEY: features_name, MODEL_KEY: model_cfg}, sort_keys=True).encode())
+
+    return hasher.hexdigest()
+
+
+@instrument("train_model", field="proc_field", rows=lambda inputs, output: len(inputs["xy"]["training"]["index"]))
+def train_model(
+    work_dir: str, proc_field: str, xy: dict, features_name: list, model_cfg: dict, n_jobs: int = MODEL_THREADS
+) -> "XGBRegressor":
+    """Train the model with early stopping on the test dataset, the trained model is saved
+    in the working directory and it is loaded (instead of training again) if the data,
+    features and hyperparameters are not changed
+
+    Args:
+        work_dir (str): working directory
+        proc_field (str): field to be studied
+        xy (dict): xy dataset
+        features_name (list): feature names
+        model_cfg (dict): model hyperparameters
+        n_jobs (int, optional): number of threads used by the model. Defaults to MODEL_THREADS.
+
+    Returns:
+        XGBRegressor: the trained model
+    """
+    from xgboost import XGBRegressor
+
+    model_path = join(
+        work_dir,
+        MODEL_DIR,
+        MODEL_FILENAME.format(field_name=proc_field, model_key=get_model_key(xy, features_name, model_cfg)),
+    )
+
+    model = XGBRegressor(n_jobs=n_jobs, **model_cfg)
+
+    if exists(model_path):
+        logger.info(f"loading the trained model from {model_path} ...")
+        model.load_model(model_path)
+        return model
+
+    model.fit(
+        get_split_data(xy, "training", "x"),
+        get_split_data(xy, "training", "y"),
+        sample_weight=get_weight(xy),
+        eval_set=[(get_split_data(xy, "test", "x"), get_split_data(xy, "test", "y"))],
+        sample_weight_eval_set=[get_weight(xy, proc_type="test")],
+        verbose=False,
+    )
+
+    # best_iteration is only defined when early stopping is used, otherwise all n_estimators trees are kept
+    if model.early_stopping_rounds is not None:
+        num_trees = model.best_iteration + 1
+    else:
+        num_trees = model.get_booster().num_boosted_rounds()
+    logger.info(f"model is trained with {num_trees} trees, saved to {model_path} ...")
+
+    makedirs(dirname(model_path), exist_ok=True)
+    model.save_model(model_path)
+
+    return model
+
+
+def analyse_feature_field(
+    work_dir: str,
+    proc_field: str,
+    proc_dataset: dict,
+    model_cfg: dict,
+    n_jobs: int = MODEL_THREADS,
+    max_shap_plots: int or None = SHAP_MAX_PLOTS,
+    shap_summary: bool = False,
+) -> list:
+    """Train and explain the model for one field, the plots are not rendered here
+    (so the function can be run in a thread)
+
+    Args:
+        work_dir (str): working directory
+        proc_field (str): field to be studied
+        proc_dataset (dict): the dataset of the field (from extract_feature_dataset)
+        model_cfg (dict): model hyperparameters
+        n_jobs (int, optional): number of threads used by the model. Defaults to MODEL_THREADS.
+        max_shap_plots (int or None, optional): maximum number of the SHAP force plots. Defaults to SHAP_MAX_PLOTS.
+        shap_summary (bool, optional): render one SHAP summary plot instead of the force plots. Defaults to False.
+
+    Returns:
+        list: the render jobs of the SHAP plots
+    """
+    logger.info(f"feature analysis {proc_field}")
+
+    xy = split_training_test_data(proc_dataset["x"], proc_dataset["y"])
+
+    model = train_model(work_dir, proc_field, xy, proc_dataset["features"], model_cfg, n_jobs=n_jobs)
+
+    # obtain_importance(work_dir, proc_field, model, feature_dataset)
+
+    shap_outputs = obtain_shap_values(work_dir, proc_field, model, xy, proc_dataset["features"], render_workers=None)
+
+    return get_shap_render_jobs(
+        work_dir,
+        proc_field,
+        shap_outputs,
+        proc_dataset["features"],
+        max_shap_plots=max_shap_plots,
+        shap_summary=shap_summary,
+    )
+
+
+def create_feature_analysis(
+    work_dir: str,
+    data: DataFrame,
+    cfg: dict,
+    max_shap_plots: int or None = SHAP_MAX_PLOTS,
+    shap_summary: bool = False,
+    render_workers: int or None = RENDER_WORKERS,
+    n_jobs: int = MODEL_THREADS,
+    field_workers: int or None = None,
+    encoded_features: dict or None = None,
+) -> list:
+    """Create feature analysis (training and SHAP explanation) for each field, the fields are
+    trained and explained concurrently in a pool of field_workers threads, and the thread
+    budget n_jobs is shared by the models, the plots are rendered after all the fields are done
+
+    Args:
+        work_dir (str): working directory
+        data (DataFrame): CAS dataset
+        cfg (dict): feature analysis configuration
+        max_shap_plots (int or None, optional): maximum number of the SHAP force plots for each field. Defaults to SHAP_MAX_PLOTS.
+        shap_summary (bool, optional): render one SHAP summary plot instead of the force plots. Defaults to False.
+        render_workers (int or None, optional): number of rendering processes, None to skip the rendering
+            (the render jobs are returned). Defaults to RENDER_WORKERS.
+        n_jobs (int, optional): total number of threads used by the models. Defaults to MODEL_THREADS.
+        field_workers (int or None, optional): number of fields analysed at the same time,
+            None for min(number of fields, n_jobs). Defaults to None.
+        encoded_features (dict or None, optional): the encoded features (from encode_features),
+            they are encoded from data if None. Defaults to None.
+
+    Returns:
+        list: the render jobs of the SHAP plots
+    """
+
+    feature_dataset = extract_feature_dataset(
+        data, cfg, encoded_features=encoded_features, feature_dir=join(work_dir, FEATURE_MATRIX_DIR)
+    )
+
+    model_cfg = get_model_cfg(cfg)
+
+    if field_workers is None:
+        field_workers = min(len(feature_dataset), n_jobs)
+    field_workers = max(1, min(field_workers, len(feature_dataset)))
+    model_threads = max(1, n_jobs // field_workers)
+
+    logger.info(f"analysing {len(feature_dataset)} fields with {field_workers} workers ({model_threads} threads each) ...")
 
+    with ThreadPoolExecutor(max_workers=field_workers) as field_pool:
+        field_tasks = [
+            field_pool.submit(
+                inherit_stages(analyse_feature_field),
+                work_dir,
+                proc_field,
+                feature_dataset[proc_field],
+                model_cfg,
+                n_jobs=model_threads,
+                max_shap_plots=max_shap_plots,
+                shap_summary=shap_summary,
+            )
+            for proc_field in feature_dataset
+        ]
 
-        # obtain_importance(work_dir, proc_field, model, feature_dataset)
+        render_jobs = []
+        for proc_task in field_tasks:
+            render_jobs.extend(proc_task.result())
 
-        obtain_shap_values(work_dir, proc_field, model, xy, feature_dataset[proc_field]["features"])
+    if render_workers is not None:
+        render_figures(render_jobs, num_workers=render_workers)
 
+    return render_jobs
 
+
+def write_feature_matrix(matrix_path: str, matrix: array) -> str:
+    """Write a feature matrix to a .npy file, which can be attached with attach_feature_matrix
+
+    Args:
+        matrix_path (str): the path of the .npy file
+        matrix (array): the feature matrix
+
+    Returns:
+        str: the path of the .npy file
+    """
+    makedirs(dirname(matrix_path), exist_ok=True)
+    with open(matrix_path + ".tmp", "wb") as fid:
+        save(fid, matrix)
+    replace(matrix_path + ".tmp", matrix_path)
+
+    return matrix_path
+
+
+def attach_feature_matrix(matrix_path: str) -> array:
+    """Attach a feature matrix (from write_feature_matrix) as a read-only memory map, the matrix is
+    not copied to the memory of the process, and its pages are shared by all the processes attaching it
+
+    Args:
+        matrix_path (str): the path of the .npy file
+
+    Returns:
+        array: the memory-mapped feature matrix
+    """
+    return load(matrix_path, mmap_mode="r")
+
+
+def attach_feature_dataset(proc_dataset: dict) -> dict:
+    """Attach the feature matrices of a field dataset from their paths, e.g., in a worker process
+    (the paths are sent to the worker instead of the matrices, so the matrices are not pickled)
+
+    Args:
+        proc_dataset (dict): the dataset of the field (from extract_feature_dataset with feature_dir)
+
+    Returns:
+        dict: the dataset of the field with the memory-mapped x and y
+    """
+    return {
+        **proc_dataset,
+        **{matrix_name: attach_feature_matrix(matrix_path) for matrix_name, matrix_path in proc_dataset["paths"].items()},
+    }
+
+
+@instrument("extract_feature_dataset", rows=lambda inputs, output: len(inputs["data"]))
 def extract_feature_dataset(
-    data: DataFrame, cfg: dict,
+    data: DataFrame, cfg: dict, encoded_features: dict or None = None, feature_dir: str or None = None,
 ) -> int:
-    """extract dataset based on required keys
+    """extract dataset based on required keys, each feature is encoded only once
+    and shared by all the fields
 
     Args:
         df (DataFrame): cas dataset (in Dataframe) to be used
         cfg (DataFrame): feature analysis configuration
         data_field (str): fields to be queried, e.g., suv
+        encoded_features (dict or None, optional): the encoded features (from encode_features),
+            the features which are not in it are encoded from data. Defaults to None.
+        feature_dir (str or None, optional): if it is set, x and y of each field are written to .npy files
+            in it and they are returned as read-only memory maps (their paths are also returned, see
+            attach_feature_dataset), otherwise they are kept in the memory. Defaults to None.
 
     Returns:
         dict: the dict contains the required dataset
@@ -128,52 +515,161 @@ def extract_feature_dataset(
 
     output = {}
 
+    features_to_apply = {
+        proc_field: [proc_field] + list(cfg[FEATURES_KEY][proc_field]) for proc_field in cfg[FEATURES_KEY]
+    }
+
+    encoded_features = encode_features(data, get_feature_columns(cfg), encoded_features=encoded_features)
+
     for proc_field in cfg[FEATURES_KEY]:
 
-        features_to_apply = [proc_field]
+        data_qc_controlled, qc_report = combine_encoded_features(encoded_features, features_to_apply[proc_field])
 
-        proc_cfg = cfg[FEATURES_KEY][proc_field]
+        logger.info(f"data QC for {proc_field}: {qc_report}")
 
-        for proc_constrain in proc_cfg:
+        # data_qc_controlled[data_qc_controlled[:, 0] >= 1.0, 0] = 1.0
 
-            features_to_apply.append(proc_constrain)
-        
-        data_qc_controlled = data_qc(data[features_to_apply], features_to_apply)
-        data_qc_controlled = data_qc_controlled.to_numpy()
+        output[proc_field] = {
+            "features": features_to_apply[proc_field][1:],
+            "qc_report": qc_report,
+        }
 
-        y_qc_controlled = data_qc_controlled[:, 0]
-        # y_qc_controlled[y_qc_controlled >= 1.0] = 1.0
+        if feature_dir is None:
+            output[proc_field].update(
+                {"y": data_qc_controlled[:, 0].copy(), "x": ascontiguousarray(data_qc_controlled[:, 1:])}
+            )
+            continue
 
-        output[proc_field] = {"y": y_qc_controlled, "x": data_qc_controlled[:,1:], "features": features_to_apply[1:]}
+        # y and x are written (in chunks) from the columns of the QC controlled dataset, which is then released
+        output[proc_field]["paths"] = {
+            matrix_name: write_feature_matrix(
+                join(feature_dir, FEATURE_MATRIX_FILENAME.format(field_name=proc_field, matrix_name=matrix_name)),
+                matrix,
+            )
+            for matrix_name, matrix in [("y", data_qc_controlled[:, 0]), ("x", data_qc_controlled[:, 1:])]
+        }
+        output[proc_field] = attach_feature_dataset(output[proc_field])
 
     return output
 
-def data_qc(data_to_be_processed: DataFrame, features_to_check: list) -> DataFrame:
-    """Data quality control
+@instrument("encode_features", rows=lambda inputs, output: len(inputs["data"]))
+def encode_features(data: DataFrame, features: list, encoded_features: dict or None = None) -> dict:
+    """Encode the features (with encode_feature), the features which have been encoded are reused
+
+    Args:
+        data (DataFrame): cas dataset
+        features (list): features to be encoded
+        encoded_features (dict or None, optional): the features which have been encoded. Defaults to None.
+
+    Returns:
+        dict: the encoded features, the keys are the feature names
+    """
+    encoded_features = dict(encoded_features or {})
+    for proc_feature in features:
+        if proc_feature not in encoded_features:
+            encoded_features[proc_feature] = encode_feature(data[proc_feature], proc_feature)
+
+    return encoded_features
+
+
+def encode_feature(feature_data: Series, proc_feature: str) -> dict:
+    """Encode a feature to float32 values, the string features (in STR2DIGIT_MAPPING)
+    are converted to their digits via the categorical codes
+
+    Args:
+        feature_data (Series): the feature to be encoded
+        proc_feature (str): the feature name, e.g., weatherA
+
+    Returns:
+        dict: the encoded values, the validity mask, and the number of rows failed by each QC rule
+    """
+    missing_values = MISSING_DATA.get(proc_feature, [])
+    nan_mask = feature_data.isna().to_numpy()
+
+    if proc_feature in STR2DIGIT_MAPPING:
+        proc_mapping = STR2DIGIT_MAPPING[proc_feature]
+        category_index = Index(list(proc_mapping.keys()))
+        if isinstance(feature_data.dtype, CategoricalDtype):
+            # only the categories are looked up, and the rows are mapped through their codes
+            feature_codes = append(category_index.get_indexer(feature_data.cat.categories), -1)[
+                feature_data.cat.codes.to_numpy()
+            ]
+        else:
+            feature_codes = category_index.get_indexer(feature_data)
+        # the digit of each category, the last element (-1) is used for the values not in the mapping
+        feature_digits = asarray(list(proc_mapping.values()) + [nan], dtype=float32)
+        values = feature_digits[feature_codes]
+        missing_mask = feature_data.isin(missing_values).to_numpy()
+        unmapped_mask = (feature_codes == -1) & ~nan_mask & ~missing_mask
+    else:
+        values = to_numeric(feature_data, errors="coerce").to_numpy(dtype=float32, na_value=nan)
+        missing_mask = isin(values, missing_values)
+        unmapped_mask = isnan(values) & ~nan_mask
+
+    return {
+        "values": values,
+        "valid": ~(nan_mask | missing_mask | unmapped_mask),
+        "report": {
+            "nan": int(nan_mask.sum()),
+            "missing": int(missing_mask.sum()),
+            "unmapped": int(unmapped_mask.sum()),
+        },
+    }
+
+
+def data_qc(data_to_be_processed: DataFrame, features_to_check: list) -> tuple:
+    """Data quality control: all the features are encoded to digits, and the rows with
+    nan, missing values (MISSING_DATA) or values not in STR2DIGIT_MAPPING are removed
+    with one combined mask
 
     Args:
         data_to_be_processed (DataFrame): raw data to be processed
         features_to_check (list): features to be chcked
 
     Returns:
-        DataFrame: quality controlled dataset
+        tuple: quality controlled dataset (a C-contiguous float32 matrix, the columns are features_to_check),
+            and the QC report (the number of rows failed by each rule for each feature)
     """
-    # remove all nan values
-    data_to_be_processed = data_to_be_processed.dropna()
-    for proc_feature in features_to_check:
-        # convert str to values
-        if proc_feature in STR2DIGIT_MAPPING:
-            data_to_be_processed = data_to_be_processed.replace(STR2DIGIT_MAPPING[proc_feature])
-    
-        # remove missing values
-        for proc_missing_value in MISSING_DATA[proc_feature]:
-            data_to_be_processed = data_to_be_processed[data_to_be_processed[proc_feature] != proc_missing_value]
-    
-    return data_to_be_processed
-    
+    encoded_features = {
+        proc_feature: encode_feature(data_to_be_processed[proc_feature], proc_feature)
+        for proc_feature in features_to_check
+    }
+
+    return combine_encoded_features(encoded_features, features_to_check)
+
+
+def combine_encoded_features(encoded_features: dict, features_to_check: list) -> tuple:
+    """Combine the encoded features (from encode_feature) to the quality controlled dataset,
+    the rows failed by any feature are removed
+
+    Args:
+        encoded_features (dict): the encoded features, the keys are the feature names
+        features_to_check (list): features to be combined
+
+    Returns:
+        tuple: quality controlled dataset (a C-contiguous float32 matrix, the columns are features_to_check),
+            and the QC report (the number of rows failed by each rule for each feature)
+    """
+    selected_features = [encoded_features[proc_feature] for proc_feature in features_to_check]
+
+    valid_mask = logical_and.reduce([proc_encoded["valid"] for proc_encoded in selected_features])
+
+    data_qc_controlled = empty((int(valid_mask.sum()), len(features_to_check)), dtype=float32, order="C")
+    for i, proc_encoded in enumerate(selected_features):
+        data_qc_controlled[:, i] = proc_encoded["values"][valid_mask]
+
+    qc_report = {
+        proc_feature: proc_encoded["report"]
+        for proc_feature, proc_encoded in zip(features_to_check, selected_features)
+    }
+    qc_report["total"] = {"input": len(valid_mask), "removed": int((~valid_mask).sum())}
+
+    return data_qc_controlled, qc_report
+
 
 def split_training_test_data(x_total: array, y_total: array, random_state: int = 1, test_size: float = 0.1) -> dict:
-    """Split dataset used for training and test
+    """Split dataset used for training and test, only the row index of each split is kept
+    (the matrices are not copied, see get_split_data)
 
     Args:
         x_total (array): total x
@@ -182,20 +678,28 @@ def split_training_test_data(x_total: array, y_total: array, random_state: int =
         test_size (float, optional): ratio for test dataset. Defaults to 0.2.
 
     Returns:
-        dict: [description]
+        dict: the total x and y, and the row index of the training and test dataset
     """
+    from sklearn.model_selection import train_test_split
 
-    output = {"training": {}, "test": {}}
-    (
-        output["training"]["x"],
-        output["test"]["x"],
-        output["training"]["y"],
-        output["test"]["y"],
-    ) = train_test_split(
-        x_total,
-        y_total,
+    training_index, test_index = train_test_split(
+        arange(len(y_total)),
         test_size=test_size,
         random_state=random_state,
     )
 
-    return output
+    return {"x": x_total, "y": y_total, "training": {"index": training_index}, "test": {"index": test_index}}
+
+
+def get_split_data(xy: dict, proc_type: str, data_name: str) -> array:
+    """Get x or y of the training or test dataset, the rows are gathered from the total x or y
+
+    Args:
+        xy (dict): xy dataset (from split_training_test_data)
+        proc_type (str): training or test
+        data_name (str): x or y
+
+    Returns:
+        array: the data of the split
+    """
+    return xy[data_name][xy[proc_type]["index"]]
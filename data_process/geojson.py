@@ -0,0 +1,127 @@
+from json import JSONDecodeError, JSONDecoder
+from logging import getLogger
+from re import compile as re_compile
+
+from numpy import nan
+from pandas.core.frame import DataFrame
+
+from data_process import (COORDINATES_KEY, FEATURES_KEY, GEOJSON_BATCH_SIZE,
+                          GEOJSON_BLOCK_SIZE, GEOMETRY_KEY, PROPERTIES_KEY,
+                          REGION_KEY, STR2DIGIT_MAPPING, X_KEY, Y_KEY)
+
+logger = getLogger()
+
+FEATURES_ARRAY_KEY = f'"{FEATURES_KEY}"'
+FEATURES_SEPARATOR = re_compile(r"[\s,]*")
+
+
+def iter_geojson_features(data_path: str, block_size: int = GEOJSON_BLOCK_SIZE):
+    """Iterate over the features of a GeoJSON FeatureCollection, the document is read
+    in blocks and the features are decoded one by one, so the whole document is never held in memory
+
+    Args:
+        data_path (str): the GeoJSON file
+        block_size (int, optional): number of characters to be read each time. Defaults to GEOJSON_BLOCK_SIZE.
+
+    Yields:
+        dict: a GeoJSON feature
+    """
+    decoder = JSONDecoder()
+
+    with open(data_path, "r", encoding="utf-8") as fin:
+
+        # locate the start of the features array
+        buffer = ""
+        position = -1
+        while position < 0:
+            proc_block = fin.read(block_size)
+            if not proc_block:
+                raise Exception(f"not able to find {FEATURES_ARRAY_KEY} from {data_path}")
+            buffer += proc_block
+
+            key_position = buffer.find(FEATURES_ARRAY_KEY)
+            if key_position < 0:
+                buffer = buffer[-len(FEATURES_ARRAY_KEY):]
+                continue
+
+            buffer = buffer[key_position:]
+            position = buffer.find("[")
+
+        position += 1
+
+        while True:
+            position = FEATURES_SEPARATOR.match(buffer, position).end()
+
+            if position < len(buffer) and buffer[position] == "]":
+                return
+
+            try:
+                if position == len(buffer):
+                    raise JSONDecodeError("the buffer is exhausted", buffer, position)
+                proc_feature, position = decoder.raw_decode(buffer, position)
+            except JSONDecodeError:
+                # the feature is not complete in the buffer, so we read the next block
+                proc_block = fin.read(block_size)
+                if not proc_block:
+                    raise Exception(f"the GeoJSON file {data_path} is not complete")
+                buffer = buffer[position:] + proc_block
+                position = 0
+                continue
+
+            yield proc_feature
+
+
+def iter_geojson_chunks(
+    data_path: str, chunksize: int = GEOJSON_BATCH_SIZE, columns: list or None = None, block_size: int = GEOJSON_BLOCK_SIZE
+):
+    """Iterate over a GeoJSON FeatureCollection in chunks of DataFrame, each chunk has the
+    same columns as the CSV dataset (the feature properties, and the point coordinates as X and Y)
+
+    Args:
+        data_path (str): the GeoJSON file
+        chunksize (int, optional): number of features in each chunk. Defaults to GEOJSON_BATCH_SIZE.
+        columns (list or None, optional): only keep these columns. Defaults to None.
+        block_size (int, optional): number of characters to be read each time. Defaults to GEOJSON_BLOCK_SIZE.
+
+    Yields:
+        DataFrame: a chunk of the dataset
+    """
+    records = []
+    for proc_feature in iter_geojson_features(data_path, block_size=block_size):
+        proc_record = {X_KEY: nan, Y_KEY: nan}
+
+        proc_geometry = proc_feature.get(GEOMETRY_KEY)
+        if proc_geometry is not None and proc_geometry.get(COORDINATES_KEY):
+            proc_record[X_KEY], proc_record[Y_KEY] = proc_geometry[COORDINATES_KEY][:2]
+
+        proc_record.update(proc_feature.get(PROPERTIES_KEY) or {})
+
+        records.append(proc_record)
+
+        if len(records) == chunksize:
+            yield create_geojson_chunk(records, columns)
+            records = []
+
+    if records:
+        yield create_geojson_chunk(records, columns)
+
+
+def create_geojson_chunk(records: list, columns: list or None) -> DataFrame:
+    """Create a chunk of DataFrame from the GeoJSON records
+
+    Args:
+        records (list): list of records (the feature properties and coordinates)
+        columns (list or None): only keep these columns
+
+    Returns:
+        DataFrame: a chunk of the dataset
+    """
+    chunk = DataFrame.from_records(records, columns=columns)
+
+    # the columns without any value are kept as missing numbers, except the string columns
+    # of the typed schema (see apply_typed_schema), they are categories in the other chunks
+    for proc_col in chunk.columns[chunk.isna().all().to_numpy()]:
+        if proc_col != REGION_KEY and proc_col not in STR2DIGIT_MAPPING:
+            chunk[proc_col] = chunk[proc_col].astype("float64")
+
+    return chunk.infer_objects()
@@ -0,0 +1,355 @@
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+from inspect import signature
+from json import dump as json_dump
+from logging import getLogger
+from os import makedirs, replace, sysconf
+from os.path import basename, join
+from resource import RUSAGE_CHILDREN, RUSAGE_SELF, getrusage
+from sys import _current_frames, platform
+from threading import Event, Lock, Thread, current_thread, get_ident
+from time import perf_counter, process_time
+
+from data_process import (PROFILE_FILENAME, PROFILE_INTERVAL,
+                          RUN_REPORT_FILENAME)
+
+logger = getLogger()
+
+# the run being reported (empty if there is no run, and then the stages are not recorded),
+# and the stages running in each thread {thread id: [stage id]}
+_RUN_REPORT = {}
+_ACTIVE_STAGES = {}
+_REPORT_LOCK = Lock()
+
+
+def get_peak_rss(who: int = RUSAGE_SELF) -> int:
+    """Get the peak resident set size (in bytes) of the process (or its child processes) over its lifetime
+
+    Args:
+        who (int, optional): RUSAGE_SELF or RUSAGE_CHILDREN. Defaults to RUSAGE_SELF.
+
+    Returns:
+        int: the peak RSS in bytes
+    """
+    peak_rss = getrusage(who).ru_maxrss
+    return peak_rss if platform == "darwin" else peak_rss * 1024
+
+
+def get_current_rss() -> int or None:
+    """Get the current resident set size (in bytes) of the process
+
+    Returns:
+        int or None: the current RSS in bytes, None if it is not available (/proc/self/statm is only on Linux)
+    """
+    try:
+        with open("/proc/self/statm", "r") as fid:
+            return int(fid.read().split()[1]) * sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def update_stage_rss(stage_record: dict, current_rss: int or None):
+    """Update the peak RSS of a stage with the current RSS (the caller holds _REPORT_LOCK)
+
+    Args:
+        stage_record (dict): the stage record
+        current_rss (int or None): the current RSS of the process
+    """
+    if current_rss is not None:
+        stage_record["peak_rss"] = max(stage_record.get("peak_rss") or 0, current_rss)
+
+
+@contextmanager
+def instrument_stage(stage_name: str, field: str or None = None, rows: int or None = None):
+    """Record the wall time, the CPU time (of the process) and the RSS of a stage in the run report,
+    the stages are only recorded when a run is reported (see run_report). The RSS is the RSS of the process
+    at the start (start_rss) and the end (end_rss) of the stage, and the maximum RSS sampled while
+    the stage runs (peak_rss, see sample_stages), it includes the memory of the stages running at the same time
+
+    Args:
+        stage_name (str): stage name
+        field (str or None, optional): the field processed by the stage. Defaults to None.
+        rows (int or None, optional): the number of rows processed by the stage,
+            it can also be set later with stage_record["rows"]. Defaults to None.
+
+    Yields:
+        dict: the stage record
+    """
+    stage_record = {"stage": stage_name, "field": field, "rows": rows}
+
+    if not _RUN_REPORT:
+        yield stage_record
+        return
+
+    thread_id = get_ident()
+    with _REPORT_LOCK:
+        stage_stack = _ACTIVE_STAGES.setdefault(thread_id, [])
+        stage_record.update(
+            {
+                "id": len(_RUN_REPORT["stages"]),
+                "parent": stage_stack[-1] if stage_stack else None,
+                "thread": current_thread().name,
+                "start": perf_counter() - _RUN_REPORT["start_time"],
+                "start_rss": get_current_rss(),
+                "peak_rss": None,
+            }
+        )
+        update_stage_rss(stage_record, stage_record["start_rss"])
+        stage_stack.append(stage_record["id"])
+        _RUN_REPORT["stages"].append(stage_record)
+
+    start_wall_time = perf_counter()
+    start_cpu_time = process_time()
+
+    try:
+        yield stage_record
+    except BaseException as stage_error:
+        stage_record["error"] = repr(stage_error)
+        raise
+    finally:
+        end_rss = get_current_rss()
+        with _REPORT_LOCK:
+            stage_record.update(
+                {
+                    "wall_time": perf_counter() - start_wall_time,
+                    "cpu_time": process_time() - start_cpu_time,
+                    "end_rss": end_rss,
+                }
+            )
+            update_stage_rss(stage_record, end_rss)
+            stage_stack.pop()
+            if not stage_stack:
+                del _ACTIVE_STAGES[thread_id]
+
+
+def instrument(stage_name: str, field: str or None = None, rows=None):
+    """Decorate a function so each call is recorded as a stage (see instrument_stage)
+
+    Args:
+        stage_name (str): stage name
+        field (str or None, optional): the name of the argument holding the processed field. Defaults to None.
+        rows (function or None, optional): get the number of the processed rows from
+            the arguments (dict) and the output of the function. Defaults to None.
+
+    Returns:
+        function: the decorator
+    """
+
+    def decorator(func):
+        func_signature = signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _RUN_REPORT:
+                return func(*args, **kwargs)
+
+            func_args = func_signature.bind(*args, **kwargs).arguments
+            with instrument_stage(stage_name, field=None if field is None else func_args.get(field)) as stage_record:
+                func_output = func(*args, **kwargs)
+                if rows is not None:
+                    stage_record["rows"] = rows(func_args, func_output)
+
+            return func_output
+
+        return wrapper
+
+    return decorator
+
+
+def inherit_stages(func):
+    """Wrap a function to be run in another thread (e.g., in a thread pool), so the stages
+    in it are recorded (and profiled) as a part of the stages running in the current thread
+
+    Args:
+        func (function): the function to be run in another thread
+
+    Returns:
+        function: the wrapped function
+    """
+    with _REPORT_LOCK:
+        parent_stack = list(_ACTIVE_STAGES.get(get_ident(), []))
+
+    if not parent_stack:
+        return func
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        thread_id = get_ident()
+        with _REPORT_LOCK:
+            _ACTIVE_STAGES.setdefault(thread_id, []).extend(parent_stack)
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with _REPORT_LOCK:
+                stage_stack = _ACTIVE_STAGES[thread_id]
+                del stage_stack[len(stage_stack) - len(parent_stack) :]
+                if not stage_stack:
+                    del _ACTIVE_STAGES[thread_id]
+
+    return wrapper
+
+
+def get_collapsed_stack(frame) -> str:
+    """Get the call stack of a frame in the collapsed format (the outermost call first, separated by ";")
+
+    Args:
+        frame (frame): the innermost frame
+
+    Returns:
+        str: the collapsed call stack
+    """
+    frame_names = []
+    while frame is not None:
+        frame_names.append(
+            f"{frame.f_code.co_name} ({basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})"
+        )
+        frame = frame.f_back
+
+    return ";".join(reversed(frame_names))
+
+
+def sample_stages(interval: float, stop_event: Event, samples: dict or None = None):
+    """Sample the RSS of the process (for the peak RSS of all the running stages), and the call stacks of
+    the threads running stages (each sample is counted for all the running stages of the thread)
+    until stop_event is set
+
+    Args:
+        interval (float): the sampling interval in seconds
+        stop_event (Event): the event to stop the sampling
+        samples (dict or None, optional): {stage id: Counter of the collapsed call stacks}, it is updated
+            in place, None to only sample the RSS. Defaults to None.
+    """
+    while not stop_event.wait(interval):
+        current_rss = get_current_rss()
+        with _REPORT_LOCK:
+            active_stages = {thread_id: list(stage_stack) for thread_id, stage_stack in _ACTIVE_STAGES.items()}
+            for stage_id in {stage_id for stage_stack in active_stages.values() for stage_id in stage_stack}:
+                update_stage_rss(_RUN_REPORT["stages"][stage_id], current_rss)
+
+        if samples is None:
+            continue
+
+        thread_frames = _current_frames()
+
+        for thread_id, stage_stack in active_stages.items():
+            if thread_id not in thread_frames:
+                continue
+            proc_stack = get_collapsed_stack(thread_frames[thread_id])
+            for stage_id in stage_stack:
+                samples.setdefault(stage_id, Counter())[proc_stack] += 1
+
+
+def dump_stage_profile(work_dir: str, stage_records: list, samples: dict) -> str or None:
+    """Dump the sampled call stacks of the slowest leaf stage (a stage without nested stages, since
+    the wall time of a stage includes its nested stages), in the collapsed format
+    (one "stack count" line for each call stack, which can be drawn as a flame graph)
+
+    Args:
+        work_dir (str): working directory
+        stage_records (list): the stage records of the run
+        samples (dict): {stage id: Counter of the collapsed call stacks}
+
+    Returns:
+        str or None: the path of the profile, None if there is no sampled stage
+    """
+    parent_ids = {proc_record["parent"] for proc_record in stage_records}
+    sampled_records = [
+        proc_record
+        for proc_record in stage_records
+        if proc_record["id"] in samples and proc_record["id"] not in parent_ids
+    ]
+    if not sampled_records:
+        return None
+
+    slowest_record = max(sampled_records, key=lambda proc_record: proc_record.get("wall_time", 0.0))
+
+    makedirs(work_dir, exist_ok=True)
+    profile_path = join(
+        work_dir, PROFILE_FILENAME.format(stage_name=f"{slowest_record['stage']}_{slowest_record['id']}")
+    )
+    with open(profile_path, "w") as fid:
+        for proc_stack, proc_count in samples[slowest_record["id"]].most_common():
+            fid.write(f"{proc_stack} {proc_count}\n")
+
+    logger.info(f"the profile of the slowest leaf stage ({slowest_record['stage']}) is dumped to {profile_path} ...")
+
+    return profile_path
+
+
+def write_run_report(work_dir: str, report: dict) -> str:
+    """Write the run report to the working directory
+
+    Args:
+        work_dir (str): working directory
+        report (dict): the run report
+
+    Returns:
+        str: the path of the run report
+    """
+    makedirs(work_dir, exist_ok=True)
+    report_path = join(work_dir, RUN_REPORT_FILENAME)
+    with open(report_path + ".tmp", "w") as fid:
+        json_dump(report, fid, indent=2, default=str)
+    replace(report_path + ".tmp", report_path)
+
+    return report_path
+
+
+@contextmanager
+def run_report(
+    work_dir: str, command: str, run_args: dict or None = None, profile: bool = False, interval: float = PROFILE_INTERVAL
+):
+    """Report a run: the instrumented stages (see instrument and instrument_stage) are recorded and
+    written to work_dir/run_report.json at the end of the run (also when the run fails)
+
+    Args:
+        work_dir (str): working directory
+        command (str): the command being run
+        run_args (dict or None, optional): the arguments of the command. Defaults to None.
+        profile (bool, optional): sample the call stacks of the stages, and dump the profile
+            of the slowest leaf stage to the working directory. Defaults to False.
+        interval (float, optional): the sampling interval (of the RSS and the call stacks) in seconds.
+            Defaults to PROFILE_INTERVAL.
+    """
+    with _REPORT_LOCK:
+        _RUN_REPORT.clear()
+        _RUN_REPORT.update({"start_time": perf_counter(), "stages": []})
+
+    started = datetime.now(timezone.utc).isoformat()
+    start_cpu_time = process_time()
+
+    # the RSS is always sampled, the call stacks are only sampled with profile
+    samples = {} if profile else None
+    stop_event = Event()
+    sampler = Thread(target=sample_stages, args=(interval, stop_event, samples), name="sampler", daemon=True)
+    sampler.start()
+
+    run_status = "failed"
+    try:
+        yield
+        run_status = "done"
+    finally:
+        stop_event.set()
+        sampler.join()
+
+        with _REPORT_LOCK:
+            report = {
+                "command": command,
+                "args": run_args,
+                "status": run_status,
+                "started": started,
+                "wall_time": perf_counter() - _RUN_REPORT["start_time"],
+                "cpu_time": process_time() - start_cpu_time,
+                "peak_rss": get_peak_rss(),
+                "children_peak_rss": get_peak_rss(RUSAGE_CHILDREN),
+                "stages": _RUN_REPORT["stages"],
+            }
+            _RUN_REPORT.clear()
+
+        if profile:
+            report["profile"] = dump_stage_profile(work_dir, report["stages"], samples)
+
+        logger.info(f"run report is written to {write_run_report(work_dir, report)} ...")
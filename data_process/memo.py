@@ -0,0 +1,260 @@
+from hashlib import blake2b
+from json import dump as json_dump
+from json import dumps as json_dumps
+from json import load as json_load
+from logging import getLogger
+from os import getpid, remove, replace, scandir, utime
+from os.path import exists, join
+from threading import Lock, get_ident
+
+from numpy import full, isnan, nan
+
+from data_process import (QUERY_MEMO_DIR, QUERY_MEMO_FILENAME,
+                          QUERY_MEMO_MAX_SIZE)
+from data_process.aggregate import get_constrain_key
+from data_process.utils import (check_private_path, get_file_fingerprint,
+                                get_private_dir)
+
+logger = getLogger()
+
+
+def open_query_memo(data_path: str, memo_dir: str = QUERY_MEMO_DIR, max_size: int = QUERY_MEMO_MAX_SIZE) -> dict:
+    """Open the on-disk memo of the aggregate queries (the sum of a field, with a set of constrains,
+    for a region and a year) of a dataset, the memo is shared by all the experiments and runs
+    on the same dataset, and it is keyed by the fingerprint of the dataset, so a changed dataset
+    never reuses the old sums
+
+    Args:
+        data_path (str): the source dataset (e.g., cas.csv)
+        memo_dir (str, optional): where the memo entries are saved, a directory of the current user
+            (see get_private_dir). Defaults to QUERY_MEMO_DIR.
+        max_size (int, optional): maximum size (in bytes) of memo_dir, the least recently used
+            entries are evicted beyond it. Defaults to QUERY_MEMO_MAX_SIZE.
+
+    Returns:
+        dict: the memo, with its hit/miss/eviction counters
+    """
+    return {
+        "dir": get_private_dir(memo_dir),
+        "fingerprint": get_file_fingerprint(data_path),
+        "max_size": max_size,
+        "hits": 0,
+        "misses": 0,
+        "evictions": 0,
+        "lock": Lock(),
+    }
+
+
+def get_memo_path(memo: dict, query_field: str, constrains: list) -> str:
+    """Get the memo entry of a field and a set of constrains, the entry holds all of its
+    (region, year) cells, so the experiments with different regions/years share it
+
+    Args:
+        memo (dict): the memo from open_query_memo
+        query_field (str): field to be summed, e.g., bicycle
+        constrains (list): constrains from get_query_keys, e.g., [{"speedLimit": 100}]
+
+    Returns:
+        str: the path of the memo entry
+    """
+    memo_key = blake2b(
+        json_dumps([memo["fingerprint"], query_field, get_constrain_key(constrains)]).encode(), digest_size=16
+    ).hexdigest()
+
+    return join(memo["dir"], QUERY_MEMO_FILENAME.format(memo_key=memo_key))
+
+
+def read_memo_cells(memo_path: str) -> dict:
+    """Read the cells of a memo entry, a missing or an invalid entry has no cells, and an entry
+    which is not owned by the current user is refused
+
+    Args:
+        memo_path (str): the path of the memo entry
+
+    Returns:
+        dict: {region: {year: value}}
+    """
+    if not exists(memo_path):
+        return {}
+
+    check_private_path(memo_path)
+
+    try:
+        with open(memo_path, "r") as fid:
+            return json_load(fid)["cells"]
+    except Exception:
+        logger.info(f"query memo {memo_path} is invalid, it will be rebuilt ...")
+        return {}
+
+
+def load_memo_values(memo: dict or None, query_field: str, constrains: list, regions: list, years: list):
+    """Load the memoized sums of a field for every region and year
+
+    Args:
+        memo (dict or None): the memo from open_query_memo, None for no memo
+        query_field (str): field to be summed, e.g., bicycle
+        constrains (list): constrains from get_query_keys, e.g., [{"speedLimit": 100}]
+        regions (list): regions (names used in the configuration)
+        years (list): years
+
+    Returns:
+        array: 2d array (region x year), the cells which are not memoized are nan
+    """
+    values = full((len(regions), len(years)), nan)
+    if memo is None:
+        return values
+
+    memo_path = get_memo_path(memo, query_field, constrains)
+
+    with memo["lock"]:
+        memo_cells = read_memo_cells(memo_path)
+        for i, proc_region in enumerate(regions):
+            region_cells = memo_cells.get(proc_region, {})
+            for j, proc_year in enumerate(years):
+                values[i, j] = region_cells.get(str(proc_year), nan)
+
+        num_hits = int((~isnan(values)).sum())
+        memo["hits"] += num_hits
+        memo["misses"] += values.size - num_hits
+
+        if num_hits > 0:
+            try:
+                # the entry is recently used, so it is evicted last
+                utime(memo_path)
+            except FileNotFoundError:
+                # it is evicted by another process
+                pass
+
+    return values
+
+
+def save_memo_values(memo: dict or None, query_field: str, constrains: list, regions: list, years: list, values):
+    """Save the sums of a field for every region and year to the memo, they are merged with the
+    cells already in the entry, and the memo is then bounded to its maximum size
+
+    Args:
+        memo (dict or None): the memo from open_query_memo, None for no memo
+        query_field (str): field to be summed, e.g., bicycle
+        constrains (list): constrains from get_query_keys, e.g., [{"speedLimit": 100}]
+        regions (list): regions (names used in the configuration)
+        years (list): years
+        values (array): 2d array (region x year)
+    """
+    if memo is None:
+        return
+
+    memo_path = get_memo_path(memo, query_field, constrains)
+
+    with memo["lock"]:
+        memo_cells = read_memo_cells(memo_path)
+        for i, proc_region in enumerate(regions):
+            region_cells = memo_cells.setdefault(proc_region, {})
+            for j, proc_year in enumerate(years):
+                region_cells[str(proc_year)] = float(values[i, j])
+
+        get_private_dir(memo["dir"])
+        memo_tmp_path = f"{memo_path}.{getpid()}.{get_ident()}"
+        with open(memo_tmp_path, "w") as fid:
+            json_dump(
+                {
+                    "fingerprint": memo["fingerprint"],
+                    "field": query_field,
+                    "constrains": get_constrain_key(constrains),
+                    "cells": memo_cells,
+                },
+                fid,
+            )
+        replace(memo_tmp_path, memo_path)
+
+        evict_query_memo(memo)
+
+
+def evict_query_memo(memo: dict):
+    """Remove the least recently used memo entries until the memo is within its maximum size
+
+    Args:
+        memo (dict): the memo from open_query_memo
+    """
+    memo_entries = []
+    for proc_entry in scandir(memo["dir"]):
+        if proc_entry.name.endswith(".json"):
+            entry_stat = proc_entry.stat()
+            memo_entries.append((entry_stat.st_mtime_ns, entry_stat.st_size, proc_entry.path))
+
+    memo_size = sum(entry_size for _, entry_size, _ in memo_entries)
+
+    for _, entry_size, entry_path in sorted(memo_entries):
+        if memo_size <= memo["max_size"]:
+            break
+        try:
+            remove(entry_path)
+        except FileNotFoundError:
+            # it is evicted by another process
+            pass
+        memo_size -= entry_size
+        memo["evictions"] += 1
+
+
+def memoize_region_year(
+    memo: dict or None, aggregate_func, data, query_fields: list, constrains: list, regions: list, years: list
+) -> dict:
+    """Sum the query fields for every region and year with aggregate_func, only the regions
+    and years of the cells which are not memoized are aggregated
+
+    Args:
+        memo (dict or None): the memo from open_query_memo, None for no memo
+        aggregate_func (function): aggregate_region_year or aggregate_region_year_from_store
+        data (DataFrame): CAS dataset, or the aggregate store
+        query_fields (list): fields to be summed, e.g., ["bicycle", "truck"]
+        constrains (list): constrains shared by all query fields, e.g., [{"speedLimit": 100}]
+        regions (list): regions to be aggregated (names used in the configuration)
+        years (list): years to be aggregated
+
+    Returns:
+        dict: {query_field: 2d array (region x year)}
+    """
+    if memo is None:
+        return aggregate_func(data, query_fields, constrains, regions, years)
+
+    query_fields = list(dict.fromkeys(query_fields))
+
+    outputs = {
+        proc_field: load_memo_values(memo, proc_field, constrains, regions, years) for proc_field in query_fields
+    }
+
+    missing_cells = sum(isnan(outputs[proc_field]) for proc_field in query_fields) > 0
+    if not missing_cells.any():
+        return outputs
+
+    missing_regions = [i for i in range(len(regions)) if missing_cells[i].any()]
+    missing_years = [j for j in range(len(years)) if missing_cells[:, j].any()]
+
+    missing_outputs = aggregate_func(
+        data,
+        query_fields,
+        constrains,
+        [regions[i] for i in missing_regions],
+        [years[j] for j in missing_years],
+    )
+
+    for proc_field in query_fields:
+        outputs[proc_field][[[i] for i in missing_regions], missing_years] = missing_outputs[proc_field]
+        save_memo_values(memo, proc_field, constrains, regions, years, outputs[proc_field])
+
+    return outputs
+
+
+def log_query_memo(memo: dict or None):
+    """Log the hit/miss/eviction counters of the memo
+
+    Args:
+        memo (dict or None): the memo from open_query_memo, None for no memo
+    """
+    if memo is None:
+        return
+
+    with memo["lock"]:
+        logger.info(
+            f"query memo {memo['dir']}: {memo['hits']} hits, {memo['misses']} misses, "
+            f"{memo['evictions']} evictions ..."
+        )
@@ -0,0 +1,402 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+from logging import getLogger
+from os import makedirs
+from os.path import basename, join, splitext
+from threading import Lock
+from time import time
+
+from pandas.core.frame import DataFrame
+
+from data_process import (CHUNK_SIZE, DEPS_KEY, FEATURE_KEY, FUNC_KEY,
+                          GROUPBY_ENGINE_KEY, LATLON_KEY, LOAD_STAGE,
+                          MODEL_THREADS, PIPELINE_WORKERS, POPULATION_KEY,
+                          QC_STAGE, RENDER_KEY, RENDER_WORKERS, SHAP_MAX_PLOTS,
+                          SPATIAL_KEY, TEMPORAL_KEY, VIS_STAGE_SUFFIX)
+from data_process.feature import create_feature_analysis, encode_features
+from data_process.instrument import instrument_stage
+from data_process.render import render_figures
+from data_process.spatial import create_spatial
+from data_process.temporal import (create_time_series, export_temporal_trend,
+                                   obtain_temporal_trend)
+from data_process.utils import (get_feature_columns, get_query_columns,
+                                read_config, read_dataset)
+from data_process.vis import plot_spatial, temporal_vis
+
+logger = getLogger()
+
+
+def get_experiments(config_files: dict) -> dict:
+    """Read the configurations of all the experiments, the experiment name is
+    the name of its configuration file (without the extension)
+
+    Args:
+        config_files (dict): the configuration files of each analysis,
+            e.g., {"temporal": ["temporal_analysis_exp1.yaml"], "feature": [...]}
+
+    Returns:
+        dict: {experiment name: {"analysis": analysis, "cfg": configuration}}
+    """
+    experiments = {}
+    for proc_analysis in config_files:
+        for proc_config_file in config_files[proc_analysis] or []:
+            exp_name = splitext(basename(proc_config_file))[0]
+            if exp_name in experiments:
+                raise Exception(f"experiment {exp_name} is defined more than once")
+            experiments[exp_name] = {"analysis": proc_analysis, "cfg": read_config(proc_config_file)}
+
+    return experiments
+
+
+def get_pipeline_columns(experiments: dict) -> list:
+    """Return all the dataset columns required by the experiments
+
+    Args:
+        experiments (dict): the experiments from get_experiments
+
+    Returns:
+        list: the columns to be used
+    """
+    pipeline_columns = []
+    for proc_exp in experiments.values():
+        if proc_exp["analysis"] == FEATURE_KEY:
+            pipeline_columns.extend(get_feature_columns(proc_exp["cfg"]))
+        else:
+            pipeline_columns.extend(get_query_columns(proc_exp["cfg"]))
+
+    return list(dict.fromkeys(pipeline_columns))
+
+
+def get_experiment_dir(workdir: str, exp_name: str) -> str:
+    """Get (and create) the working directory of an experiment
+
+    Args:
+        workdir (str): the pipeline working directory
+        exp_name (str): experiment name
+
+    Returns:
+        str: the working directory of the experiment
+    """
+    exp_dir = join(workdir, exp_name)
+    makedirs(exp_dir, exist_ok=True)
+    return exp_dir
+
+
+def run_temporal_stage(
+    exp_dir: str,
+    cfg: dict,
+    engine: str,
+    scheduler: str or None,
+    num_workers: int or None,
+    memo: dict or None,
+    data: DataFrame,
+) -> dict:
+    """Create the timeseries and the trend table (exported to the experiment directory)
+
+    Args:
+        exp_dir (str): experiment directory
+        cfg (dict): temporal analysis configuration
+        engine (str): the engine used to compute the timeseries
+        scheduler (str or None): the dask scheduler, None for the configuration or DASK_SCHEDULER
+        num_workers (int or None): number of dask workers, None for the configuration or DASK_WORKERS
+        memo (dict or None): the query memo (from open_query_memo), None for no memo
+        data (DataFrame): CAS dataset
+
+    Returns:
+        dict: the timeseries and the trend table
+    """
+    timeseries_data = create_time_series(
+        data, cfg, num_workers=num_workers, engine=engine, scheduler=scheduler, memo=memo
+    )
+    trend_table = obtain_temporal_trend(timeseries_data, cfg)
+    export_temporal_trend(exp_dir, trend_table)
+
+    return {"timeseries": timeseries_data, "trend": trend_table}
+
+
+def run_spatial_stage(
+    cfg: dict, engine: str, scheduler: str or None, num_workers: int or None, memo: dict or None, data: DataFrame
+) -> dict:
+    """Create the spatial data
+
+    Args:
+        cfg (dict): spatial analysis configuration
+        engine (str): the engine used to compute the spatial data
+        scheduler (str or None): the dask scheduler, None for the configuration or DASK_SCHEDULER
+        num_workers (int or None): number of dask workers, None for the configuration or DASK_WORKERS
+        memo (dict or None): the query memo (from open_query_memo), None for no memo
+        data (DataFrame): CAS dataset
+
+    Returns:
+        dict: the spatial data and the lat/lon of the regions
+    """
+    population_data = None
+    if cfg[f"use_{POPULATION_KEY}_data"] is not None:
+        population_data = read_dataset(cfg[f"use_{POPULATION_KEY}_data"])
+
+    return {
+        "spatial": create_spatial(
+            data, population_data, cfg, num_workers=num_workers, engine=engine, scheduler=scheduler, memo=memo
+        ),
+        "latlon": read_dataset(cfg[f"{LATLON_KEY}_data"]),
+    }
+
+
+def run_temporal_vis_stage(exp_dir: str, cfg: dict, render_workers: int, temporal_outputs: dict):
+    """Draw the timeseries figures
+
+    Args:
+        exp_dir (str): experiment directory
+        cfg (dict): temporal analysis configuration
+        render_workers (int): number of rendering processes
+        temporal_outputs (dict): the outputs of run_temporal_stage
+    """
+    temporal_vis(
+        exp_dir,
+        cfg,
+        temporal_outputs["timeseries"],
+        trend_table=temporal_outputs["trend"],
+        render_workers=render_workers,
+    )
+
+
+def run_spatial_vis_stage(exp_dir: str, cfg: dict, render_workers: int, spatial_outputs: dict):
+    """Draw the spatial figures
+
+    Args:
+        exp_dir (str): experiment directory
+        cfg (dict): spatial analysis configuration
+        render_workers (int): number of rendering processes
+        spatial_outputs (dict): the outputs of run_spatial_stage
+    """
+    plot_spatial(
+        exp_dir,
+        spatial_outputs["spatial"],
+        spatial_outputs["latlon"],
+        cfg["vis_scatter_factor"],
+        cfg[f"use_{POPULATION_KEY}_data"],
+        render_workers=render_workers,
+    )
+
+
+def run_feature_stage(
+    exp_dir: str,
+    cfg: dict,
+    model_threads: int,
+    max_shap_plots: int or None,
+    shap_summary: bool,
+    data: DataFrame,
+    encoded_features: dict,
+) -> list:
+    """Train and explain the feature models, the figures are not rendered here
+
+    Args:
+        exp_dir (str): experiment directory
+        cfg (dict): feature analysis configuration
+        model_threads (int): number of threads used by the models
+        max_shap_plots (int or None): maximum number of the SHAP force plots for each field
+        shap_summary (bool): render one SHAP summary plot instead of the force plots
+        data (DataFrame): CAS dataset
+        encoded_features (dict): the encoded features (from encode_features)
+
+    Returns:
+        list: the render jobs of the SHAP plots
+    """
+    return create_feature_analysis(
+        exp_dir,
+        data,
+        cfg,
+        max_shap_plots=max_shap_plots,
+        shap_summary=shap_summary,
+        render_workers=None,
+        n_jobs=model_threads,
+        encoded_features=encoded_features,
+    )
+
+
+def get_pipeline_stages(
+    workdir: str,
+    data_src: str,
+    experiments: dict,
+    chunksize: int or None = CHUNK_SIZE,
+    engine: str = GROUPBY_ENGINE_KEY,
+    scheduler: str or None = None,
+    num_workers: int or None = None,
+    memo: dict or None = None,
+    render_workers: int = RENDER_WORKERS,
+    model_threads: int = MODEL_THREADS,
+    max_shap_plots: int or None = SHAP_MAX_PLOTS,
+    shap_summary: bool = False,
+) -> dict:
+    """Get the stages of the pipeline: the dataset is loaded (and the features are
+    encoded) once, and each experiment has an analysis stage and a visualization stage
+
+    Args:
+        workdir (str): working directory, the outputs of each experiment are in workdir/{experiment name}
+        data_src (str): the dataset to be used
+        experiments (dict): the experiments from get_experiments
+        chunksize (int or None, optional): if it is set, the dataset is streamed in chunks. Defaults to CHUNK_SIZE.
+        engine (str, optional): the engine used to compute the timeseries and the spatial data.
+            Defaults to GROUPBY_ENGINE_KEY.
+        scheduler (str or None, optional): the dask scheduler (only used by the dask engine),
+            None for the configuration of each experiment or DASK_SCHEDULER. Defaults to None.
+        num_workers (int or None, optional): number of dask workers (only used by the dask engine),
+            None for the configuration of each experiment or DASK_WORKERS. Defaults to None.
+        memo (dict or None, optional): the query memo (from open_query_memo) shared by the temporal
+            and spatial experiments, None for no memo. Defaults to None.
+        render_workers (int, optional): number of rendering processes. Defaults to RENDER_WORKERS.
+        model_threads (int, optional): number of threads used by the feature models. Defaults to MODEL_THREADS.
+        max_shap_plots (int or None, optional): maximum number of the SHAP force plots for each field. Defaults to SHAP_MAX_PLOTS.
+        shap_summary (bool, optional): render one SHAP summary plot instead of the force plots. Defaults to False.
+
+    Returns:
+        dict: {stage name: {"func": function, "deps": stage names, "render": if the stage draws figures}},
+            the function takes the outputs of the deps stages as the arguments
+    """
+    stages = {
+        LOAD_STAGE: {
+            FUNC_KEY: partial(
+                read_dataset, data_src, use_cache=True, columns=get_pipeline_columns(experiments), chunksize=chunksize
+            ),
+            DEPS_KEY: [],
+            RENDER_KEY: False,
+        }
+    }
+
+    feature_columns = []
+    for proc_exp in experiments.values():
+        if proc_exp["analysis"] == FEATURE_KEY:
+            feature_columns.extend(get_feature_columns(proc_exp["cfg"]))
+
+    if feature_columns:
+        stages[QC_STAGE] = {
+            FUNC_KEY: partial(encode_features, features=list(dict.fromkeys(feature_columns))),
+            DEPS_KEY: [LOAD_STAGE],
+            RENDER_KEY: False,
+        }
+
+    for exp_name, proc_exp in experiments.items():
+        exp_dir = get_experiment_dir(workdir, exp_name)
+        cfg = proc_exp["cfg"]
+
+        if proc_exp["analysis"] == TEMPORAL_KEY:
+            exp_func = partial(run_temporal_stage, exp_dir, cfg, engine, scheduler, num_workers, memo)
+            exp_deps = [LOAD_STAGE]
+            vis_func = partial(run_temporal_vis_stage, exp_dir, cfg, render_workers)
+        elif proc_exp["analysis"] == SPATIAL_KEY:
+            exp_func = partial(run_spatial_stage, cfg, engine, scheduler, num_workers, memo)
+            exp_deps = [LOAD_STAGE]
+            vis_func = partial(run_spatial_vis_stage, exp_dir, cfg, render_workers)
+        elif proc_exp["analysis"] == FEATURE_KEY:
+            exp_func = partial(run_feature_stage, exp_dir, cfg, model_threads, max_shap_plots, shap_summary)
+            exp_deps = [LOAD_STAGE, QC_STAGE]
+            vis_func = partial(render_figures, num_workers=render_workers)
+        else:
+            raise Exception(f"analysis {proc_exp['analysis']} is not supported")
+
+        stages[exp_name] = {FUNC_KEY: exp_func, DEPS_KEY: exp_deps, RENDER_KEY: False}
+        stages[exp_name + VIS_STAGE_SUFFIX] = {FUNC_KEY: vis_func, DEPS_KEY: [exp_name], RENDER_KEY: True}
+
+    return stages
+
+
+def check_pipeline_stages(stages: dict):
+    """Check that all the dependencies of the stages exist and there is no cycle
+
+    Args:
+        stages (dict): the pipeline stages
+    """
+    resolved = set()
+    unresolved = dict(stages)
+    while unresolved:
+        ready = [
+            stage_name
+            for stage_name, proc_stage in unresolved.items()
+            if all(proc_dep in resolved for proc_dep in proc_stage[DEPS_KEY])
+        ]
+        if not ready:
+            raise Exception(f"the dependencies of the stages {list(unresolved)} can not be resolved")
+        for stage_name in ready:
+            resolved.add(stage_name)
+            del unresolved[stage_name]
+
+
+def run_pipeline_stage(stage_name: str, proc_stage: dict, deps_outputs: list, render_lock: Lock):
+    """Run one pipeline stage, the stages drawing figures are run one at a time
+    (matplotlib.pyplot is not thread-safe)
+
+    Args:
+        stage_name (str): stage name
+        proc_stage (dict): the stage
+        deps_outputs (list): the outputs of the dependencies
+        render_lock (Lock): the lock for the stages drawing figures
+
+    Returns:
+        the output of the stage
+    """
+    if not proc_stage[RENDER_KEY]:
+        return run_stage_func(stage_name, proc_stage[FUNC_KEY], deps_outputs)
+
+    with render_lock:
+        return run_stage_func(stage_name, proc_stage[FUNC_KEY], deps_outputs)
+
+
+def run_stage_func(stage_name: str, stage_func, deps_outputs: list):
+    """Run the function of a stage and log its run time
+
+    Args:
+        stage_name (str): stage name
+        stage_func (function): the function of the stage
+        deps_outputs (list): the outputs of the dependencies
+
+    Returns:
+        the output of the stage
+    """
+    start_time = time()
+    with instrument_stage(stage_name):
+        stage_output = stage_func(*deps_outputs)
+    logger.info(f"stage {stage_name} is done in {time() - start_time:.2f} s ...")
+
+    return stage_output
+
+
+def run_pipeline(stages: dict, num_workers: int = PIPELINE_WORKERS) -> dict:
+    """Run the pipeline stages as a dependency graph, each stage is started as soon as
+    all its dependencies are done, and the independent stages are run in parallel threads
+
+    Args:
+        stages (dict): the pipeline stages (from get_pipeline_stages)
+        num_workers (int, optional): number of stages run at the same time. Defaults to PIPELINE_WORKERS.
+
+    Returns:
+        dict: the outputs of all the stages
+    """
+    check_pipeline_stages(stages)
+
+    stage_outputs = {}
+    pending_stages = dict(stages)
+    running_stages = {}
+    render_lock = Lock()
+
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as stage_pool:
+        while pending_stages or running_stages:
+            for stage_name in list(pending_stages):
+                proc_stage = pending_stages[stage_name]
+                if all(proc_dep in stage_outputs for proc_dep in proc_stage[DEPS_KEY]):
+                    logger.info(f"stage {stage_name} is started ...")
+                    running_stages[
+                        stage_pool.submit(
+                            run_pipeline_stage,
+                            stage_name,
+                            proc_stage,
+                            [stage_outputs[proc_dep] for proc_dep in proc_stage[DEPS_KEY]],
+                            render_lock,
+                        )
+                    ] = stage_name
+                    del pending_stages[stage_name]
+
+            done_stages, _ = wait(running_stages, return_when=FIRST_COMPLETED)
+            for proc_task in done_stages:
+                stage_outputs[running_stages.pop(proc_task)] = proc_task.result()
+
+    return stage_outputs
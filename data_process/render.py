@@ -0,0 +1,105 @@
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import blake2b
+from json import dump as json_dump
+from json import load as json_load
+from logging import getLogger
+from multiprocessing import get_context
+from os import replace
+from os.path import exists
+from pickle import HIGHEST_PROTOCOL
+from pickle import dumps as pickle_dumps
+
+from data_process import RENDER_BACKEND, RENDER_START_METHOD, RENDER_WORKERS
+from data_process.instrument import instrument
+
+logger = getLogger()
+
+
+def init_render_worker():
+    """Set up a rendering worker with the headless matplotlib backend"""
+    from matplotlib import use
+
+    use(RENDER_BACKEND)
+
+
+def get_render_digest(proc_func, proc_kwargs: dict) -> str:
+    """Get the digest of a render job, which is made from the function and all its inputs
+
+    Args:
+        proc_func (function): the function drawing the figure
+        proc_kwargs (dict): the inputs of the function
+
+    Returns:
+        str: the digest of the render job
+    """
+    return blake2b(
+        pickle_dumps((proc_func.__module__, proc_func.__qualname__, proc_kwargs), protocol=HIGHEST_PROTOCOL),
+        digest_size=16,
+    ).hexdigest()
+
+
+def load_render_digests(digest_path: str) -> dict:
+    """Load the digests of the rendered figures
+
+    Args:
+        digest_path (str): the path of the render digests
+
+    Returns:
+        dict: {figure filename: digest}
+    """
+    if not exists(digest_path):
+        return {}
+
+    with open(digest_path) as fid:
+        return json_load(fid)
+
+
+@instrument("render_figures", rows=lambda inputs, output: len(inputs["render_jobs"]))
+def render_figures(render_jobs: list, num_workers: int = RENDER_WORKERS, digest_path: str or None = None):
+    """Render figures, the figures are rendered one by one in the current process
+    if num_workers is 1, otherwise they are rendered in a pool of processes
+
+    Args:
+        render_jobs (list): list of (function, kwargs), each function draws and saves one figure
+            (to kwargs["filename"]), and kwargs should only contain the (small) data required by the figure
+        num_workers (int, optional): number of rendering processes. Defaults to RENDER_WORKERS.
+        digest_path (str or None, optional): if it is set, the digests of the rendered figures are saved
+            in it, and the figures are not rendered again if their inputs are not changed. Defaults to None.
+    """
+    if digest_path is not None:
+        render_digests = load_render_digests(digest_path)
+        job_digests = [get_render_digest(proc_func, proc_kwargs) for proc_func, proc_kwargs in render_jobs]
+
+        changed_jobs = [
+            (proc_job, proc_digest)
+            for proc_job, proc_digest in zip(render_jobs, job_digests)
+            if not exists(proc_job[1]["filename"]) or render_digests.get(proc_job[1]["filename"]) != proc_digest
+        ]
+
+        logger.info(f"{len(render_jobs) - len(changed_jobs)} of {len(render_jobs)} figures are not changed ...")
+
+        render_figures([proc_job for proc_job, _ in changed_jobs], num_workers=num_workers)
+
+        render_digests.update({proc_job[1]["filename"]: proc_digest for proc_job, proc_digest in changed_jobs})
+        with open(digest_path + ".tmp", "w") as fid:
+            json_dump(render_digests, fid, indent=2)
+        replace(digest_path + ".tmp", digest_path)
+
+        return
+
+    if num_workers <= 1 or len(render_jobs) <= 1:
+        for proc_func, proc_kwargs in render_jobs:
+            proc_func(**proc_kwargs)
+        return
+
+    num_workers = min(num_workers, len(render_jobs))
+
+    logger.info(f"rendering {len(render_jobs)} figures with {num_workers} workers ...")
+
+    with ProcessPoolExecutor(
+        max_workers=num_workers, mp_context=get_context(RENDER_START_METHOD), initializer=init_render_worker
+    ) as render_pool:
+        render_tasks = [render_pool.submit(proc_func, **proc_kwargs) for proc_func, proc_kwargs in render_jobs]
+
+        for proc_task in render_tasks:
+            proc_task.result()
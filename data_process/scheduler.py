@@ -0,0 +1,127 @@
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+from multiprocessing import get_context
+from uuid import uuid4
+
+from data_process import (DASK_SCHEDULER, DASK_START_METHOD, DASK_WORKERS,
+                          DISTRIBUTED_SCHEDULER_KEY, NUM_WORKERS_KEY,
+                          PROCESSES_SCHEDULER_KEY, SCHEDULER_KEY,
+                          SYNCHRONOUS_SCHEDULER_KEY, THREADS_SCHEDULER_KEY)
+from data_process.instrument import instrument
+
+logger = getLogger()
+
+# the data shared with the tasks in a worker process {data key: data}, see init_scheduler_worker
+_SHARED_DATA = {}
+
+
+def get_scheduler_options(cfg: dict, scheduler: str or None = None, num_workers: int or None = None) -> tuple:
+    """Get the scheduler and the number of workers, the arguments (e.g., from the CLI) are used
+    if they are set, otherwise they are taken from the configuration (scheduler and num_workers)
+    or the environmental variables (DASK_SCHEDULER and DASK_WORKERS)
+
+    Args:
+        cfg (dict): configuration file
+        scheduler (str or None, optional): synchronous, threads, processes or distributed. Defaults to None.
+        num_workers (int or None, optional): number of workers. Defaults to None.
+
+    Returns:
+        tuple: the scheduler and the number of workers
+    """
+    if scheduler is None:
+        scheduler = cfg.get(SCHEDULER_KEY, DASK_SCHEDULER)
+
+    if num_workers is None:
+        num_workers = cfg.get(NUM_WORKERS_KEY, DASK_WORKERS)
+
+    if scheduler not in {
+        SYNCHRONOUS_SCHEDULER_KEY,
+        THREADS_SCHEDULER_KEY,
+        PROCESSES_SCHEDULER_KEY,
+        DISTRIBUTED_SCHEDULER_KEY,
+    }:
+        raise Exception(f"scheduler {scheduler} is not supported ...")
+
+    return scheduler, max(1, int(num_workers))
+
+
+def init_scheduler_worker(shared_data: dict):
+    """Set up a worker process of the processes scheduler with the shared data
+
+    Args:
+        shared_data (dict): {data key: data}
+    """
+    _SHARED_DATA.update(shared_data)
+
+
+def run_shared_task(task_func, data_key: str, *task_args):
+    """Run a task on the data shared with the worker process
+
+    Args:
+        task_func (function): the task, which takes the data as the first argument
+        data_key (str): the key of the shared data
+
+    Returns:
+        object: the output of the task
+    """
+    return task_func(_SHARED_DATA[data_key], *task_args)
+
+
+@instrument("dask_compute", field="scheduler", rows=lambda inputs, output: len(inputs["data"]))
+def compute_tasks(
+    task_func, data, task_args: list, scheduler: str = DASK_SCHEDULER, num_workers: int = DASK_WORKERS
+) -> list:
+    """Compute task_func(data, *args) for each args in task_args with dask, the data is put into
+    the scheduler once and the tasks only reference it by its key: it is one node of the task graph
+    (synchronous and threads), it is sent once to each worker process when the pool starts (processes),
+    or it is scattered to the workers of a local cluster (distributed, which requires dask distributed)
+
+    Args:
+        task_func (function): the task, which takes the data as the first argument
+        data (object): the data shared by all the tasks, e.g., the CAS dataset
+        task_args (list): the other arguments of each task
+        scheduler (str, optional): synchronous, threads, processes or distributed. Defaults to DASK_SCHEDULER.
+        num_workers (int, optional): number of workers. Defaults to DASK_WORKERS.
+
+    Returns:
+        list: the output of each task
+    """
+    from dask import compute as dask_compute
+    from dask import delayed as dask_delayed
+    from dask.diagnostics import ProgressBar
+
+    data_key = f"shared-data-{uuid4().hex}"
+
+    logger.info(f"computing {len(task_args)} jobs with the dask {scheduler} scheduler ({num_workers} workers) ...")
+
+    if scheduler in {SYNCHRONOUS_SCHEDULER_KEY, THREADS_SCHEDULER_KEY}:
+        shared_data = dask_delayed(data, name=data_key, traverse=False)
+        jobs = [dask_delayed(task_func, pure=False)(shared_data, *proc_args) for proc_args in task_args]
+        with ProgressBar():
+            return list(dask_compute(*jobs, scheduler=scheduler, num_workers=num_workers))
+
+    if scheduler == PROCESSES_SCHEDULER_KEY:
+        jobs = [dask_delayed(run_shared_task, pure=False)(task_func, data_key, *proc_args) for proc_args in task_args]
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=get_context(DASK_START_METHOD),
+            initializer=init_scheduler_worker,
+            initargs=({data_key: data},),
+        ) as scheduler_pool, ProgressBar():
+            return list(dask_compute(*jobs, scheduler=scheduler, pool=scheduler_pool))
+
+    if scheduler == DISTRIBUTED_SCHEDULER_KEY:
+        try:
+            from distributed import Client, LocalCluster
+        except ImportError:
+            raise Exception("the distributed scheduler requires dask distributed (e.g., conda install distributed)")
+
+        with LocalCluster(
+            n_workers=num_workers, threads_per_worker=1, processes=True, dashboard_address=None
+        ) as cluster, Client(cluster) as client:
+            shared_data = client.scatter(data, broadcast=True)
+            return client.gather(
+                [client.submit(task_func, shared_data, *proc_args, pure=False) for proc_args in task_args]
+            )
+
+    raise Exception(f"scheduler {scheduler} is not supported ...")
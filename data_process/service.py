@@ -0,0 +1,373 @@
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps as json_dumps
+from json import loads as json_loads
+from logging import getLogger
+from threading import Lock
+
+from pandas import CategoricalDtype, Series
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+from pandas.core.frame import DataFrame
+
+from data_process import (CONSTRAIN_KEY, CRASH_YEAR_KEY, FIELD_KEY,
+                          IN_CONSTRAIN_KEY, IS_NULL_CONSTRAIN_KEY,
+                          NOT_CONSTRAIN_KEY, NOT_IN_CONSTRAIN_KEY, QUERY_KEY,
+                          REGION_KEY, SERVICE_CACHE_SIZE, SERVICE_HOST,
+                          SERVICE_MAX_BODY_SIZE, SERVICE_PORT,
+                          SERVICE_QUERY_PATH, SERVICE_STATS_PATH, YEARS_KEY)
+from data_process.aggregate import aggregate_region_year, get_constrain_key
+from data_process.utils import get_constrain_value, get_query_keys
+
+logger = getLogger()
+
+
+def get_service_defaults(data: DataFrame) -> dict:
+    """Get the regions and years in the dataset, they are used when a query does not set them
+
+    Args:
+        data (DataFrame): CAS dataset
+
+    Returns:
+        dict: the regions (names used in the configuration) and the years
+    """
+    region_suffix = " " + REGION_KEY.capitalize()
+    return {
+        "regions": sorted(
+            proc_region[: -len(region_suffix)]
+            for proc_region in data[REGION_KEY].dropna().unique()
+            if proc_region.endswith(region_suffix)
+        ),
+        YEARS_KEY: sorted(int(proc_year) for proc_year in data[CRASH_YEAR_KEY].dropna().unique()),
+    }
+
+
+def coerce_constrain_scalar(column: Series, constrain_scalar):
+    """Coerce a value of a constrain to the type of the column, e.g., "100" -> 100.0 for speedLimit,
+    a value which can not be compared with the column (or a category not in the column) is refused,
+    so the query does not silently match nothing
+
+    Args:
+        column (Series): the constrained column
+        constrain_scalar (object): the value
+
+    Returns:
+        object: the coerced value
+    """
+    if is_numeric_dtype(column.dtype) and not is_bool_dtype(column.dtype):
+        if isinstance(constrain_scalar, bool):
+            raise Exception(f"{column.name} is numeric, got {constrain_scalar}")
+        try:
+            return float(constrain_scalar)
+        except (TypeError, ValueError):
+            raise Exception(f"{column.name} is numeric, got {constrain_scalar}")
+
+    if not isinstance(constrain_scalar, str):
+        raise Exception(f"{column.name} is a string column, got {constrain_scalar}")
+
+    if isinstance(column.dtype, CategoricalDtype) and constrain_scalar not in column.cat.categories:
+        raise Exception(f"{constrain_scalar} is not a value of {column.name}")
+
+    return constrain_scalar
+
+
+def coerce_constrain_value(column: Series, constrain_value):
+    """Coerce all the values of a canonical constrain (see get_constrain_value) to the type of the column
+
+    Args:
+        column (Series): the constrained column
+        constrain_value (object): the canonical constrain
+
+    Returns:
+        object: the canonical constrain with the coerced values
+    """
+    if constrain_value is None:
+        return None
+
+    if not isinstance(constrain_value, dict):
+        return coerce_constrain_scalar(column, constrain_value)
+
+    coerced_value = {}
+    for proc_operator, proc_operand in constrain_value.items():
+        if proc_operator in {IN_CONSTRAIN_KEY, NOT_IN_CONSTRAIN_KEY}:
+            coerced_value[proc_operator] = [coerce_constrain_scalar(column, proc_value) for proc_value in proc_operand]
+        elif proc_operator == NOT_CONSTRAIN_KEY:
+            coerced_value[proc_operator] = coerce_constrain_value(column, proc_operand)
+        elif proc_operator == IS_NULL_CONSTRAIN_KEY:
+            coerced_value[proc_operator] = proc_operand
+        else:
+            coerced_value[proc_operator] = coerce_constrain_scalar(column, proc_operand)
+
+    return get_constrain_value(coerced_value)
+
+
+def parse_query(query: dict, data: DataFrame, defaults: dict) -> dict:
+    """Parse a query, e.g., {"field": "motorcycle", "constrains": {"speedLimit": 100}, "regions": ["Otago"],
+    "years": {"start": 2010, "end": 2021}}, it is the same query as the analysis field {"motorcycle": {"speedLimit": 100}}
+    in a configuration (see get_query_keys), and the regions and years default to all of them in the dataset.
+    The regions and years which are not in the dataset are refused, and the constrain values are
+    coerced to the types of the columns (see coerce_constrain_value)
+
+    Args:
+        query (dict): the query
+        data (DataFrame): CAS dataset
+        defaults (dict): the regions and years in the dataset (from get_service_defaults)
+
+    Returns:
+        dict: the field, the constrains (as in get_query_keys), the regions and the years
+    """
+    if not isinstance(query, dict) or not isinstance(query.get(FIELD_KEY), str):
+        raise Exception(f"the query must be a JSON object with the field (a string), got {query}")
+
+    unknown_keys = set(query) - {FIELD_KEY, "constrains", "regions", YEARS_KEY}
+    if unknown_keys:
+        raise Exception(f"unknown query keys {sorted(unknown_keys)}")
+
+    constrains = query.get("constrains") or None
+    if constrains is not None and not isinstance(constrains, dict):
+        raise Exception(f"the constrains must be a JSON object, e.g., {{\"speedLimit\": 100}}, got {constrains}")
+
+    fields_to_query = get_query_keys({query[FIELD_KEY]: constrains})
+
+    missing_columns = [proc_column for proc_column in fields_to_query[QUERY_KEY] if proc_column not in data.columns]
+    if missing_columns:
+        raise Exception(f"the columns {missing_columns} are not in the dataset")
+
+    regions = query.get("regions") or defaults["regions"]
+    if isinstance(regions, str):
+        regions = [regions]
+    regions = [str(proc_region) for proc_region in regions]
+
+    unknown_regions = [proc_region for proc_region in regions if proc_region not in defaults["regions"]]
+    if unknown_regions:
+        raise Exception(f"the regions {unknown_regions} are not in the dataset")
+
+    years = query.get(YEARS_KEY) or defaults[YEARS_KEY]
+    if isinstance(years, dict):
+        start_year, end_year = int(years["start"]), int(years["end"])
+        # the range is checked before it is expanded, so a huge range is not allocated
+        if start_year > end_year:
+            raise Exception(f"the start year {start_year} is after the end year {end_year}")
+        if start_year < min(defaults[YEARS_KEY]) or end_year > max(defaults[YEARS_KEY]):
+            raise Exception(f"the years {start_year}-{end_year} are not in the dataset")
+        years = list(range(start_year, end_year + 1))
+    years = [int(proc_year) for proc_year in years]
+
+    unknown_years = [proc_year for proc_year in years if proc_year not in defaults[YEARS_KEY]]
+    if unknown_years:
+        raise Exception(f"the years {unknown_years} are not in the dataset")
+
+    return {
+        FIELD_KEY: fields_to_query[QUERY_KEY][0],
+        CONSTRAIN_KEY: [
+            {
+                constrain_name: coerce_constrain_value(data[constrain_name], constrain_value)
+                for constrain_name, constrain_value in proc_constrain.items()
+            }
+            for proc_constrain in fields_to_query[CONSTRAIN_KEY]
+        ],
+        "regions": regions,
+        YEARS_KEY: years,
+    }
+
+
+def get_query_cache_key(parsed_query: dict) -> str:
+    """Get the key of a parsed query in the result cache, the constrains are keyed
+    in the same way as the aggregate store (see get_constrain_key)
+
+    Args:
+        parsed_query (dict): the query from parse_query
+
+    Returns:
+        str: the cache key
+    """
+    return json_dumps(
+        [
+            parsed_query[FIELD_KEY],
+            get_constrain_key(parsed_query[CONSTRAIN_KEY]),
+            parsed_query["regions"],
+            parsed_query[YEARS_KEY],
+        ]
+    )
+
+
+def create_query_cache(max_size: int = SERVICE_CACHE_SIZE) -> dict:
+    """Create the LRU cache of the query results
+
+    Args:
+        max_size (int, optional): maximum number of the cached results. Defaults to SERVICE_CACHE_SIZE.
+
+    Returns:
+        dict: the cache
+    """
+    return {"results": OrderedDict(), "max_size": max_size, "hits": 0, "misses": 0, "lock": Lock()}
+
+
+def compute_query(data: DataFrame, parsed_query: dict) -> dict:
+    """Sum the field for every region and year (with the same grouped pass as the temporal analysis)
+
+    Args:
+        data (DataFrame): CAS dataset
+        parsed_query (dict): the query from parse_query
+
+    Returns:
+        dict: the query, the sums of each region and the total of all the regions
+    """
+    query_values = aggregate_region_year(
+        data,
+        [parsed_query[FIELD_KEY]],
+        parsed_query[CONSTRAIN_KEY],
+        parsed_query["regions"],
+        parsed_query[YEARS_KEY],
+    )[parsed_query[FIELD_KEY]]
+
+    return {
+        FIELD_KEY: parsed_query[FIELD_KEY],
+        "constrains": {
+            constrain_name: constrain_value
+            for proc_constrain in parsed_query[CONSTRAIN_KEY]
+            for constrain_name, constrain_value in proc_constrain.items()
+        },
+        "regions": parsed_query["regions"],
+        YEARS_KEY: parsed_query[YEARS_KEY],
+        "values": {
+            proc_region: query_values[i].tolist() for i, proc_region in enumerate(parsed_query["regions"])
+        },
+        "total": query_values.sum(axis=0).tolist(),
+    }
+
+
+def answer_query(data: DataFrame, query_cache: dict, query: dict, defaults: dict) -> tuple:
+    """Answer a query from the LRU cache, or compute it (and cache the result)
+
+    Args:
+        data (DataFrame): CAS dataset
+        query_cache (dict): the cache from create_query_cache
+        query (dict): the query (see parse_query)
+        defaults (dict): the regions and years in the dataset (from get_service_defaults)
+
+    Returns:
+        tuple: the result (from compute_query), and whether it is from the cache
+    """
+    parsed_query = parse_query(query, data, defaults)
+    query_key = get_query_cache_key(parsed_query)
+
+    with query_cache["lock"]:
+        if query_key in query_cache["results"]:
+            query_cache["results"].move_to_end(query_key)
+            query_cache["hits"] += 1
+            return query_cache["results"][query_key], True
+
+    # the query is computed out of the lock, so the other queries are not blocked
+    query_result = compute_query(data, parsed_query)
+
+    with query_cache["lock"]:
+        query_cache["misses"] += 1
+        query_cache["results"][query_key] = query_result
+        query_cache["results"].move_to_end(query_key)
+        while len(query_cache["results"]) > query_cache["max_size"]:
+            query_cache["results"].popitem(last=False)
+
+    return query_result, False
+
+
+def get_service_stats(server: ThreadingHTTPServer) -> dict:
+    """Get the statistics of the query service
+
+    Args:
+        server (ThreadingHTTPServer): the server from create_query_server
+
+    Returns:
+        dict: the number of rows, the regions and years in the dataset, and the cache statistics
+    """
+    query_cache = server.query_cache
+    with query_cache["lock"]:
+        cache_stats = {
+            "size": len(query_cache["results"]),
+            "max_size": query_cache["max_size"],
+            "hits": query_cache["hits"],
+            "misses": query_cache["misses"],
+        }
+
+    return {"rows": len(server.query_data), **server.query_defaults, "cache": cache_stats}
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """Handle the requests of the query service: POST /query (a JSON query, see parse_query)
+    and GET /stats, the responses are in JSON"""
+
+    def send_json(self, status: int, body: dict):
+        response = json_dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def do_GET(self):
+        if self.path != SERVICE_STATS_PATH:
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+            return
+
+        self.send_json(200, get_service_stats(self.server))
+
+    def do_POST(self):
+        if self.path != SERVICE_QUERY_PATH:
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+            return
+
+        if self.headers.get("Content-Length") is None:
+            self.send_json(411, {"error": "the query has no Content-Length"})
+            return
+
+        try:
+            body_size = int(self.headers["Content-Length"])
+        except ValueError:
+            body_size = -1
+
+        if body_size < 0:
+            self.send_json(400, {"error": f"invalid Content-Length {self.headers['Content-Length']}"})
+            return
+
+        if body_size > SERVICE_MAX_BODY_SIZE:
+            self.send_json(413, {"error": f"the query is larger than {SERVICE_MAX_BODY_SIZE} bytes"})
+            return
+
+        try:
+            query_result, cached = answer_query(
+                self.server.query_data,
+                self.server.query_cache,
+                json_loads(self.rfile.read(body_size) or b"null"),
+                self.server.query_defaults,
+            )
+        except Exception as query_error:
+            self.send_json(400, {"error": str(query_error)})
+            return
+
+        self.send_json(200, {**query_result, "cached": cached})
+
+    def log_message(self, format: str, *args):
+        logger.info(f"{self.address_string()} - {format % args}")
+
+
+def create_query_server(
+    data: DataFrame, host: str = SERVICE_HOST, port: int = SERVICE_PORT, cache_size: int = SERVICE_CACHE_SIZE
+) -> ThreadingHTTPServer:
+    """Create the query service, each request is handled in its own thread,
+    and all of them share the dataset and the result cache
+
+    Args:
+        data (DataFrame): CAS dataset (loaded once)
+        host (str, optional): the host to bind, the service is local by default. Defaults to SERVICE_HOST.
+        port (int, optional): the port to bind, 0 for any free port. Defaults to SERVICE_PORT.
+        cache_size (int, optional): maximum number of the cached results. Defaults to SERVICE_CACHE_SIZE.
+
+    Returns:
+        ThreadingHTTPServer: the server, it is started by serve_forever()
+    """
+    server = ThreadingHTTPServer((host, port), QueryRequestHandler)
+    server.daemon_threads = True
+    server.query_data = data
+    server.query_cache = create_query_cache(max_size=cache_size)
+    server.query_defaults = get_service_defaults(data)
+
+    return server
@@ -1,61 +1,226 @@
 from logging import getLogger
 
-from dask import compute as dask_compute
-from dask import delayed as dask_delayed
-from dask.diagnostics import ProgressBar
+from numpy import array, isnan
+from pandas import MultiIndex, Series
 from pandas.core.frame import DataFrame
 
 from data_process import (ANALYSIS_FILEDS_KEY, CENSUS_YEAR_KEY, CONSTRAIN_KEY,
-                          CRASH_YEAR_KEY, MEASURE_KEY, POPULATION_MEASURE,
-                          QUERY_KEY, REGION_KEY, VALUE_KEY, YEAR_KEY)
+                          CRASH_YEAR_KEY, DASK_ENGINE_KEY, DASK_SCHEDULER,
+                          DASK_WORKERS, GROUPBY_ENGINE_KEY, MEASURE_KEY,
+                          POPULATION_MEASURE, QUERY_KEY, REGION_KEY,
+                          VALUE_KEY, YEAR_KEY)
+from data_process.aggregate import (aggregate_region_year,
+                                    aggregate_region_year_from_store,
+                                    get_constrain_mask, get_region_name,
+                                    group_fields_by_constrains)
+from data_process.instrument import instrument
+from data_process.memo import (load_memo_values, log_query_memo,
+                               memoize_region_year, save_memo_values)
+from data_process.scheduler import compute_tasks, get_scheduler_options
 from data_process.utils import get_query_keys
 
 logger = getLogger()
 
-def create_spatial(data: DataFrame, population: DataFrame, cfg: dict, num_workers=4) -> dict:
+@instrument(
+    "create_spatial", rows=lambda inputs, output: None if inputs["data"] is None else len(inputs["data"])
+)
+def create_spatial(
+    data: DataFrame or None,
+    population: DataFrame,
+    cfg: dict,
+    num_workers: int or None = None,
+    store: DataFrame or None = None,
+    engine: str = GROUPBY_ENGINE_KEY,
+    scheduler: str or None = None,
+    memo: dict or None = None,
+) -> dict:
     """Create timeseries data
 
     Args:
-        data (DataFrame): decoded data
+        data (DataFrame or None): decoded data (not used if store is provided)
         cfg (dict): configuration file
-        num_workers (int, optional): multiprocessing processors. Defaults to 4.
+        num_workers (int or None, optional): number of workers (only used by the dask engine),
+            None for the configuration or DASK_WORKERS. Defaults to None.
+        store (DataFrame or None, optional): the aggregate store (from update_aggregate_store),
+            if it is provided, the sums are taken from it (so the engine is not used). Defaults to None.
+        engine (str, optional): groupby (one grouped pass for each distinct set of constrains)
+            or dask (one task for each field, region and year). Defaults to groupby.
+        scheduler (str or None, optional): the dask scheduler (only used by the dask engine),
+            None for the configuration or DASK_SCHEDULER. Defaults to None.
+        memo (dict or None, optional): the query memo (from open_query_memo), only the sums
+            which are not memoized are computed. Defaults to None.
 
     Returns:
         dict: the dict contains timeseries data
     """
+    if engine not in {GROUPBY_ENGINE_KEY, DASK_ENGINE_KEY}:
+        raise Exception(f"spatial engine {engine} is not supported ...")
+
+    fields_to_query = {
+        field_name: get_query_keys(cfg[ANALYSIS_FILEDS_KEY][field_name]) for field_name in cfg[ANALYSIS_FILEDS_KEY]
+    }
+
+    population_value = 1.0
+    if population is not None:
+        population_value = obtain_population_value(
+            create_population_lookup(population), cfg[REGION_KEY], cfg[YEAR_KEY]
+        )
+
+    if store is None and engine == DASK_ENGINE_KEY:
+        scheduler, num_workers = get_scheduler_options(cfg, scheduler=scheduler, num_workers=num_workers)
+        grouped_sums = create_spatial_with_dask(data, cfg, scheduler=scheduler, num_workers=num_workers, memo=memo)
+    else:
+        grouped_sums = {}
+        for proc_group in group_fields_by_constrains(fields_to_query).values():
+
+            logger.info(f"computing fields {list(proc_group['fields'].keys())} with one grouped pass ...")
+
+            proc_outputs = memoize_region_year(
+                memo,
+                aggregate_region_year if store is None else aggregate_region_year_from_store,
+                data if store is None else store,
+                list(proc_group["fields"].values()),
+                proc_group[CONSTRAIN_KEY],
+                cfg[REGION_KEY],
+                cfg[YEAR_KEY],
+            )
+            for field_name, query_field in proc_group["fields"].items():
+                grouped_sums[field_name] = proc_outputs[query_field]
+
+    log_query_memo(memo)
+
+    grouped_outputs = {field_name: grouped_sums[field_name] / population_value for field_name in grouped_sums}
 
     analysis_fields_data = {}
 
     for field_name in cfg[ANALYSIS_FILEDS_KEY]:
 
-        proc_field = cfg[ANALYSIS_FILEDS_KEY][field_name]
-        proc_field_name = list(proc_field.keys())[0]
-        
-        analysis_fields_data[field_name] = {}
-        fields_to_query = get_query_keys(proc_field)
+        proc_field_name = fields_to_query[field_name][QUERY_KEY][0]
+
+        analysis_fields_data[field_name] = {proc_field_name: {}}
 
-        analysis_fields_data[field_name][proc_field_name] = {}
+        for i, proc_region in enumerate(cfg[REGION_KEY]):
+            analysis_fields_data[field_name][proc_field_name][proc_region] = dict(
+                zip(cfg[YEAR_KEY], grouped_outputs[field_name][i].tolist())
+            )
 
-        for proc_region in cfg[REGION_KEY]:
+    return analysis_fields_data
 
-            analysis_fields_data[field_name][proc_field_name][proc_region] = {}
 
-            for proc_year in cfg[YEAR_KEY]:
-                
-                analysis_fields_data[field_name][proc_field_name][proc_region][proc_year] = extract_spatial_dataset(
-                        data, population, proc_region, proc_year, fields_to_query
-                    )
+def create_spatial_with_dask(
+    data: DataFrame,
+    cfg: dict,
+    scheduler: str = DASK_SCHEDULER,
+    num_workers: int = DASK_WORKERS,
+    memo: dict or None = None,
+) -> dict:
+    """Sum the fields with one dask task for each field, region and year (which is not in the query memo)
 
-    return analysis_fields_data
+    Args:
+        data (DataFrame): decoded data
+        cfg (dict): configuration file
+        scheduler (str, optional): the dask scheduler (see compute_tasks). Defaults to DASK_SCHEDULER.
+        num_workers (int, optional): number of workers. Defaults to DASK_WORKERS.
+        memo (dict or None, optional): the query memo (from open_query_memo). Defaults to None.
+
+    Returns:
+        dict: the 2d sums (region x year) of each field
+    """
+    fields_to_query = {
+        field_name: get_query_keys(cfg[ANALYSIS_FILEDS_KEY][field_name]) for field_name in cfg[ANALYSIS_FILEDS_KEY]
+    }
+
+    outputs = {
+        field_name: load_memo_values(
+            memo,
+            fields_to_query[field_name][QUERY_KEY][0],
+            fields_to_query[field_name][CONSTRAIN_KEY],
+            cfg[REGION_KEY],
+            cfg[YEAR_KEY],
+        )
+        for field_name in fields_to_query
+    }
+
+    task_cells = [
+        (field_name, i, j)
+        for field_name in fields_to_query
+        for i in range(len(cfg[REGION_KEY]))
+        for j in range(len(cfg[YEAR_KEY]))
+        if isnan(outputs[field_name][i, j])
+    ]
+
+    if task_cells:
+        task_args = [
+            (None, cfg[REGION_KEY][i], cfg[YEAR_KEY][j], fields_to_query[field_name]) for field_name, i, j in task_cells
+        ]
+        task_outputs = compute_tasks(
+            extract_spatial_dataset, data, task_args, scheduler=scheduler, num_workers=num_workers
+        )
+        for (field_name, i, j), proc_output in zip(task_cells, task_outputs):
+            outputs[field_name][i, j] = proc_output
+
+        for field_name in fields_to_query:
+            save_memo_values(
+                memo,
+                fields_to_query[field_name][QUERY_KEY][0],
+                fields_to_query[field_name][CONSTRAIN_KEY],
+                cfg[REGION_KEY],
+                cfg[YEAR_KEY],
+                outputs[field_name],
+            )
+
+    return outputs
+
+
+def create_population_lookup(population: DataFrame) -> Series:
+    """Create the (region, census year) -> population lookup table
+
+    Args:
+        population (DataFrame): population dataset (in Dataframe) to be used
+
+    Returns:
+        Series: the population indexed by region and census year
+    """
+    population_lookup = population.loc[
+        population[MEASURE_KEY.capitalize()] == POPULATION_MEASURE,
+        [REGION_KEY.capitalize(), CENSUS_YEAR_KEY, VALUE_KEY.capitalize()],
+    ]
+    population_lookup = population_lookup.astype({CENSUS_YEAR_KEY: str}).set_index(
+        [REGION_KEY.capitalize(), CENSUS_YEAR_KEY]
+    )[VALUE_KEY.capitalize()]
+
+    return population_lookup[~population_lookup.index.duplicated(keep="first")]
+
+
+def obtain_population_value(population_lookup: Series, regions: list, years: list) -> array:
+    """Obtain the population for every region and year
+
+    Args:
+        population_lookup (Series): the lookup table from create_population_lookup
+        regions (list): regions to be used
+        years (list): years to be used
+
+    Returns:
+        array: 2d population (region x year)
+    """
+    population_value = population_lookup.reindex(
+        MultiIndex.from_product([regions, [str(proc_year) for proc_year in years]])
+    )
+
+    if population_value.isna().any():
+        missing_keys = population_value.index[population_value.isna()].tolist()
+        raise Exception(f"not able to find the population for {missing_keys}")
+
+    return population_value.to_numpy(dtype=float).reshape(len(regions), len(years))
 
 
 def extract_spatial_dataset(
     data: DataFrame, population: DataFrame or None, data_region: str, data_year: int, fields_to_query: dict,
 ) -> int:
-    """extract dataset based on required keys
+    """extract dataset based on required keys, the constrains, region and year are compiled into one row mask
 
     Args:
-        df (DataFrame): cas dataset (in Dataframe) to be used
+        df (DataFrame): cas dataset (in Dataframe), or the crash cube, to be used
         population (DataFrame): population dataset (in Dataframe) to be used
         data_field (str): fields to be queried, e.g., suv
 
@@ -63,17 +228,9 @@ def extract_spatial_dataset(
         dict: the dict contains the required dataset
     """
 
-    grouped_data = data[fields_to_query[QUERY_KEY]]
-
-    grouped_data = grouped_data.loc[grouped_data[CRASH_YEAR_KEY] == data_year].loc[
-        grouped_data[REGION_KEY] == data_region + " " + REGION_KEY.capitalize()
-    ]
-
-    for proc_constrain in fields_to_query[CONSTRAIN_KEY]:
-        constrain_name = list(proc_constrain.keys())[0]
-        grouped_data = grouped_data.loc[
-            grouped_data[constrain_name] == proc_constrain[constrain_name]
-        ]
+    data_mask = get_constrain_mask(data, fields_to_query[CONSTRAIN_KEY])
+    data_mask &= (data[CRASH_YEAR_KEY] == data_year).to_numpy()
+    data_mask &= (data[REGION_KEY] == get_region_name(data_region)).to_numpy()
     
     if population is not None:
         grouped_population = population[[REGION_KEY.capitalize(), VALUE_KEY.capitalize(), MEASURE_KEY.capitalize(), CENSUS_YEAR_KEY]]
@@ -84,5 +241,5 @@ def extract_spatial_dataset(
     else:
         population_value = 1.0
 
-    return grouped_data[fields_to_query[QUERY_KEY][0]].sum()/population_value
+    return data.loc[data_mask, fields_to_query[QUERY_KEY][0]].sum()/population_value
         
@@ -0,0 +1,317 @@
+from json import dump as json_dump
+from json import dumps as json_dumps
+from json import load as json_load
+from logging import getLogger
+from os import makedirs, replace
+from os.path import basename, dirname, exists, join, splitext
+
+from pandas import DataFrame, MultiIndex, concat, read_parquet
+from pandas.util import hash_pandas_object
+
+from data_process import (AGGREGATE_STORE_COLUMNS, AGGREGATE_STORE_FILENAME,
+                          ANALYSIS_FILEDS_KEY, COLUMN_SETS_KEY, CONSTRAIN_KEY,
+                          CRASH_YEAR_KEY, FIELD_KEY, FINGERPRINT_KEY,
+                          REGION_KEY, VALUE_KEY, YEAR_FINGERPRINT_FILENAME,
+                          YEAR_KEY)
+from data_process.aggregate import (aggregate_region_year,
+                                    group_fields_by_constrains)
+from data_process.cube import read_crash_dataset
+from data_process.instrument import instrument
+from data_process.utils import (get_file_fingerprint, get_query_keys,
+                                read_dataset)
+
+logger = getLogger()
+
+
+def get_columns_key(columns: list) -> str:
+    """Get the key of a set of columns, e.g., ["speedLimit", "bicycle"] -> '["bicycle", "speedLimit"]'
+
+    Args:
+        columns (list): the columns
+
+    Returns:
+        str: the key
+    """
+    return json_dumps(sorted(set(columns)))
+
+
+def get_cells_column_sets(cfg: dict) -> list:
+    """Get the column sets used by the cells of the analysis fields in a configuration,
+    a cell uses its field, the region, the year and the columns of its constrains
+
+    Args:
+        cfg (dict): analysis configuration
+
+    Returns:
+        list: the column sets, e.g., [["bicycle", "crashYear", "region", "speedLimit"]]
+    """
+    fields_to_query = {
+        field_name: get_query_keys(cfg[ANALYSIS_FILEDS_KEY][field_name]) for field_name in cfg[ANALYSIS_FILEDS_KEY]
+    }
+
+    column_sets = {}
+    for proc_group in group_fields_by_constrains(fields_to_query).values():
+        constrain_columns = [list(proc_constrain.keys())[0] for proc_constrain in proc_group[CONSTRAIN_KEY]]
+        for query_field in proc_group["fields"].values():
+            proc_columns = [query_field, REGION_KEY, CRASH_YEAR_KEY] + constrain_columns
+            column_sets[get_columns_key(proc_columns)] = sorted(set(proc_columns))
+
+    return list(column_sets.values())
+
+
+def get_year_fingerprints(data: DataFrame, column_sets: list) -> dict:
+    """Get the fingerprint of the rows of each year for each set of columns, the rows are
+    hashed over all the columns of the set (so moving a value to another row changes the fingerprint),
+    and the fingerprint does not depend on the order of the rows
+
+    Args:
+        data (DataFrame): CAS dataset
+        column_sets (list): the column sets, e.g., [["bicycle", "crashYear", "region"]]
+
+    Returns:
+        dict: {columns key: {year: fingerprint}}
+    """
+    year_fingerprints = {}
+    data_years = data[CRASH_YEAR_KEY].to_numpy()
+    for proc_columns in column_sets:
+        # the sum of the row hashes (wrapped at 2**64) is independent of the row order
+        row_hashes = (
+            hash_pandas_object(data[sorted(set(proc_columns))], index=False)
+            .groupby(data_years)
+            .agg(["sum", "count"])
+        )
+        year_fingerprints[get_columns_key(proc_columns)] = {
+            str(int(proc_year)): f"{int(hash_count)}-{int(hash_sum):016x}"
+            for proc_year, hash_sum, hash_count in zip(
+                row_hashes.index, row_hashes["sum"].to_numpy(), row_hashes["count"].to_numpy()
+            )
+        }
+
+    return year_fingerprints
+
+
+def get_year_fingerprint_path(data_path: str) -> str:
+    """Get the path of the year fingerprints of a dataset, e.g., /tmp/cas.csv -> /tmp/cas.years.json
+
+    Args:
+        data_path (str): the dataset path
+
+    Returns:
+        str: the path of the year fingerprints
+    """
+    return join(dirname(data_path), YEAR_FINGERPRINT_FILENAME.format(data_name=splitext(basename(data_path))[0]))
+
+
+def read_year_fingerprints(data_path: str) -> dict:
+    """Read the year fingerprints saved next to a dataset, they are dropped if the dataset has been changed
+
+    Args:
+        data_path (str): the dataset path
+
+    Returns:
+        dict: {columns key: {year: fingerprint}}
+    """
+    fingerprint_path = get_year_fingerprint_path(data_path)
+
+    if not exists(fingerprint_path):
+        return {}
+
+    with open(fingerprint_path) as fid:
+        fingerprint_meta = json_load(fid)
+
+    if fingerprint_meta.get(FINGERPRINT_KEY) != get_file_fingerprint(data_path):
+        return {}
+
+    return fingerprint_meta.get(COLUMN_SETS_KEY, {})
+
+
+def create_year_fingerprints(data_path: str, column_sets: list) -> dict:
+    """Create the year fingerprints of a dataset for the column sets, and save them next to the dataset
+    (together with the fingerprints of the other column sets which are already saved)
+
+    Args:
+        data_path (str): the dataset path
+        column_sets (list): the column sets, e.g., [["bicycle", "crashYear", "region"]]
+
+    Returns:
+        dict: {columns key: {year: fingerprint}}
+    """
+    used_columns = sorted({proc_column for proc_columns in column_sets for proc_column in proc_columns})
+    year_fingerprints = {
+        **read_year_fingerprints(data_path),
+        **get_year_fingerprints(read_dataset(data_path, use_cache=True, columns=used_columns), column_sets),
+    }
+
+    fingerprint_path = get_year_fingerprint_path(data_path)
+    with open(fingerprint_path + ".tmp", "w") as fid:
+        json_dump({FINGERPRINT_KEY: get_file_fingerprint(data_path), COLUMN_SETS_KEY: year_fingerprints}, fid)
+    replace(fingerprint_path + ".tmp", fingerprint_path)
+
+    logger.info(f"the fingerprints of {len(column_sets)} column sets are saved to {fingerprint_path} ...")
+
+    return year_fingerprints
+
+
+def load_year_fingerprints(data_path: str, column_sets: list) -> dict:
+    """Load the year fingerprints of a dataset, the missing column sets are fingerprinted
+    (and all of them are fingerprinted again if the dataset has been changed)
+
+    Args:
+        data_path (str): the dataset path
+        column_sets (list): the column sets, e.g., [["bicycle", "crashYear", "region"]]
+
+    Returns:
+        dict: {columns key: {year: fingerprint}}
+    """
+    year_fingerprints = read_year_fingerprints(data_path)
+
+    missing_column_sets = [
+        proc_columns for proc_columns in column_sets if get_columns_key(proc_columns) not in year_fingerprints
+    ]
+    if not missing_column_sets:
+        return year_fingerprints
+
+    return create_year_fingerprints(data_path, missing_column_sets)
+
+
+def get_cells_fingerprint(year_fingerprints: dict, year: int, columns: list) -> str:
+    """Get the fingerprint of the source rows of the cells of one year
+
+    Args:
+        year_fingerprints (dict): {columns key: {year: fingerprint}}
+        year (int): the year of the cells
+        columns (list): the columns used to compute the cells
+
+    Returns:
+        str: the fingerprint
+    """
+    return json_dumps(year_fingerprints.get(get_columns_key(columns), {}).get(str(year)))
+
+
+def load_aggregate_store(work_dir: str) -> DataFrame:
+    """Load the aggregate store in the working directory
+
+    Args:
+        work_dir (str): working directory
+
+    Returns:
+        DataFrame: the aggregate store, one row for each (field, constrains, region, year) cell
+    """
+    store_path = join(work_dir, AGGREGATE_STORE_FILENAME)
+    if not exists(store_path):
+        return DataFrame(columns=AGGREGATE_STORE_COLUMNS)
+
+    return read_parquet(store_path)
+
+
+def write_aggregate_store(work_dir: str, store: DataFrame):
+    """Write the aggregate store to the working directory
+
+    Args:
+        work_dir (str): working directory
+        store (DataFrame): the aggregate store
+    """
+    makedirs(work_dir, exist_ok=True)
+    store_path = join(work_dir, AGGREGATE_STORE_FILENAME)
+    store.to_parquet(store_path + ".tmp", index=False)
+    replace(store_path + ".tmp", store_path)
+
+
+@instrument("update_aggregate_store", rows=lambda inputs, output: len(output))
+def update_aggregate_store(work_dir: str, data_path: str, cfg: dict, chunksize: int or None = None) -> DataFrame:
+    """Update the aggregate store for the analysis fields in the configuration: the cells are
+    reused if the source rows (the columns used by the cell, in the same year) are not changed,
+    and only the years with changed (or missing) cells are read and aggregated again
+
+    Args:
+        work_dir (str): working directory
+        data_path (str): the dataset path
+        cfg (dict): analysis configuration
+        chunksize (int or None, optional): if it is defined, the dataset is streamed in chunks. Defaults to None.
+
+    Returns:
+        DataFrame: the aggregate store
+    """
+    year_fingerprints = load_year_fingerprints(data_path, get_cells_column_sets(cfg))
+    store = load_aggregate_store(work_dir)
+
+    fields_to_query = {
+        field_name: get_query_keys(cfg[ANALYSIS_FILEDS_KEY][field_name]) for field_name in cfg[ANALYSIS_FILEDS_KEY]
+    }
+
+    expected_cells = []
+    for constrain_key, proc_group in group_fields_by_constrains(fields_to_query).items():
+        constrain_columns = [list(proc_constrain.keys())[0] for proc_constrain in proc_group[CONSTRAIN_KEY]]
+        for query_field in dict.fromkeys(proc_group["fields"].values()):
+            for proc_year in cfg[YEAR_KEY]:
+                proc_fingerprint = get_cells_fingerprint(
+                    year_fingerprints, proc_year, [query_field, REGION_KEY, CRASH_YEAR_KEY] + constrain_columns
+                )
+                expected_cells.extend(
+                    [
+                        (query_field, constrain_key, proc_region, proc_year, proc_fingerprint)
+                        for proc_region in cfg[REGION_KEY]
+                    ]
+                )
+
+    cell_keys = [FIELD_KEY, CONSTRAIN_KEY, REGION_KEY, CRASH_YEAR_KEY]
+    expected_cells = DataFrame(expected_cells, columns=cell_keys + [FINGERPRINT_KEY])
+    stored_fingerprints = store.set_index(cell_keys)[FINGERPRINT_KEY]
+    stale_mask = (
+        stored_fingerprints.reindex(MultiIndex.from_frame(expected_cells[cell_keys])).to_numpy()
+        != expected_cells[FINGERPRINT_KEY].to_numpy()
+    )
+    stale_cells = expected_cells[stale_mask]
+
+    logger.info(f"aggregate store: {len(expected_cells) - len(stale_cells)} of {len(expected_cells)} cells are reused ...")
+
+    if len(stale_cells) == 0:
+        return store
+
+    stale_years = sorted(stale_cells[CRASH_YEAR_KEY].unique().tolist())
+
+    logger.info(f"aggregate store: the years {stale_years} are aggregated again ...")
+
+    data = read_crash_dataset(data_path, {**cfg, YEAR_KEY: stale_years}, chunksize=chunksize)
+
+    updated_cells = []
+    for constrain_key, proc_group in group_fields_by_constrains(fields_to_query).items():
+        proc_stale_cells = stale_cells[stale_cells[CONSTRAIN_KEY] == constrain_key]
+        if len(proc_stale_cells) == 0:
+            continue
+
+        proc_fields = proc_stale_cells[FIELD_KEY].unique().tolist()
+        proc_years = sorted(proc_stale_cells[CRASH_YEAR_KEY].unique().tolist())
+        proc_outputs = aggregate_region_year(data, proc_fields, proc_group[CONSTRAIN_KEY], cfg[REGION_KEY], proc_years)
+
+        proc_cells = expected_cells[
+            (expected_cells[CONSTRAIN_KEY] == constrain_key)
+            & expected_cells[FIELD_KEY].isin(proc_fields)
+            & expected_cells[CRASH_YEAR_KEY].isin(proc_years)
+        ].set_index([FIELD_KEY, REGION_KEY, CRASH_YEAR_KEY])
+        proc_values = DataFrame(
+            {
+                VALUE_KEY: [
+                    proc_value
+                    for proc_field in proc_fields
+                    for proc_value in proc_outputs[proc_field].astype(float).ravel()
+                ]
+            },
+            index=MultiIndex.from_product(
+                [proc_fields, cfg[REGION_KEY], proc_years], names=[FIELD_KEY, REGION_KEY, CRASH_YEAR_KEY]
+            ),
+        )
+        updated_cells.append(proc_cells.join(proc_values).reset_index()[AGGREGATE_STORE_COLUMNS])
+
+    updated_cells = concat(updated_cells, ignore_index=True)
+
+    # the updated cells replace the stored ones
+    unchanged_mask = ~MultiIndex.from_frame(store[cell_keys]).isin(MultiIndex.from_frame(updated_cells[cell_keys]))
+    store = concat([store[unchanged_mask], updated_cells], ignore_index=True).astype(
+        {CRASH_YEAR_KEY: int, VALUE_KEY: float}
+    )
+
+    write_aggregate_store(work_dir, store)
+
+    return store
+
@@ -0,0 +1,121 @@
+from logging import getLogger
+from os import makedirs, replace
+from os.path import abspath, dirname
+
+from numpy import arange, asarray, nan
+from numpy.random import default_rng
+from pandas.core.frame import DataFrame
+from pyarrow import Table
+from pyarrow.csv import CSVWriter, WriteOptions
+
+from data_process import (CRASH_YEAR_KEY, MISSING_DATA, REGION_KEY,
+                          STR2DIGIT_MAPPING, SYNTHETIC_CHUNK_SIZE,
+                          SYNTHETIC_MEASURE_RATES, SYNTHETIC_MISSING_RATE,
+                          SYNTHETIC_REGIONS, SYNTHETIC_SPEED_LIMITS,
+                          SYNTHETIC_YEARS, X_KEY, Y_KEY)
+from data_process.aggregate import get_region_name
+
+logger = getLogger()
+
+
+def get_category_weights(num_categories: int):
+    """Get the weights of the categories, the first category is the most common one
+    and each following category is half as common as the previous one
+
+    Args:
+        num_categories (int): number of categories
+
+    Returns:
+        array: the weights (sum to 1)
+    """
+    weights = 0.5 ** arange(num_categories)
+    return weights / weights.sum()
+
+
+def create_synthetic_chunk(
+    rng,
+    start_id: int,
+    num_rows: int,
+    regions: dict = SYNTHETIC_REGIONS,
+    years: list = SYNTHETIC_YEARS,
+    missing_rate: float = SYNTHETIC_MISSING_RATE,
+) -> DataFrame:
+    """Create a chunk of the synthetic CAS dataset
+
+    Args:
+        rng (Generator): the random generator of the chunk
+        start_id (int): OBJECTID of the first row
+        num_rows (int): number of rows
+        regions (dict, optional): {region: share of the crashes}. Defaults to SYNTHETIC_REGIONS.
+        years (list, optional): crash years. Defaults to SYNTHETIC_YEARS.
+        missing_rate (float, optional): the ratio of the missing values in each column. Defaults to SYNTHETIC_MISSING_RATE.
+
+    Returns:
+        DataFrame: the synthetic CAS dataset, with the same columns as the CSV from NZTA
+    """
+    region_weights = asarray(list(regions.values()), dtype=float)
+    region_names = asarray([get_region_name(proc_region) for proc_region in regions], dtype=object)
+
+    data = DataFrame(
+        {
+            X_KEY: rng.uniform(1090000.0, 2090000.0, num_rows),
+            Y_KEY: rng.uniform(4750000.0, 6200000.0, num_rows),
+            "OBJECTID": arange(start_id, start_id + num_rows),
+            CRASH_YEAR_KEY: rng.choice(asarray(years), num_rows),
+            REGION_KEY: rng.choice(region_names, num_rows, p=region_weights / region_weights.sum()),
+        }
+    )
+    data.loc[rng.random(num_rows) < missing_rate, REGION_KEY] = nan
+
+    for proc_feature in STR2DIGIT_MAPPING:
+        proc_categories = asarray(list(STR2DIGIT_MAPPING[proc_feature]), dtype=object)
+        data[proc_feature] = rng.choice(proc_categories, num_rows, p=get_category_weights(len(proc_categories)))
+        if MISSING_DATA[proc_feature]:
+            data.loc[rng.random(num_rows) < missing_rate, proc_feature] = MISSING_DATA[proc_feature][0]
+
+    data["NumberOfLanes"] = rng.choice(asarray([2.0, 1.0, 4.0, 3.0]), num_rows, p=get_category_weights(4))
+    data["speedLimit"] = rng.choice(asarray(SYNTHETIC_SPEED_LIMITS, dtype=float), num_rows)
+    for proc_column in ["NumberOfLanes", "speedLimit"]:
+        data.loc[rng.random(num_rows) < missing_rate, proc_column] = nan
+
+    for proc_measure, proc_rate in SYNTHETIC_MEASURE_RATES.items():
+        data[proc_measure] = rng.poisson(proc_rate, num_rows)
+
+    return data
+
+
+def create_synthetic_dataset(
+    data_path: str, num_rows: int, seed: int = 0, chunksize: int = SYNTHETIC_CHUNK_SIZE
+) -> str:
+    """Create a synthetic CAS dataset (CSV), the rows are created and written (with the arrow CSV writer)
+    chunk by chunk so the memory does not grow with num_rows, and the dataset only depends on
+    seed and chunksize (the chunk i is created with the seed [seed, i])
+
+    Args:
+        data_path (str): the path of the synthetic dataset
+        num_rows (int): number of rows
+        seed (int, optional): random seed. Defaults to 0.
+        chunksize (int, optional): number of rows in each chunk. Defaults to SYNTHETIC_CHUNK_SIZE.
+
+    Returns:
+        str: the path of the synthetic dataset
+    """
+    makedirs(dirname(abspath(data_path)), exist_ok=True)
+
+    csv_writer = None
+    for i, start_id in enumerate(range(0, num_rows, chunksize)):
+        proc_chunk = Table.from_pandas(
+            create_synthetic_chunk(default_rng([seed, i]), start_id, min(chunksize, num_rows - start_id)),
+            preserve_index=False,
+        )
+        if csv_writer is None:
+            csv_schema = proc_chunk.schema
+            csv_writer = CSVWriter(data_path + ".tmp", csv_schema, write_options=WriteOptions(quoting_style="needed"))
+        csv_writer.write_table(proc_chunk.cast(csv_schema))
+    csv_writer.close()
+
+    replace(data_path + ".tmp", data_path)
+
+    logger.info(f"{num_rows} synthetic rows are written to {data_path} ...")
+
+    return data_path
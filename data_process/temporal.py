@@ -1,15 +1,24 @@
 from logging import getLogger
+from os.path import join
 
-from dask import compute as dask_compute
-from dask import delayed as dask_delayed
-from dask.diagnostics import ProgressBar
-from numpy import array, asarray, linspace
+from numpy import (absolute, arange, array, asarray, errstate, full, isnan,
+                   nan, sqrt)
 from numpy import sum as numpy_sum
 from pandas.core.frame import DataFrame
-from sklearn.linear_model import LinearRegression
 
 from data_process import (ANALYSIS_FILEDS_KEY, CONSTRAIN_KEY, CRASH_YEAR_KEY,
-                          QUERY_KEY, REGION_KEY, YEAR_KEY)
+                          DASK_ENGINE_KEY, DASK_SCHEDULER, DASK_WORKERS,
+                          FIELD_KEY, GROUPBY_ENGINE_KEY, QUERY_KEY,
+                          REGION_KEY, TEMPORAL_TREND_FILENAME,
+                          TREND_TOTAL_KEY, YEAR_KEY)
+from data_process.aggregate import (aggregate_region_year,
+                                    aggregate_region_year_from_store,
+                                    get_constrain_mask, get_region_name,
+                                    group_fields_by_constrains)
+from data_process.instrument import instrument
+from data_process.memo import (load_memo_values, log_query_memo,
+                               memoize_region_year, save_memo_values)
+from data_process.scheduler import compute_tasks, get_scheduler_options
 from data_process.utils import get_query_keys
 
 logger = getLogger()
@@ -19,106 +28,262 @@ logger = getLogger()
 def extract_temporal_dataset(
     data: DataFrame, data_region: str, data_year: int, fields_to_query: dict
 ) -> int:
-    """extract dataset based on required keys
+    """extract dataset based on required keys, the constrains, region and year are compiled into one row mask
 
     Args:
-        df ([type]): dataset (in Dataframe) to be used
+        df ([type]): dataset (in Dataframe), or the crash cube, to be used
         fields_to_query (dict): fields to be queried
 
     Returns:
         dict: the dict contains the required dataset
     """
 
-    grouped_data = data[fields_to_query[QUERY_KEY]]
+    data_mask = get_constrain_mask(data, fields_to_query[CONSTRAIN_KEY])
+    data_mask &= (data[CRASH_YEAR_KEY] == data_year).to_numpy()
+    data_mask &= (data[REGION_KEY] == get_region_name(data_region)).to_numpy()
+
+    return data.loc[data_mask, fields_to_query[QUERY_KEY][0]].sum()
+
+
+@instrument(
+    "create_time_series", rows=lambda inputs, output: None if inputs["data"] is None else len(inputs["data"])
+)
+def create_time_series(
+    data: DataFrame or None,
+    cfg: dict,
+    num_workers: int or None = None,
+    engine: str = GROUPBY_ENGINE_KEY,
+    store: DataFrame or None = None,
+    scheduler: str or None = None,
+    memo: dict or None = None,
+) -> dict:
+    """Create timeseries data
 
-    grouped_data = grouped_data.loc[grouped_data[CRASH_YEAR_KEY] == data_year].loc[
-        grouped_data[REGION_KEY] == data_region + " " + REGION_KEY.capitalize()
-    ]
+    Args:
+        data (DataFrame or None): decoded data (not used if store is provided)
+        cfg (dict): configuration file
+        num_workers (int or None, optional): number of workers (only used by the dask engine),
+            None for the configuration or DASK_WORKERS. Defaults to None.
+        engine (str, optional): groupby (one grouped pass for each distinct set of constrains)
+            or dask (one task for each field, region and year). Defaults to groupby.
+        store (DataFrame or None, optional): the aggregate store (from update_aggregate_store),
+            if it is provided, the timeseries are taken from it (so the engine is not used). Defaults to None.
+        scheduler (str or None, optional): the dask scheduler (only used by the dask engine),
+            None for the configuration or DASK_SCHEDULER. Defaults to None.
+        memo (dict or None, optional): the query memo (from open_query_memo), only the sums
+            which are not memoized are computed. Defaults to None.
 
-    for proc_constrain in fields_to_query[CONSTRAIN_KEY]:
-        constrain_name = list(proc_constrain.keys())[0]
-        grouped_data = grouped_data.loc[
-            grouped_data[constrain_name] == proc_constrain[constrain_name]
-        ]
+    Returns:
+        dict: the dict contains timeseries data
+    """
+    if engine not in {GROUPBY_ENGINE_KEY, DASK_ENGINE_KEY}:
+        raise Exception(f"temporal engine {engine} is not supported ...")
 
-    return grouped_data[fields_to_query[QUERY_KEY][0]].sum()
+    if store is None and engine == DASK_ENGINE_KEY:
+        scheduler, num_workers = get_scheduler_options(cfg, scheduler=scheduler, num_workers=num_workers)
+        analysis_fields_data = create_time_series_with_dask(
+            data, cfg, scheduler=scheduler, num_workers=num_workers, memo=memo
+        )
+        log_query_memo(memo)
+        return analysis_fields_data
 
+    fields_to_query = {
+        field_name: get_query_keys(cfg[ANALYSIS_FILEDS_KEY][field_name]) for field_name in cfg[ANALYSIS_FILEDS_KEY]
+    }
 
-def create_time_series(data: DataFrame, cfg: dict, num_workers=4) -> dict:
-    """Create timeseries data
+    analysis_fields_data = {}
+
+    for proc_group in group_fields_by_constrains(fields_to_query).values():
+
+        logger.info(f"computing fields {list(proc_group['fields'].keys())} with one grouped pass ...")
+
+        grouped_outputs = memoize_region_year(
+            memo,
+            aggregate_region_year if store is None else aggregate_region_year_from_store,
+            data if store is None else store,
+            list(proc_group["fields"].values()),
+            proc_group[CONSTRAIN_KEY],
+            cfg[REGION_KEY],
+            cfg[YEAR_KEY],
+        )
+
+        for field_name, query_field in proc_group["fields"].items():
+            analysis_fields_data[field_name] = {
+                proc_region: grouped_outputs[query_field][i].tolist() for i, proc_region in enumerate(cfg[REGION_KEY])
+            }
+
+    log_query_memo(memo)
+
+    return {field_name: analysis_fields_data[field_name] for field_name in cfg[ANALYSIS_FILEDS_KEY]}
+
+
+def create_time_series_with_dask(
+    data: DataFrame,
+    cfg: dict,
+    scheduler: str = DASK_SCHEDULER,
+    num_workers: int = DASK_WORKERS,
+    memo: dict or None = None,
+) -> dict:
+    """Create timeseries data with one dask task for each field, region and year
+    (which is not in the query memo)
 
     Args:
         data (DataFrame): decoded data
         cfg (dict): configuration file
-        num_workers (int, optional): multiprocessing processors. Defaults to 4.
+        scheduler (str, optional): the dask scheduler (see compute_tasks). Defaults to DASK_SCHEDULER.
+        num_workers (int, optional): number of workers. Defaults to DASK_WORKERS.
+        memo (dict or None, optional): the query memo (from open_query_memo). Defaults to None.
 
     Returns:
         dict: the dict contains timeseries data
     """
+    fields_to_query = {
+        field_name: get_query_keys(cfg[ANALYSIS_FILEDS_KEY][field_name]) for field_name in cfg[ANALYSIS_FILEDS_KEY]
+    }
+
+    field_values = {
+        field_name: load_memo_values(
+            memo,
+            fields_to_query[field_name][QUERY_KEY][0],
+            fields_to_query[field_name][CONSTRAIN_KEY],
+            cfg[REGION_KEY],
+            cfg[YEAR_KEY],
+        )
+        for field_name in fields_to_query
+    }
+
+    task_cells = []
+    task_args = []
+
+    for field_name in fields_to_query:
+        for i, proc_region in enumerate(cfg[REGION_KEY]):
+            for j, proc_year in enumerate(cfg[YEAR_KEY]):
+                if isnan(field_values[field_name][i, j]):
+                    task_cells.append((field_name, i, j))
+                    task_args.append((proc_region, proc_year, fields_to_query[field_name]))
+
+    if task_args:
+        outputs = compute_tasks(
+            extract_temporal_dataset, data, task_args, scheduler=scheduler, num_workers=num_workers
+        )
+        for (field_name, i, j), proc_output in zip(task_cells, outputs):
+            field_values[field_name][i, j] = proc_output
+
+        for field_name in fields_to_query:
+            save_memo_values(
+                memo,
+                fields_to_query[field_name][QUERY_KEY][0],
+                fields_to_query[field_name][CONSTRAIN_KEY],
+                cfg[REGION_KEY],
+                cfg[YEAR_KEY],
+                field_values[field_name],
+            )
+
+    return {
+        field_name: {
+            proc_region: field_values[field_name][i].tolist() for i, proc_region in enumerate(cfg[REGION_KEY])
+        }
+        for field_name in fields_to_query
+    }
+
+
+def fit_temporal_trend(ts_data: array, x: array or None = None) -> dict:
+    """Fit the linear trends (y = slope * x + intercept) of all the timeseries at once
+    with the batched least squares
 
-    jobs = []
-
-    for field_name in cfg[ANALYSIS_FILEDS_KEY]:
-
-        proc_field = cfg[ANALYSIS_FILEDS_KEY][field_name]
-
-        for proc_region in cfg[REGION_KEY]:
+    Args:
+        ts_data (array): 2d timeseries data (timeseries x year)
+        x (array or None, optional): x of each year, None for 0, 1, 2, ... Defaults to None.
 
-            fields_to_query = get_query_keys(proc_field)
+    Returns:
+        dict: slope, intercept, the standard error of the slope and the p-value (two-sided t-test,
+            the null hypothesis is that the slope is zero) of each timeseries
+    """
+    from scipy.stats import t as t_dist
 
-            for proc_year in cfg[YEAR_KEY]:
+    ts_data = asarray(ts_data, dtype=float)
+    x = arange(ts_data.shape[1], dtype=float) if x is None else asarray(x, dtype=float)
 
-                jobs.append(
-                    dask_delayed(extract_temporal_dataset)(
-                        data, proc_region, proc_year, fields_to_query
-                    )
-                )
+    x_anomaly = x - x.mean()
+    x_var = (x_anomaly**2).sum()
+    y_mean = ts_data.mean(axis=1)
 
-    ProgressBar().register()
+    slope = (ts_data @ x_anomaly) / x_var
+    intercept = y_mean - slope * x.mean()
 
-    logger.info("computing jobs with dask ...")
+    dof = len(x) - 2
+    residual = ts_data - (intercept[:, None] + slope[:, None] * x[None, :])
 
-    outputs = dask_compute(*jobs, num_workers=num_workers)
+    with errstate(divide="ignore", invalid="ignore"):
+        stderr = sqrt((residual**2).sum(axis=1) / dof / x_var) if dof > 0 else full(slope.shape, nan)
+        p_value = 2.0 * t_dist.sf(absolute(slope / stderr), dof) if dof > 0 else full(slope.shape, nan)
 
-    i = 0
+    return {"slope": slope, "intercept": intercept, "stderr": stderr, "p_value": p_value}
 
-    analysis_fields_data = {}
 
-    for field_name in cfg[ANALYSIS_FILEDS_KEY]:
+@instrument("obtain_temporal_trend", rows=lambda inputs, output: len(output))
+def obtain_temporal_trend(timeseries_data: dict, cfg: dict) -> DataFrame:
+    """Obtain the temporal trends of every region (and the total of all the regions)
+    for every field, all the trends are fitted at once
 
-        proc_field = cfg[ANALYSIS_FILEDS_KEY][field_name]
-        analysis_fields_data[field_name] = {}
+    Args:
+        timeseries_data (dict): timeseries data, e.g., {field: {region: [value of each year]}}
+        cfg (dict): temporal analysis configuration
 
-        for proc_region in cfg[REGION_KEY]:
+    Returns:
+        DataFrame: the trend table, one row for each field and region, the slope is the change
+            per year, and the intercept is the value (on the trend) in the first year
+    """
+    years = asarray(cfg[YEAR_KEY], dtype=float)
 
-            fields_to_query = get_query_keys(proc_field)
+    trend_index = []
+    ts_data = []
+    for proc_field in timeseries_data:
+        proc_ts_data = asarray([timeseries_data[proc_field][proc_region] for proc_region in cfg[REGION_KEY]])
+        trend_index.extend([(proc_field, proc_region) for proc_region in cfg[REGION_KEY]])
+        trend_index.append((proc_field, TREND_TOTAL_KEY))
+        ts_data.extend(proc_ts_data)
+        ts_data.append(numpy_sum(proc_ts_data, axis=0))
 
-            analysis_fields_data[field_name][proc_region] = []
+    trend = fit_temporal_trend(asarray(ts_data), x=years - years[0])
 
-            for proc_year in cfg[YEAR_KEY]:
-                analysis_fields_data[field_name][proc_region].append(outputs[i])
-                i += 1
+    trend_table = DataFrame(trend_index, columns=[FIELD_KEY, REGION_KEY])
+    for proc_key in trend:
+        trend_table[proc_key] = trend[proc_key]
 
-    return analysis_fields_data
+    return trend_table
 
 
-def obtain_temporal_trend(ts_data: array) -> dict:
-    """obtain the temporal changes trend using a SVR model
+def get_trend_line(trend_table: DataFrame, field_name: str, years: list, region: str = TREND_TOTAL_KEY) -> dict:
+    """Get the two endpoints (the first and last years) of a trend line
 
     Args:
-        ts_data (array): decoded 2d timeseries data
+        trend_table (DataFrame): the trend table from obtain_temporal_trend
+        field_name (str): field name
+        years (list): years
+        region (str, optional): region name. Defaults to TREND_TOTAL_KEY.
 
     Returns:
-        dict: the temporal change created by both SVR and Linear
+        dict: x (the index of the years) and y of the endpoints
     """
+    proc_trend = trend_table[(trend_table[FIELD_KEY] == field_name) & (trend_table[REGION_KEY] == region)].iloc[0]
+
+    x = asarray([0, len(years) - 1])
+    y = proc_trend["intercept"] + proc_trend["slope"] * (asarray(years, dtype=float)[x] - years[0])
+
+    return {"x": x, "y": y}
 
-    total_ts_data = numpy_sum(ts_data, axis=0)
-    x_regres = linspace(0, total_ts_data.shape[0], 100000)[:, None]
-    x = asarray(range(0, len(total_ts_data)))
-    x = x.reshape((len(x), 1))
 
-    # svr_model = SVR(kernel="rbf", gamma=3.0)
-    regres_model = LinearRegression()
-    regres_model.fit(x, total_ts_data)
+def export_temporal_trend(work_dir: str, trend_table: DataFrame) -> str:
+    """Export the trend table to a CSV file
 
-    return {"x_regres": x_regres, "y_regres": regres_model.predict(x_regres), "x": x, "y": total_ts_data}
+    Args:
+        work_dir (str): working directory
+        trend_table (DataFrame): the trend table from obtain_temporal_trend
+
+    Returns:
+        str: the path of the CSV file
+    """
+    trend_path = join(work_dir, TEMPORAL_TREND_FILENAME)
+    trend_table.to_csv(trend_path, index=False)
+    return trend_path
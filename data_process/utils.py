@@ -1,11 +1,30 @@
+from hashlib import blake2b
+from json import dump as json_dump
+from json import load as json_load
 from logging import Formatter, StreamHandler, getLogger
+from os import chmod, getuid, makedirs, stat
+from os.path import basename, dirname, join, splitext
 
 from genericpath import exists
-from pandas import read_csv
+from pandas import (CategoricalDtype, DataFrame, concat, read_csv,
+                    read_parquet, to_numeric)
+from pandas.api.types import union_categoricals
 from yaml import safe_load
 
-from data_process import (CONSTRAIN_KEY, CRASH_YEAR_KEY, LOGGER_LEVEL,
-                          QUERY_KEY, REGION_KEY)
+from data_process import (ANALYSIS_FILEDS_KEY, CONSTRAIN_COMPARISONS,
+                          CONSTRAIN_KEY, CRASH_YEAR_KEY, CSV_KEY,
+                          DATASET_CACHE_FILENAME, DATASET_CACHE_META_FILENAME,
+                          EQUAL_CONSTRAIN_KEY, FEATURES_KEY,
+                          FINGERPRINT_BLOCK_SIZE, FINGERPRINT_KEY,
+                          GEOJSON_BATCH_SIZE, GEOJSON_KEY,
+                          IN_CONSTRAIN_KEY, IS_NULL_CONSTRAIN_KEY,
+                          LOGGER_LEVEL, NOT_CONSTRAIN_KEY,
+                          NOT_IN_CONSTRAIN_KEY, QUERY_KEY, REGION_KEY,
+                          SOURCE_KEY, STR2DIGIT_MAPPING)
+from data_process.geojson import iter_geojson_chunks
+from data_process.instrument import instrument
+
+logger = getLogger()
 
 
 def setup_logging():
@@ -25,23 +44,351 @@ def setup_logging():
     return logger
 
 
-def read_dataset(data_path: str):
+@instrument("read_dataset", rows=lambda inputs, output: len(output))
+def read_dataset(
+    data_path: str,
+    use_cache: bool = False,
+    columns: list or None = None,
+    chunksize: int or None = None,
+    filters: dict or None = None,
+    aggregate_by: list or None = None,
+):
     """Read dataset from NZTA
 
     Args:
         data_path (str): the dataset to be read
+        use_cache (bool, optional): if True, the typed columnar cache next to
+            the dataset is used (and created if it is missing or outdated). Defaults to False.
+        columns (list or None, optional): only read these columns. Defaults to None (all columns).
+        chunksize (int or None, optional): if it is defined, the dataset is streamed in chunks of chunksize rows,
+            and each chunk is filtered/aggregated before the next one is read (the cache is not created in this case).
+            Defaults to None.
+        filters (dict or None, optional): only keep the rows with these values, e.g., {"crashYear": [2018]}. Defaults to None.
+        aggregate_by (list or None, optional): group the rows by these columns and sum the other columns. Defaults to None.
     """
     if not exists(data_path):
         raise Exception(f"not able to locate the data from {data_path}")
 
-    if data_path.endswith("csv"):
-        df = read_csv(data_path)
+    if use_cache:
+        df = load_dataset_cache(data_path, columns=columns)
+        if df is not None:
+            return reduce_dataset(df, filters=filters, aggregate_by=aggregate_by)
+
+    if data_path.endswith(CSV_KEY):
+        if chunksize is not None:
+            return reduce_chunks(
+                read_csv(data_path, usecols=columns, chunksize=int(chunksize)), filters=filters, aggregate_by=aggregate_by
+            )
+        df = read_csv(data_path, usecols=None if use_cache else columns)
+
+    elif data_path.endswith(GEOJSON_KEY):
+        # GeoJSON is always streamed, it is only combined as a whole when the cache is created
+        if chunksize is not None or not use_cache:
+            return reduce_chunks(
+                iter_geojson_chunks(data_path, chunksize=int(chunksize or GEOJSON_BATCH_SIZE), columns=columns),
+                filters=filters,
+                aggregate_by=aggregate_by,
+            )
+        df = concat_chunks(
+            [apply_typed_schema(proc_chunk) for proc_chunk in iter_geojson_chunks(data_path, chunksize=GEOJSON_BATCH_SIZE)]
+        )
+
     else:
-        raise Exception("currently only CSV format is supported ...")
+        raise Exception("currently only CSV and GeoJSON formats are supported ...")
+
+    if use_cache:
+        df = write_dataset_cache(data_path, df)
+        if columns is not None:
+            df = df[columns]
+
+    return reduce_dataset(df, filters=filters, aggregate_by=aggregate_by)
+
+
+def reduce_chunks(chunks, filters: dict or None = None, aggregate_by: list or None = None) -> DataFrame:
+    """Reduce a dataset which is read in chunks, so the peak memory scales with
+    the chunk size and the selected columns rather than the full file
+
+    Args:
+        chunks (iterable): the chunks (DataFrame) of the dataset
+        filters (dict or None, optional): only keep the rows with these values. Defaults to None.
+        aggregate_by (list or None, optional): group the rows by these columns and sum the other columns. Defaults to None.
+
+    Returns:
+        DataFrame: the dataset
+    """
+    reduced_chunks = []
+    for proc_chunk in chunks:
+        reduced_chunks.append(
+            reduce_dataset(apply_typed_schema(proc_chunk), filters=filters, aggregate_by=aggregate_by)
+        )
+
+    df = concat_chunks(reduced_chunks)
+
+    if aggregate_by is not None:
+        df = aggregate_dataset(df, aggregate_by)
+
+    return df
+
+
+def concat_chunks(chunks: list) -> DataFrame:
+    """Concatenate the chunks of a dataset, the categorical columns are
+    combined with the union of their categories (so they are not decoded to strings)
+
+    Args:
+        chunks (list): list of DataFrame
+
+    Returns:
+        DataFrame: the combined dataset
+    """
+    if not chunks:
+        return DataFrame()
+
+    categorical_columns = [
+        proc_col
+        for proc_col in chunks[0].columns
+        if all(isinstance(proc_chunk[proc_col].dtype, CategoricalDtype) for proc_chunk in chunks)
+    ]
+
+    df = concat([proc_chunk.drop(columns=categorical_columns) for proc_chunk in chunks], ignore_index=True)
+
+    for proc_col in categorical_columns:
+        df[proc_col] = union_categoricals(cast_categories([proc_chunk[proc_col] for proc_chunk in chunks]))
+
+    return df[chunks[0].columns]
+
+
+def cast_categories(categoricals: list) -> list:
+    """Cast the categories of the chunks of a categorical column to one dtype, e.g., a chunk where
+    the column is all missing has no categories (typed as float) while the others have strings
+
+    Args:
+        categoricals (list): list of categorical Series
+
+    Returns:
+        list: the categorical Series with the same dtype of categories
+    """
+    categories_dtypes = {
+        proc_data.cat.categories.dtype for proc_data in categoricals if len(proc_data.cat.categories) > 0
+    }
+    categories_dtype = categories_dtypes.pop() if len(categories_dtypes) == 1 else object
+
+    return [
+        proc_data
+        if proc_data.cat.categories.dtype == categories_dtype
+        else proc_data.astype(CategoricalDtype(proc_data.cat.categories.astype(categories_dtype)))
+        for proc_data in categoricals
+    ]
+
+
+def reduce_dataset(df: DataFrame, filters: dict or None = None, aggregate_by: list or None = None) -> DataFrame:
+    """Filter and aggregate a dataset
+
+    Args:
+        df (DataFrame): the dataset to be reduced
+        filters (dict or None, optional): only keep the rows with these values, e.g., {"crashYear": [2018]}. Defaults to None.
+        aggregate_by (list or None, optional): group the rows by these columns and sum the other columns. Defaults to None.
+
+    Returns:
+        DataFrame: the reduced dataset
+    """
+    if filters is not None:
+        mask = None
+        for proc_col in filters:
+            proc_mask = df[proc_col].isin(filters[proc_col]).to_numpy()
+            mask = proc_mask if mask is None else mask & proc_mask
+        df = df.loc[mask]
+
+    if aggregate_by is not None:
+        df = aggregate_dataset(df, aggregate_by)
+
+    return df
+
+
+def aggregate_dataset(df: DataFrame, aggregate_by: list) -> DataFrame:
+    """Group the rows by a list of columns and sum all the other columns,
+    the rows with missing group values are kept
+
+    Args:
+        df (DataFrame): the dataset to be aggregated
+        aggregate_by (list): columns to be grouped by
+
+    Returns:
+        DataFrame: the aggregated dataset
+    """
+    measures = [proc_col for proc_col in df.columns if proc_col not in aggregate_by]
+
+    return df.groupby(aggregate_by, observed=True, dropna=False)[measures].sum().reset_index()
+
+
+def get_file_fingerprint(data_path: str) -> str:
+    """Get the fingerprint of a file, the fingerprint is created from the file
+    size, modification time and the first/last blocks of the file, so it is cheap
+    to obtain even for a large dataset
+
+    Args:
+        data_path (str): the file to be checked
+
+    Returns:
+        str: the fingerprint of the file
+    """
+    file_stat = stat(data_path)
+
+    hasher = blake2b(digest_size=16)
+    hasher.update(f"{file_stat.st_size}-{file_stat.st_mtime_ns}".encode())
+
+    with open(data_path, "rb") as fin:
+        hasher.update(fin.read(FINGERPRINT_BLOCK_SIZE))
+        if file_stat.st_size > 2 * FINGERPRINT_BLOCK_SIZE:
+            fin.seek(-FINGERPRINT_BLOCK_SIZE, 2)
+            hasher.update(fin.read(FINGERPRINT_BLOCK_SIZE))
+
+    return hasher.hexdigest()
+
+
+def get_private_dir(dir_path: str) -> str:
+    """Create (if needed) a directory only accessible by the current user, it is used for the caches
+    which are read back by the tasks, so the directory (or a file in it) planted by another user is refused
+
+    Args:
+        dir_path (str): the directory
+
+    Returns:
+        str: the directory
+    """
+    if not exists(dir_path):
+        makedirs(dir_path, mode=0o700, exist_ok=True)
+        chmod(dir_path, 0o700)
+
+    check_private_path(dir_path)
+
+    return dir_path
+
+
+def check_private_path(proc_path: str):
+    """Check that a path is owned by the current user and it can not be written by the other users
+
+    Args:
+        proc_path (str): the path to be checked
+    """
+    path_stat = stat(proc_path)
+
+    if path_stat.st_uid != getuid():
+        raise Exception(f"{proc_path} is not owned by the current user, it is not used as a cache")
+
+    if path_stat.st_mode & 0o022:
+        raise Exception(f"{proc_path} can be written by the other users, it is not used as a cache")
+
+
+def get_dataset_cache_paths(data_path: str) -> dict:
+    """Get the paths of the columnar cache (and its metadata) for a dataset
+
+    Args:
+        data_path (str): the dataset path, e.g., /tmp/cas_analysis/cas.csv
+
+    Returns:
+        dict: the paths for the cache data and the cache metadata
+    """
+    data_name = splitext(basename(data_path))[0]
+    return {
+        "data": join(dirname(data_path), DATASET_CACHE_FILENAME.format(data_name=data_name)),
+        "meta": join(dirname(data_path), DATASET_CACHE_META_FILENAME.format(data_name=data_name)),
+    }
+
+
+def apply_typed_schema(df: DataFrame) -> DataFrame:
+    """Convert the raw dataset to a compact typed schema: region and the string
+    features (in STR2DIGIT_MAPPING) are stored as categories, integer columns are downcast
+    and integer-valued float columns (e.g., vehicle counts with missing values) are stored as float32
+
+    Args:
+        df (DataFrame): raw dataset
+
+    Returns:
+        DataFrame: the dataset with the typed schema
+    """
+    for proc_col in df.columns:
+        proc_data = df[proc_col]
+        if proc_col == REGION_KEY or proc_col in STR2DIGIT_MAPPING:
+            df[proc_col] = proc_data.astype("category")
+        elif proc_data.dtype.kind in "iu":
+            df[proc_col] = to_numeric(proc_data, downcast="integer")
+        elif proc_data.dtype.kind == "f":
+            proc_valid_data = proc_data.dropna()
+            if (proc_valid_data == proc_valid_data.round()).all() and (proc_valid_data.abs() < 2**24).all():
+                df[proc_col] = proc_data.astype("float32")
 
     return df
 
 
+def load_dataset_cache(data_path: str, columns: list or None = None) -> DataFrame or None:
+    """Load the columnar cache for a dataset
+
+    Args:
+        data_path (str): the dataset path (not the cache path)
+        columns (list or None, optional): only load these columns. Defaults to None.
+
+    Returns:
+        DataFrame or None: the cached dataset, or None if the cache is missing or outdated
+    """
+    cache_paths = get_dataset_cache_paths(data_path)
+
+    if not (exists(cache_paths["data"]) and exists(cache_paths["meta"])):
+        return None
+
+    with open(cache_paths["meta"], "r") as fin:
+        cache_meta = json_load(fin)
+
+    if cache_meta[FINGERPRINT_KEY] != get_file_fingerprint(data_path):
+        logger.info(f"the cache for {data_path} is outdated ...")
+        return None
+
+    try:
+        return read_parquet(cache_paths["data"], columns=columns)
+    except ImportError:
+        logger.warning("parquet engine is not available, the dataset cache is not used ...")
+        return None
+
+
+def write_dataset_cache(data_path: str, df: DataFrame) -> DataFrame:
+    """Write the columnar cache for a dataset
+
+    Args:
+        data_path (str): the dataset path (not the cache path)
+        df (DataFrame): the dataset read from data_path
+
+    Returns:
+        DataFrame: the dataset with the typed schema
+    """
+    cache_paths = get_dataset_cache_paths(data_path)
+
+    df = apply_typed_schema(df)
+
+    try:
+        df.to_parquet(cache_paths["data"], index=False)
+    except ImportError:
+        logger.warning("parquet engine is not available, the dataset cache is not created ...")
+        return df
+
+    with open(cache_paths["meta"], "w") as fout:
+        json_dump({FINGERPRINT_KEY: get_file_fingerprint(data_path), SOURCE_KEY: data_path}, fout)
+
+    return df
+
+
+def build_dataset_cache(data_path: str) -> str:
+    """Build (or rebuild) the columnar cache for a dataset
+
+    Args:
+        data_path (str): the dataset path
+
+    Returns:
+        str: the path of the cache
+    """
+    write_dataset_cache(data_path, read_dataset(data_path))
+
+    return get_dataset_cache_paths(data_path)["data"]
+
+
 def read_config(config_path: str):
     """Read config file for temporal analysis
 
@@ -57,6 +404,60 @@ def read_config(config_path: str):
     return cfg
 
 
+def get_constrain_value(constrain_value):
+    """Check the constrain of a column and return its canonical form, a constrain is one of:
+        * a value, the column equals to it, e.g., speedLimit: 100
+        * null, the value is missing, e.g., weatherB: null
+        * a list, the column is one of the values, e.g., weatherA: [Heavy rain, Snow]
+        * the operators (all of them are met), e.g., speedLimit: {">=": 80, "<": 100}, which are
+          ==, !=, >, >=, <, <= (a value), in, not_in (a list), is_null (true or false) and not (a constrain)
+    the missing values only meet null, is_null: true and not
+
+    Args:
+        constrain_value (object): the constrain
+
+    Returns:
+        object: the canonical constrain, e.g., a list is {"in": [...]} (sorted),
+            {"==": 100} is 100 and {"is_null": true} is null
+    """
+    if isinstance(constrain_value, list):
+        constrain_value = {IN_CONSTRAIN_KEY: constrain_value}
+
+    if not isinstance(constrain_value, dict):
+        return constrain_value
+
+    if not constrain_value:
+        raise Exception("a constrain must have at least one operator")
+
+    canonical_value = {}
+    for proc_operator, proc_operand in constrain_value.items():
+        if proc_operator in {IN_CONSTRAIN_KEY, NOT_IN_CONSTRAIN_KEY}:
+            if not isinstance(proc_operand, list):
+                raise Exception(f"{proc_operator} requires a list of values, got {proc_operand}")
+            canonical_value[proc_operator] = sorted(dict.fromkeys(proc_operand), key=str)
+        elif proc_operator == IS_NULL_CONSTRAIN_KEY:
+            if not isinstance(proc_operand, bool):
+                raise Exception(f"{proc_operator} requires true or false, got {proc_operand}")
+            canonical_value[proc_operator] = proc_operand
+        elif proc_operator == NOT_CONSTRAIN_KEY:
+            canonical_value[proc_operator] = get_constrain_value(proc_operand)
+        elif proc_operator in CONSTRAIN_COMPARISONS:
+            if isinstance(proc_operand, (dict, list)) or proc_operand is None:
+                raise Exception(f"{proc_operator} requires a value, got {proc_operand}")
+            canonical_value[proc_operator] = proc_operand
+        else:
+            raise Exception(f"constrain operator {proc_operator} is not supported ...")
+
+    # the same constrains as the equality (and null) constrains keep their keys
+    if list(canonical_value) == [EQUAL_CONSTRAIN_KEY]:
+        return canonical_value[EQUAL_CONSTRAIN_KEY]
+
+    if canonical_value == {IS_NULL_CONSTRAIN_KEY: True}:
+        return None
+
+    return canonical_value
+
+
 def get_query_keys(proc_field) -> dict:
     """Return the keys to be queried
 
@@ -77,6 +478,39 @@ def get_query_keys(proc_field) -> dict:
     for constrain_key in proc_field[query_key]:
 
         query_keys.append(constrain_key)
-        query_constrains.append({constrain_key: proc_field[query_key][constrain_key]})
+        query_constrains.append({constrain_key: get_constrain_value(proc_field[query_key][constrain_key])})
 
     return {QUERY_KEY: query_keys, CONSTRAIN_KEY: query_constrains}
+
+
+def get_query_columns(cfg: dict) -> list:
+    """Return all the dataset columns required by the analysis fields in a configuration
+
+    Args:
+        cfg (dict): analysis configuration
+
+    Returns:
+        list: the columns to be used, e.g., ["bicycle", "crashYear", "region", "speedLimit"]
+    """
+    query_columns = []
+    for field_name in cfg[ANALYSIS_FILEDS_KEY]:
+        query_columns.extend(get_query_keys(cfg[ANALYSIS_FILEDS_KEY][field_name])[QUERY_KEY])
+
+    return list(dict.fromkeys(query_columns))
+
+
+def get_feature_columns(cfg: dict) -> list:
+    """Return all the dataset columns required by the feature analysis
+
+    Args:
+        cfg (dict): feature analysis configuration
+
+    Returns:
+        list: the columns to be used, e.g., ["motorcycle", "light", "speedLimit"]
+    """
+    feature_columns = []
+    for proc_field in cfg[FEATURES_KEY]:
+        feature_columns.append(proc_field)
+        feature_columns.extend(cfg[FEATURES_KEY][proc_field])
+
+    return list(dict.fromkeys(feature_columns))
@@ -1,16 +1,67 @@
 
-from os.path import join
-
-from matplotlib.pyplot import (close, colorbar, figure, legend, savefig,
-                               subplots, title)
-from mpl_toolkits.basemap import Basemap
-from numpy import array, asarray, float16, sum
+from hashlib import blake2b
+from json import dumps as json_dumps
+from logging import getLogger
+from os import getpid, replace
+from os.path import exists, join
+from typing import TYPE_CHECKING
+
+from numpy import (array, asarray, concatenate, cumsum, empty, float16,
+                   repeat, savez, sort, split)
+from numpy import load as numpy_load
+from numpy import sum as numpy_sum
 from pandas import DataFrame
 
-from data_process import (ANALYSIS_FILEDS_KEY, LAT_KEY, LON_KEY, MAP_CFG,
-                          RECORDS_KEY, REGION_KEY, SPATIAL_FILENAME,
-                          TIMESERIES_FILENAME, YEAR_KEY)
-from data_process.temporal import obtain_temporal_trend
+from data_process import (ANALYSIS_FILEDS_KEY, IN_CONSTRAIN_KEY,
+                          IS_NULL_CONSTRAIN_KEY, LAT_KEY, LON_KEY,
+                          MAP_CACHE_DIR, MAP_CACHE_FILENAME, MAP_CFG,
+                          MAP_SEGMENTS, NOT_CONSTRAIN_KEY,
+                          NOT_IN_CONSTRAIN_KEY, REGION_KEY, RENDER_WORKERS,
+                          SPATIAL_FILENAME, TIMESERIES_FILENAME, YEAR_KEY)
+from data_process.render import render_figures
+from data_process.temporal import get_trend_line, obtain_temporal_trend
+from data_process.utils import (check_private_path, get_constrain_value,
+                                get_private_dir)
+
+if TYPE_CHECKING:
+    from mpl_toolkits.basemap import Basemap
+
+logger = getLogger()
+
+# the map backgrounds of this process (see load_map)
+_MAP_MEMO = {}
+
+
+def create_constrain_str(constrain_key: str, constrain_value) -> str:
+    """Create the title of a constrain, e.g., speedLimit: 100, speedLimit >= 80 or weatherA in [Heavy rain, Snow]
+
+    Args:
+        constrain_key (str): the constrained column
+        constrain_value (object): the canonical constrain (see get_constrain_value)
+
+    Returns:
+        str: title of the constrain
+    """
+    if constrain_value is None:
+        return f"{constrain_key} is null"
+
+    if not isinstance(constrain_value, dict):
+        return f"{constrain_key}: {constrain_value}"
+
+    constrain_strs = []
+    for proc_operator, proc_operand in constrain_value.items():
+        if proc_operator == NOT_CONSTRAIN_KEY:
+            constrain_strs.append(f"not ({create_constrain_str(constrain_key, proc_operand)})")
+        elif proc_operator == IS_NULL_CONSTRAIN_KEY:
+            constrain_strs.append(f"{constrain_key} is {'' if proc_operand else 'not '}null")
+        elif proc_operator in {IN_CONSTRAIN_KEY, NOT_IN_CONSTRAIN_KEY}:
+            constrain_strs.append(
+                f"{constrain_key} {proc_operator.replace('_', ' ')} [{', '.join(str(value) for value in proc_operand)}]"
+            )
+        else:
+            constrain_strs.append(f"{constrain_key} {proc_operator} {proc_operand}")
+
+    return ", ".join(constrain_strs)
 
 
 def create_title_str(analysis_fields_cfg: dict, field_name: str) -> str:
@@ -33,9 +84,8 @@ def create_title_str(analysis_fields_cfg: dict, field_name: str) -> str:
 
     constrains = ""
     for constrain_key in proc_analysis_field_cfg[major_key_name]:
-        constrains += ", {constrain_key}: {constrain_value}".format(
-            constrain_key=constrain_key,
-            constrain_value=proc_analysis_field_cfg[major_key_name][constrain_key],
+        constrains += ", " + create_constrain_str(
+            constrain_key, get_constrain_value(proc_analysis_field_cfg[major_key_name][constrain_key])
         )
 
 
@@ -62,7 +112,7 @@ def rank_region_by_crashes(timeseries_data: dict, cfg: dict) -> dict:
             #    proc_timeseries = proc_timeseries / max(proc_timeseries)
             #    proc_timeseries = gradient(proc_timeseries)
 
-            total_crash[proc_field_name][proc_region] = sum(proc_timeseries)
+            total_crash[proc_field_name][proc_region] = numpy_sum(proc_timeseries)
 
         ranked_regions[proc_field_name] = sorted(
             total_crash[proc_field_name], key=total_crash[proc_field_name].get, reverse=True
@@ -71,16 +121,32 @@ def rank_region_by_crashes(timeseries_data: dict, cfg: dict) -> dict:
     return ranked_regions
 
 
-def temporal_vis(work_dir: str, cfg: dict, timeseries_data: dict):
+def temporal_vis(
+    work_dir: str,
+    cfg: dict,
+    timeseries_data: dict,
+    trend_table: DataFrame or None = None,
+    render_workers: int = RENDER_WORKERS,
+    digest_path: str or None = None,
+):
     """Temporal analysis visualization
 
     Args:
         work_dir (str): working directory, e.g., where to save the figures
         cfg (dict): temporal analysis configuration
         timeseries_data (dict): produced time series data
+        trend_table (DataFrame or None, optional): the trend table from obtain_temporal_trend,
+            it is created if None. Defaults to None.
+        render_workers (int, optional): number of rendering processes. Defaults to RENDER_WORKERS.
+        digest_path (str or None, optional): if it is set, only the changed figures are rendered
+            (see render_figures). Defaults to None.
     """
     ranked_regions = rank_region_by_crashes(timeseries_data, cfg)
 
+    if trend_table is None:
+        trend_table = obtain_temporal_trend(timeseries_data, cfg)
+
+    render_jobs = []
     for proc_field_name in timeseries_data:
 
         ts_data = []
@@ -91,120 +157,364 @@ def temporal_vis(work_dir: str, cfg: dict, timeseries_data: dict):
             ts_data.append(proc_ts_data)
 
         ts_data = asarray(ts_data)
-        ts_data_trend = obtain_temporal_trend(ts_data)
-        _, ax = subplots(1, 1, figsize=(12, 10))
 
-        cb = ax.pcolor(ts_data.astype(float16), cmap="jet")
-
-        ax.set_title(
-            create_title_str(cfg[ANALYSIS_FILEDS_KEY], proc_field_name)
+        render_jobs.append(
+            (
+                plot_temporal_field,
+                {
+                    "filename": join(work_dir, TIMESERIES_FILENAME.format(field_name=proc_field_name)),
+                    "ts_data": ts_data,
+                    "ts_total": numpy_sum(ts_data, axis=0),
+                    "ts_trend_line": get_trend_line(trend_table, proc_field_name, cfg[YEAR_KEY]),
+                    "title_str": create_title_str(cfg[ANALYSIS_FILEDS_KEY], proc_field_name),
+                    "years": cfg[YEAR_KEY],
+                    "regions": ranked_regions[proc_field_name],
+                },
+            )
         )
-        ax.set_xticks(range(0, ts_data.shape[1]))
-        ax.set_xticklabels(cfg[YEAR_KEY], rotation=90)
-        ax.set_xlabel(YEAR_KEY)
 
-        ax.set_yticks(range(0, ts_data.shape[0]))
-        ax.set_yticklabels(ranked_regions[proc_field_name], rotation=45)
-        ax.set_ylabel(REGION_KEY)
+    render_figures(render_jobs, num_workers=render_workers, digest_path=digest_path)
 
-        cbar = colorbar(cb, fraction=0.03, pad=0.1)
-        cbar.set_label("Crash number", rotation=270)
 
+def plot_temporal_field(
+    filename: str, ts_data: array, ts_total: array, ts_trend_line: dict, title_str: str, years: list, regions: list
+):
+    """Plot the timeseries of one analysis field
 
+    Args:
+        filename (str): where to save the figure
+        ts_data (array): 2d timeseries data (region x year)
+        ts_total (array): the total of all the regions for each year
+        ts_trend_line (dict): the endpoints of the trend line of the total, from get_trend_line
+        title_str (str): the figure title
+        years (list): years (x axis)
+        regions (list): regions (y axis)
+    """
+    from matplotlib.pyplot import close, colorbar, savefig, subplots
 
-        ax2 = ax.twinx()
-        ax2.set_ylabel("total crashes", color="r")  # we already handled the x-label with ax1
-        ax2.plot(ts_data_trend["x_regres"], ts_data_trend["y_regres"], color="r")
-        ax2.scatter(ts_data_trend["x"], ts_data_trend["y"], color="r", s=50)
-        ax2.tick_params(axis='y', labelcolor="r")
+    _, ax = subplots(1, 1, figsize=(12, 10))
 
-        filename = TIMESERIES_FILENAME.format(field_name=proc_field_name)
+    cb = ax.pcolor(ts_data.astype(float16), cmap="jet")
 
-        savefig(join(work_dir, filename), bbox_inches="tight")
+    ax.set_title(title_str)
+    ax.set_xticks(range(0, ts_data.shape[1]))
+    ax.set_xticklabels(years, rotation=90)
+    ax.set_xlabel(YEAR_KEY)
 
-        close()
+    ax.set_yticks(range(0, ts_data.shape[0]))
+    ax.set_yticklabels(regions, rotation=45)
+    ax.set_ylabel(REGION_KEY)
 
+    cbar = colorbar(cb, fraction=0.03, pad=0.1)
+    cbar.set_label("Crash number", rotation=270)
 
-def plot_spatial(work_dir: str, spatial_data: dict, latlon: DataFrame, vis_scatter_factor: float, per_capita: bool):
+    ax2 = ax.twinx()
+    ax2.set_ylabel("total crashes", color="r")  # we already handled the x-label with ax1
+    ax2.plot(ts_trend_line["x"], ts_trend_line["y"], color="r")
+    ax2.scatter(range(0, len(ts_total)), ts_total, color="r", s=50)
+    ax2.tick_params(axis='y', labelcolor="r")
+
+    savefig(filename, bbox_inches="tight")
+
+    close()
+
+
+def plot_spatial(
+    work_dir: str,
+    spatial_data: dict,
+    latlon: DataFrame,
+    vis_scatter_factor: float,
+    per_capita: bool,
+    render_workers: int = RENDER_WORKERS,
+    digest_path: str or None = None,
+):
     """Plot spatial data
 
     Args:
         work_dir (str): working directory
         spatial_data (dict): spatial data to be plotted
         latlon (DataFrame): lat and lon for different regions
+        render_workers (int, optional): number of rendering processes. Defaults to RENDER_WORKERS.
+        digest_path (str or None, optional): if it is set, only the changed figures are rendered
+            (see render_figures). Defaults to None.
     """
+    # the map background is built (or loaded) once here, so the rendering workers only read it from the cache
+    load_map()
+
+    region_latlon = latlon.set_index(REGION_KEY.capitalize())[[LAT_KEY, LON_KEY]]
 
+    render_jobs = []
     for field_name in spatial_data:
         proc_spatial_data = spatial_data[field_name]
 
         for field in proc_spatial_data:
 
-            figure(figsize=(12, 10))
-            map_obj = generate_map()
-
-            scatter_objs = []
-            scatter_values = []
-            for region_name in proc_spatial_data[field]:
-                region_lat = latlon.loc[latlon[REGION_KEY.capitalize()]==region_name].to_dict(RECORDS_KEY)[0][LAT_KEY]
-                region_lon = latlon.loc[latlon[REGION_KEY.capitalize()]==region_name].to_dict(RECORDS_KEY)[0][LON_KEY]
-                x, y = map_obj(region_lon, region_lat)
-
-                for proc_year in proc_spatial_data[field][region_name]:
-                    
-                    proc_value = proc_spatial_data[field][region_name][proc_year]
-                    if per_capita:
-                        proc_value *= 100000.0
-
-                    scatter_objs.append(map_obj.scatter(x, y, proc_value**vis_scatter_factor, marker='o', edgecolors=None, color='Red', alpha=0.3))
-                    scatter_values.append(proc_value)
-
-            index = [i[0] for i in sorted(enumerate(scatter_values), key=lambda x:x[1])]
-            scatter_objs_sorted = [scatter_objs[i] for i in index][::5]
-            scatter_values_sorted = [round(scatter_values[i],3) for i in index][::5]
-
-            title_str = f"Crashes, {field}, {proc_year}"
-            if per_capita:
-                tag = ",Crashes/100,000 person"
-                title_str += tag
-            else:
-                tag = ",Total crashes"
-                title_str += tag
-
-            legend(scatter_objs_sorted, scatter_values_sorted, ncol=4, frameon=True, fontsize=12,
-                handlelength=2, loc = 8, borderpad = 1.8,
-                handletextpad=1, title=tag, scatterpoints = 1)
-
-            title(title_str)
-            
-            filename = SPATIAL_FILENAME.format(field_name=field_name)
-            savefig(join(work_dir, filename), bbox_inches="tight")
-            close()
-
-def generate_map() -> dict:
-    """Generates basemap object.
+            regions = list(proc_spatial_data[field])
+            years = list(proc_spatial_data[field][regions[0]])
+
+            field_latlon = region_latlon.loc[regions].to_numpy(dtype=float)
+            field_values = asarray(
+                [[proc_spatial_data[field][region_name][proc_year] for proc_year in years] for region_name in regions],
+                dtype=float,
+            )
+
+            render_jobs.append(
+                (
+                    plot_spatial_field,
+                    {
+                        "filename": join(work_dir, SPATIAL_FILENAME.format(field_name=field_name)),
+                        "field": field,
+                        "lat": repeat(field_latlon[:, 0], len(years)),
+                        "lon": repeat(field_latlon[:, 1], len(years)),
+                        "values": field_values.ravel(),
+                        "year": years[-1],
+                        "vis_scatter_factor": vis_scatter_factor,
+                        "per_capita": per_capita,
+                    },
+                )
+            )
+
+    render_figures(render_jobs, num_workers=render_workers, digest_path=digest_path)
+
+
+def plot_spatial_field(
+    filename: str,
+    field: str,
+    lat: array,
+    lon: array,
+    values: array,
+    year: int,
+    vis_scatter_factor: float,
+    per_capita: bool,
+    legend_step: int = 5,
+):
+    """Plot the spatial data of one analysis field, all the points are projected
+    and drawn at once
+
+    Args:
+        filename (str): where to save the figure
+        field (str): the field to be plotted, e.g., motorcycle
+        lat (array): latitude of each point
+        lon (array): longitude of each point
+        values (array): value of each point
+        year (int): the year in the title
+        vis_scatter_factor (float): the scatter size is value ** vis_scatter_factor
+        per_capita (bool): if the values are per capita
+        legend_step (int, optional): one of every legend_step sorted values is shown in the legend. Defaults to 5.
+    """
+    from matplotlib.pyplot import close, figure, legend, savefig, title
+
+    figure(figsize=(12, 10))
+    map_obj = generate_map()
+
+    if per_capita:
+        values = values * 100000.0
+
+    x, y = map_obj(lon, lat)
+    sizes = values**vis_scatter_factor
+    scatter_obj = map_obj.scatter(x, y, sizes, marker='o', edgecolors=None, color='Red', alpha=0.3)
+
+    title_str = f"Crashes, {field}, {year}"
+    if per_capita:
+        tag = ",Crashes/100,000 person"
+        title_str += tag
+    else:
+        tag = ",Total crashes"
+        title_str += tag
+
+    # the legend values are obtained from the sizes with the same function used by legend_elements,
+    # so none of them falls outside the range of the drawn sizes because of the rounding
+    def size_to_value(proc_sizes):
+        return proc_sizes ** (1.0 / vis_scatter_factor)
+
+    legend_handles, legend_labels = scatter_obj.legend_elements(
+        prop="sizes",
+        num=size_to_value(sort(sizes)[::legend_step]).tolist(),
+        func=size_to_value,
+        fmt="{x:.3f}",
+        color="Red",
+        alpha=0.3,
+    )
+
+    legend(legend_handles, legend_labels, ncol=4, frameon=True, fontsize=12,
+        handlelength=2, loc = 8, borderpad = 1.8,
+        handletextpad=1, title=tag, scatterpoints = 1)
+
+    title(title_str)
+
+    savefig(filename, bbox_inches="tight")
+    close()
+
+
+def plot_shap_force(filename: str, base_value: float, shap_values: array, data: array, feature_names: list):
+    """Plot the SHAP force plot for one row
+
+    Args:
+        filename (str): where to save the figure
+        base_value (float): the SHAP base value
+        shap_values (array): SHAP values of the row
+        data (array): feature values of the row
+        feature_names (list): feature names
+    """
+    from matplotlib.pyplot import close, savefig
+    from shap.plots import force as shap_force_plot
+
+    shap_force_plot(base_value, shap_values, data, show=False, matplotlib=True, feature_names=feature_names)
+
+    savefig(filename, bbox_inches="tight")
+
+    close()
+
+
+def plot_shap_summary(filename: str, shap_values: array, data: array, feature_names: list):
+    """Plot the SHAP summary plot for all the explained rows
+
+    Args:
+        filename (str): where to save the figure
+        shap_values (array): SHAP values (row x feature)
+        data (array): feature values (row x feature)
+        feature_names (list): feature names
+    """
+    from matplotlib.pyplot import close, savefig
+    from shap import summary_plot as shap_summary_plot
+
+    shap_summary_plot(shap_values, data, feature_names=feature_names, show=False)
+
+    savefig(filename, bbox_inches="tight")
+
+    close()
+
+
+def get_map_key(map_cfg: dict) -> str:
+    """Get the key of the map background, which is made from the map configuration
+    and the Basemap version
+
+    Args:
+        map_cfg (dict): map configuration, e.g., MAP_CFG
 
     Returns:
-        a dict contains the map ionformation
+        str: the map key
     """
+    from mpl_toolkits.basemap import __version__ as basemap_version
+
+    map_identity = json_dumps({"map_cfg": map_cfg, "basemap": basemap_version}, sort_keys=True)
+    return blake2b(map_identity.encode(), digest_size=16).hexdigest()
+
 
-    map_obj = Basemap(
-        projection="mill",
-        llcrnrlon=MAP_CFG["llcrnrlon"],
-        urcrnrlon=MAP_CFG["urcrnrlon"],
-        llcrnrlat=MAP_CFG["llcrnrlat"],
-        urcrnrlat=MAP_CFG["urcrnrlat"],
-        resolution=MAP_CFG["resolution"],
+def pack_map_segments(segments: list) -> tuple:
+    """Pack the line segments (each one is a list of projected (x, y) points) into two arrays
+
+    Args:
+        segments (list): the line segments
+
+    Returns:
+        tuple: the points of all the segments (point x 2) and the offset of each segment
+    """
+    offsets = cumsum([0] + [len(proc_segment) for proc_segment in segments])
+    points = concatenate(
+        [asarray(proc_segment, dtype=float).reshape(-1, 2) for proc_segment in segments] or [empty((0, 2))]
     )
 
+    return points, offsets
 
-    # x, y = map_obj(lon, lat)
 
-    map_obj.drawcoastlines()
+def load_map(map_cfg: dict = MAP_CFG, cache_dir: str = MAP_CACHE_DIR) -> dict:
+    """Load the map background (the projected coastlines and rivers), it is looked up in the memory,
+    then in cache_dir (a directory of the current user, see get_private_dir), and it is only built
+    (and saved to cache_dir) if neither of them has it. The cache only holds numeric arrays
+    (loaded without pickle), so it can not run any code
 
-    map_obj.drawmapboundary()
+    Args:
+        map_cfg (dict, optional): map configuration. Defaults to MAP_CFG.
+        cache_dir (str, optional): where the map backgrounds are cached. Defaults to MAP_CACHE_DIR.
 
-    map_obj.drawrivers()
+    Returns:
+        dict: the line segments of the coastlines and the rivers
+    """
+    map_key = get_map_key(map_cfg)
 
-    return map_obj
+    if map_key in _MAP_MEMO:
+        return _MAP_MEMO[map_key]
+
+    map_path = join(get_private_dir(cache_dir), MAP_CACHE_FILENAME.format(map_key=map_key))
+
+    map_segments = None
+    if exists(map_path):
+        check_private_path(map_path)
+        try:
+            with numpy_load(map_path, allow_pickle=False) as map_arrays:
+                map_segments = {
+                    proc_name: split(map_arrays[f"{proc_name}_points"], map_arrays[f"{proc_name}_offsets"][1:-1])
+                    for proc_name in MAP_SEGMENTS
+                }
+        except Exception:
+            logger.info(f"map cache {map_path} is invalid, it will be rebuilt ...")
+            map_segments = None
+
+    if map_segments is None:
+        from mpl_toolkits.basemap import Basemap
+
+        map_obj = Basemap(**map_cfg)
+        # the rivers are only read by drawrivers, they are read here so they can be cached with the coastlines
+        map_segments = {"coastlines": map_obj.coastsegs, "rivers": map_obj._readboundarydata("rivers")[0]}
+
+        map_arrays = {}
+        for proc_name in MAP_SEGMENTS:
+            map_arrays[f"{proc_name}_points"], map_arrays[f"{proc_name}_offsets"] = pack_map_segments(
+                map_segments[proc_name]
+            )
+
+        map_tmp_path = f"{map_path}.{getpid()}"
+        with open(map_tmp_path, "wb") as fid:
+            savez(fid, **map_arrays)
+        replace(map_tmp_path, map_path)
+
+        logger.info(f"map background is saved to {map_path} ...")
+
+    _MAP_MEMO[map_key] = map_segments
 
-    return {"map_obj": map_obj, "x": x, "y": y}
+    return map_segments
+
+
+def get_map(map_cfg: dict = MAP_CFG) -> "Basemap":
+    """Get a Basemap object for the projection only (without the boundary datasets, so it is cheap),
+    a new object is returned for each call since a Basemap object can not be drawn on more than one figure
+
+    Args:
+        map_cfg (dict, optional): map configuration. Defaults to MAP_CFG.
+
+    Returns:
+        Basemap: the map object
+    """
+    from mpl_toolkits.basemap import Basemap
+
+    return Basemap(**{**map_cfg, "resolution": None})
+
+
+def generate_map(map_cfg: dict = MAP_CFG, cache_dir: str = MAP_CACHE_DIR) -> "Basemap":
+    """Generates basemap object and draws the coastlines and rivers (from the cached map background)
+    on the current figure, with the same styles as drawcoastlines and drawrivers
+
+    Args:
+        map_cfg (dict, optional): map configuration. Defaults to MAP_CFG.
+        cache_dir (str, optional): where the map backgrounds are cached. Defaults to MAP_CACHE_DIR.
+
+    Returns:
+        Basemap: the map object
+    """
+    from matplotlib.collections import LineCollection
+    from matplotlib.pyplot import gca
+
+    map_segments = load_map(map_cfg=map_cfg, cache_dir=cache_dir)
+    map_obj = get_map(map_cfg=map_cfg)
+    ax = gca()
+
+    ax.add_collection(LineCollection(map_segments["coastlines"], linewidths=1.0, colors="k", label="_nolabel_"))
+
+    map_obj.drawmapboundary(ax=ax)
+
+    ax.add_collection(LineCollection(map_segments["rivers"], linewidths=0.5, colors="k", label="_nolabel_"))
+
+    map_obj.set_axes_limits(ax=ax)
+
+    return map_obj
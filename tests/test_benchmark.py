@@ -0,0 +1,77 @@
+import unittest
+from filecmp import cmp
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from data_process import SYNTHETIC_REGIONS, SYNTHETIC_YEARS
+from data_process.benchmark import (compare_benchmarks, measure_stage,
+                                    measure_startup, write_benchmark)
+from data_process.synthetic import create_synthetic_dataset
+from data_process.utils import read_dataset
+from numpy import ones
+from numpy.testing import assert_almost_equal, assert_equal
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_create_synthetic_dataset(self):
+        with TemporaryDirectory() as work_dir:
+            for proc_name in ["cas1.csv", "cas2.csv"]:
+                create_synthetic_dataset(join(work_dir, proc_name), 2500, seed=1, chunksize=1000)
+
+            assert_equal(cmp(join(work_dir, "cas1.csv"), join(work_dir, "cas2.csv"), shallow=False), True)
+
+            data = read_dataset(join(work_dir, "cas1.csv"))
+            assert_equal(len(data), 2500)
+            assert_equal(data["OBJECTID"].tolist(), list(range(2500)))
+            assert_equal(set(data["crashYear"]) <= set(SYNTHETIC_YEARS), True)
+            assert_equal(
+                set(data["region"].dropna()) <= {proc_region + " Region" for proc_region in SYNTHETIC_REGIONS}, True
+            )
+
+    def test_compare_benchmarks(self):
+        _, stage_record = measure_stage("ones", ones, 1000000)
+        assert_equal(stage_record["stage"], "ones")
+        assert_equal(stage_record["peak_memory"] >= 8000000, True)
+
+        with TemporaryDirectory() as work_dir:
+            baseline_path = write_benchmark(
+                join(work_dir, "baseline.json"), [{"num_rows": 10, "stages": [{**stage_record, "wall_time": 1.0}]}]
+            )
+            benchmark_path = write_benchmark(
+                join(work_dir, "benchmark.json"), [{"num_rows": 10, "stages": [{**stage_record, "wall_time": 0.5}]}]
+            )
+
+            compared = compare_benchmarks(baseline_path, benchmark_path)
+            assert_almost_equal(compared["wall_time_ratio"].tolist(), [0.5])
+            assert_almost_equal(compared["peak_memory_ratio"].tolist(), [1.0])
+
+    def test_measure_startup(self):
+        # the package is imported without the heavy dependencies (and without creating the working directory)
+        startup_records = measure_startup(
+            {
+                "import data_process": [
+                    "-c",
+                    "import sys\n"
+                    "from os.path import exists\n"
+                    "import data_process\n"
+                    "heavy_modules = {'dask', 'matplotlib', 'mpl_toolkits.basemap', 'shap', 'sklearn', 'xgboost'}\n"
+                    "assert not heavy_modules & set(sys.modules), heavy_modules & set(sys.modules)\n"
+                    "assert not exists(data_process.WORKDIR)\n",
+                ],
+                "cli_preproc --help": ["-m", "cli.cli_preproc", "--help"],
+            },
+            repeats=1,
+        )
+        assert_equal(
+            [proc_record["stage"] for proc_record in startup_records],
+            ["startup import data_process", "startup cli_preproc --help"],
+        )
+
+        with TemporaryDirectory() as work_dir:
+            benchmark_path = write_benchmark(join(work_dir, "benchmark.json"), [], startup=startup_records)
+            compared = compare_benchmarks(benchmark_path, benchmark_path)
+            assert_almost_equal(compared["wall_time_ratio"].tolist(), [1.0, 1.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
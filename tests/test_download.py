@@ -1,24 +1,105 @@
 import unittest
-from os.path import join
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os.path import exists, join
+from tempfile import mkdtemp
+from threading import Thread
 
-from data_process import CAS_KEY
-from data_process.download import download_cas_dataset
+from data_process import CAS_KEY, DOWNLOAD_PART_SUFFIX
+from data_process.download import download_cas_dataset, read_download_meta
 from numpy.testing import assert_equal
 
 
+class CasRequestHandler(BaseHTTPRequestHandler):
+    """A local stand-in of the NZTA open data server, supporting ETag and Range requests"""
+
+    content = b"crashYear,region,bicycle\n" + b"2018,Otago Region,1\n" * 5000
+    etag = '"cas-v1"'
+    interrupt_next = False
+    received_headers = []
+
+    def do_GET(self):
+        CasRequestHandler.received_headers.append(dict(self.headers))
+
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        if self.headers.get("Range") and self.headers.get("If-Range") == self.etag:
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(self.content) - 1}/{len(self.content)}")
+        else:
+            self.send_response(200)
+
+        body = self.content[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", self.etag)
+        self.end_headers()
+
+        if CasRequestHandler.interrupt_next:
+            # drop the connection in the middle of the transfer
+            CasRequestHandler.interrupt_next = False
+            self.wfile.write(body[: len(body) // 2])
+            return
+
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
 class TestDownload(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), CasRequestHandler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.data_source = f"http://127.0.0.1:{self.server.server_address[1]}/cas.csv"
+        CasRequestHandler.received_headers = []
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
     def test_download_cas_dataset(self):
         workdir = "/tmp/test"
         input_fmt = "csv"
 
         overwrite_api_src = "https://test"
-        output = download_cas_dataset(workdir, input_fmt, overwrite_api_src=overwrite_api_src)
+        output = download_cas_dataset(workdir, input_fmt, overwrite_api_src=overwrite_api_src, backoff_factor=0.0)
         assert_equal(output, None)
 
         overwrite_api_src = "tests/test_download.py"
-        output = download_cas_dataset(workdir, input_fmt, overwrite_api_src=overwrite_api_src)
+        output = download_cas_dataset(workdir, input_fmt, overwrite_api_src=overwrite_api_src, backoff_factor=0.0)
         assert_equal(output, join(workdir, f"{CAS_KEY}.{input_fmt}"))
 
+    def test_download_cas_dataset_conditional(self):
+        workdir = mkdtemp()
+
+        output = download_cas_dataset(workdir, "csv", overwrite_api_src=self.data_source, backoff_factor=0.0)
+        with open(output, "rb") as fin:
+            assert_equal(fin.read(), CasRequestHandler.content)
+        assert_equal(read_download_meta(output)["etag"], CasRequestHandler.etag)
+
+        # the dataset is not changed on the server, so it is not downloaded again
+        output = download_cas_dataset(workdir, "csv", overwrite_api_src=self.data_source, backoff_factor=0.0)
+        assert_equal(CasRequestHandler.received_headers[-1]["If-None-Match"], CasRequestHandler.etag)
+        with open(output, "rb") as fin:
+            assert_equal(fin.read(), CasRequestHandler.content)
+
+    def test_download_cas_dataset_resume(self):
+        workdir = mkdtemp()
+        CasRequestHandler.interrupt_next = True
+
+        output = download_cas_dataset(workdir, "csv", overwrite_api_src=self.data_source, backoff_factor=0.0)
+        assert_equal(len(CasRequestHandler.received_headers), 2)
+        assert_equal(
+            CasRequestHandler.received_headers[1]["Range"], f"bytes={len(CasRequestHandler.content) // 2}-"
+        )
+        assert_equal(exists(output + DOWNLOAD_PART_SUFFIX), False)
+        with open(output, "rb") as fin:
+            assert_equal(fin.read(), CasRequestHandler.content)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from os import listdir
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from data_process import MODEL_DIR
+from data_process.feature import (attach_feature_dataset,
+                                  compute_shap_values, data_qc,
+                                  extract_feature_dataset, get_split_data,
+                                  split_training_test_data, train_model)
+from numpy import float32, memmap
+from numpy.random import default_rng
+from numpy.testing import assert_allclose, assert_equal
+from pandas import DataFrame
+from xgboost import XGBRegressor
+
+
+class TestFeature(unittest.TestCase):
+    def test_data_qc(self):
+        data = DataFrame(
+            {
+                "motorcycle": [1.0, 0.0, None, 2.0, 1.0],
+                "weatherA": ["Fine", "Heavy rain", "Fine", "Null", "Tornado"],
+                "speedLimit": [100, 50, 50, 80, 30],
+            }
+        )
+        output, qc_report = data_qc(data, ["motorcycle", "weatherA", "speedLimit"])
+
+        assert_equal(output.dtype, float32)
+        assert_equal(output.flags["C_CONTIGUOUS"], True)
+        assert_equal(output.tolist(), [[1.0, 0.0, 100.0], [0.0, 3.0, 50.0]])
+        assert_equal(qc_report["motorcycle"]["nan"], 1)
+        assert_equal(qc_report["weatherA"], {"nan": 0, "missing": 1, "unmapped": 1})
+        assert_equal(qc_report["total"], {"input": 5, "removed": 3})
+
+    def test_extract_feature_dataset(self):
+        data = DataFrame(
+            {
+                "motorcycle": [1.0, 0.0, None, 2.0, 1.0],
+                "bicycle": [0.0, 1.0, 1.0, 0.0, None],
+                "weatherA": ["Fine", "Heavy rain", "Fine", "Null", "Fine"],
+                "speedLimit": [100, 50, 50, 80, 30],
+            }
+        )
+        cfg = {"features": {"motorcycle": {"weatherA": None, "speedLimit": None}, "bicycle": {"weatherA": None}}}
+        output = extract_feature_dataset(data, cfg)
+
+        for proc_field, proc_features in [("motorcycle", ["weatherA", "speedLimit"]), ("bicycle", ["weatherA"])]:
+            expected_output, _ = data_qc(data, [proc_field] + proc_features)
+            assert_equal(output[proc_field]["features"], proc_features)
+            assert_equal(output[proc_field]["y"], expected_output[:, 0])
+            assert_equal(output[proc_field]["x"], expected_output[:, 1:])
+
+        with TemporaryDirectory() as work_dir:
+            mapped_output = extract_feature_dataset(data, cfg, feature_dir=work_dir)
+            assert_equal(isinstance(mapped_output["motorcycle"]["x"], memmap), True)
+            assert_equal(mapped_output["motorcycle"]["x"].flags["C_CONTIGUOUS"], True)
+            assert_equal(mapped_output["motorcycle"]["x"], output["motorcycle"]["x"])
+
+            # the workers only get the paths, and attach the matrices themselves
+            proc_dataset = {"paths": mapped_output["bicycle"]["paths"]}
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                assert_equal(pool.submit(attach_feature_dataset, proc_dataset).result()["y"], output["bicycle"]["y"])
+
+    def test_compute_shap_values(self):
+        rng = default_rng(1)
+        x = rng.integers(0, 4, size=(200, 3)).astype(float32)
+        y = x[:, 0] * 2.0 + x[:, 2]
+        model = XGBRegressor(max_depth=3, n_estimators=10)
+        model.fit(x, y)
+
+        output = compute_shap_values(model, x, batch_size=64)
+        assert_equal(output["values"].shape, (200, 3))
+        assert_allclose(output["values"].sum(axis=1) + output["base_values"], model.predict(x), atol=1e-4)
+
+    def test_train_model(self):
+        rng = default_rng(1)
+        x = rng.integers(0, 4, size=(200, 3)).astype(float32)
+        y = x[:, 0] * 2.0 + x[:, 2]
+        xy = split_training_test_data(x, y)
+        assert_equal(len(xy["training"]["index"]) + len(xy["test"]["index"]), 200)
+        assert_equal(get_split_data(xy, "test", "y"), y[xy["test"]["index"]])
+        model_cfg = {"max_depth": 3, "n_estimators": 20, "early_stopping_rounds": 5, "random_state": 1}
+
+        with TemporaryDirectory() as work_dir:
+            model = train_model(work_dir, "test", xy, ["a", "b", "c"], model_cfg, n_jobs=1)
+            assert_equal(len(listdir(join(work_dir, MODEL_DIR))), 1)
+
+            cached_model = train_model(work_dir, "test", xy, ["a", "b", "c"], model_cfg, n_jobs=1)
+            assert_equal(cached_model.predict(x), model.predict(x))
+            assert_equal(len(listdir(join(work_dir, MODEL_DIR))), 1)
+
+            train_model(work_dir, "test", xy, ["a", "b", "c"], {**model_cfg, "max_depth": 2}, n_jobs=1)
+            assert_equal(len(listdir(join(work_dir, MODEL_DIR))), 2)
+
+            # the model is trained without early stopping
+            train_model(work_dir, "test", xy, ["a", "b", "c"], {**model_cfg, "early_stopping_rounds": None}, n_jobs=1)
+            assert_equal(len(listdir(join(work_dir, MODEL_DIR))), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from json import load as json_load
+from os.path import exists, join
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from data_process.instrument import (inherit_stages, instrument,
+                                     instrument_stage, run_report)
+from numpy.testing import assert_equal
+
+
+@instrument("count_rows", field="field_name", rows=lambda inputs, output: len(inputs["rows"]))
+def count_rows(field_name: str, rows: list) -> int:
+    start_time = perf_counter()
+    while perf_counter() - start_time < 0.1:
+        pass
+    return len(rows)
+
+
+class TestInstrument(unittest.TestCase):
+    def test_run_report(self):
+        with TemporaryDirectory() as work_dir:
+            # the stages are not recorded if there is no run report
+            assert_equal(count_rows("field0", [1]), 1)
+
+            with run_report(work_dir, "test", run_args={"num_fields": 2}, profile=True, interval=0.005):
+                with instrument_stage("fields"):
+                    with ThreadPoolExecutor(max_workers=2) as field_pool:
+                        field_tasks = [
+                            field_pool.submit(inherit_stages(count_rows), f"field{i}", list(range(i)))
+                            for i in range(1, 3)
+                        ]
+                        assert_equal([proc_task.result() for proc_task in field_tasks], [1, 2])
+
+            with open(join(work_dir, "run_report.json")) as fid:
+                report = json_load(fid)
+
+            assert_equal(report["status"], "done")
+            assert_equal(report["args"], {"num_fields": 2})
+            assert_equal(
+                sorted(
+                    (proc_stage["stage"], proc_stage["field"], proc_stage["rows"], proc_stage["parent"])
+                    for proc_stage in report["stages"]
+                ),
+                [("count_rows", "field1", 1, 0), ("count_rows", "field2", 2, 0), ("fields", None, None, None)],
+            )
+            assert_equal(exists(report["profile"]), True)
+            # the profile is of a leaf stage, not of the stage holding them
+            assert_equal(report["profile"].endswith(("profile_count_rows_1.txt", "profile_count_rows_2.txt")), True)
+
+    def test_stage_rss(self):
+        with TemporaryDirectory() as work_dir:
+            with run_report(work_dir, "test", interval=0.005):
+                with instrument_stage("allocate"):
+                    proc_buffer = b"x" * (64 * 1024 * 1024)
+                del proc_buffer
+                with instrument_stage("after"):
+                    pass
+
+            with open(join(work_dir, "run_report.json")) as fid:
+                stage_records = {proc_stage["stage"]: proc_stage for proc_stage in json_load(fid)["stages"]}
+
+            if stage_records["after"]["peak_rss"] is None:
+                self.skipTest("the RSS is not available on this platform")
+
+            # the peak RSS of a stage is not carried over to the following stages
+            assert_equal(
+                stage_records["allocate"]["peak_rss"] - stage_records["after"]["peak_rss"] > 32 * 1024 * 1024, True
+            )
+            for proc_record in stage_records.values():
+                assert_equal(proc_record["peak_rss"] >= max(proc_record["start_rss"], proc_record["end_rss"]), True)
+
+
+if __name__ == "__main__":
+    unittest.main()
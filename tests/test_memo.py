@@ -0,0 +1,76 @@
+import unittest
+from os import chmod, listdir, makedirs
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from data_process.memo import open_query_memo
+from data_process.spatial import create_spatial
+from data_process.temporal import create_time_series
+from numpy.testing import assert_equal
+from pandas import DataFrame
+
+
+class TestMemo(unittest.TestCase):
+    def setUp(self):
+        self.data = DataFrame(
+            {
+                "region": ["Auckland Region", "Auckland Region", "Otago Region", "Otago Region"],
+                "crashYear": [2018, 2019, 2018, 2019],
+                "speedLimit": [100, 50, 100, 100],
+                "bicycle": [1.0, 2.0, 4.0, 3.0],
+            }
+        )
+        self.cfg = {
+            "region": ["Auckland", "Otago"],
+            "year": [2018, 2019],
+            "analysis_fields": {"field1": {"bicycle": {"speedLimit": 100}}, "field2": {"bicycle": None}},
+        }
+
+    def test_query_memo(self):
+        with TemporaryDirectory() as work_dir:
+            data_path = join(work_dir, "cas.csv")
+            memo_dir = join(work_dir, "memo")
+            self.data.to_csv(data_path, index=False)
+
+            for proc_engine in ["groupby", "dask"]:
+                expected_output = create_time_series(self.data, self.cfg, engine=proc_engine)
+
+                memo = open_query_memo(data_path, memo_dir=memo_dir)
+                assert_equal(create_time_series(self.data, self.cfg, engine=proc_engine, memo=memo), expected_output)
+                assert_equal(create_time_series(self.data, self.cfg, engine=proc_engine, memo=memo), expected_output)
+                assert_equal((memo["hits"], memo["misses"]), (16, 0) if proc_engine == "dask" else (8, 8))
+
+            # the spatial analysis shares the cells of the temporal analysis (the year 2018 only)
+            memo = open_query_memo(data_path, memo_dir=memo_dir)
+            spatial_cfg = {**self.cfg, "year": [2018]}
+            assert_equal(
+                create_spatial(self.data, None, spatial_cfg, memo=memo), create_spatial(self.data, None, spatial_cfg)
+            )
+            assert_equal((memo["hits"], memo["misses"]), (4, 0))
+
+            # a changed dataset does not reuse the cells
+            changed_data = self.data.copy()
+            changed_data.loc[1, "bicycle"] = 5.0
+            changed_data.to_csv(data_path, index=False)
+            memo = open_query_memo(data_path, memo_dir=memo_dir)
+            assert_equal(
+                create_time_series(changed_data, self.cfg, memo=memo), create_time_series(changed_data, self.cfg)
+            )
+            assert_equal((memo["hits"], memo["misses"]), (0, 8))
+
+            # the least recently used entries are evicted beyond the maximum size
+            memo = open_query_memo(data_path, memo_dir=memo_dir, max_size=0)
+            create_time_series(self.data, {**self.cfg, "year": [2020]}, memo=memo)
+            assert_equal(memo["evictions"] > 0, True)
+            assert_equal(listdir(memo_dir), [])
+
+            # a memo directory which can be written by the other users is refused
+            shared_dir = join(work_dir, "shared")
+            makedirs(shared_dir)
+            chmod(shared_dir, 0o777)
+            with self.assertRaises(Exception):
+                open_query_memo(data_path, memo_dir=shared_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+from data_process.pipeline import run_pipeline
+from numpy.testing import assert_equal
+
+
+def get_stage(func, deps, render=False):
+    return {"func": func, "deps": deps, "render": render}
+
+
+class TestPipeline(unittest.TestCase):
+    def test_run_pipeline(self):
+        stages = {
+            "load": get_stage(lambda: 2, []),
+            "exp1": get_stage(lambda data: data + 1, ["load"]),
+            "exp2": get_stage(lambda data: data * 10, ["load"]),
+            "report": get_stage(lambda exp1, exp2: [exp1, exp2], ["exp1", "exp2"], render=True),
+        }
+        stage_outputs = run_pipeline(stages, num_workers=2)
+
+        assert_equal(stage_outputs, {"load": 2, "exp1": 3, "exp2": 20, "report": [3, 20]})
+
+    def test_run_pipeline_with_cycle(self):
+        stages = {
+            "load": get_stage(lambda: 2, []),
+            "exp1": get_stage(lambda data, exp2: data, ["load", "exp2"]),
+            "exp2": get_stage(lambda exp1: exp1, ["exp1"]),
+        }
+
+        with self.assertRaises(Exception):
+            run_pipeline(stages)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+
+from data_process.scheduler import compute_tasks, get_scheduler_options
+from numpy import arange, take
+from numpy.testing import assert_equal
+
+
+class TestScheduler(unittest.TestCase):
+    def test_get_scheduler_options(self):
+        cfg = {"scheduler": "processes", "num_workers": 3}
+        assert_equal(get_scheduler_options(cfg), ("processes", 3))
+        assert_equal(get_scheduler_options(cfg, scheduler="threads", num_workers=0), ("threads", 1))
+
+        with self.assertRaises(Exception):
+            get_scheduler_options({"scheduler": "spark"})
+
+    def test_compute_tasks(self):
+        data = arange(10) * 2
+        for proc_scheduler in ["synchronous", "threads", "processes"]:
+            assert_equal(
+                compute_tasks(take, data, [(0,), (3,), (9,)], scheduler=proc_scheduler, num_workers=2), [0, 6, 18]
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+from json import dumps as json_dumps
+from json import loads as json_loads
+from http.client import HTTPConnection
+from threading import Thread
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from data_process.service import create_query_server
+from data_process.temporal import create_time_series
+from numpy.testing import assert_equal
+from pandas import DataFrame
+
+
+def post_query(server, query: dict) -> dict:
+    with urlopen(
+        f"http://127.0.0.1:{server.server_address[1]}/query", data=json_dumps(query).encode(), timeout=10
+    ) as response:
+        return json_loads(response.read())
+
+
+class TestService(unittest.TestCase):
+    def setUp(self):
+        self.data = DataFrame(
+            {
+                "region": ["Auckland Region", "Auckland Region", "Otago Region", "Otago Region", None],
+                "crashYear": [2018, 2019, 2018, 2018, 2018],
+                "speedLimit": [100, 50, 100, 100, 100],
+                "bicycle": [1.0, 2.0, None, 3.0, 5.0],
+            }
+        )
+        self.server = create_query_server(self.data, host="127.0.0.1", port=0, cache_size=1)
+        self.server_thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join()
+
+    def test_query(self):
+        query = {"field": "bicycle", "constrains": {"speedLimit": 100}, "years": {"start": 2018, "end": 2019}}
+        output = post_query(self.server, query)
+        assert_equal(output["regions"], ["Auckland", "Otago"])
+        assert_equal(output["cached"], False)
+
+        # the same answer as the temporal analysis
+        cfg = {
+            "region": ["Auckland", "Otago"],
+            "year": [2018, 2019],
+            "analysis_fields": {"field1": {"bicycle": {"speedLimit": 100}}},
+        }
+        expected_output = create_time_series(self.data, cfg)["field1"]
+        assert_equal(output["values"], expected_output)
+        assert_equal(output["total"], [4.0, 0.0])
+
+        assert_equal(post_query(self.server, {**query, "years": [2018, 2019]})["cached"], True)
+
+        # the least recently used result is evicted
+        post_query(self.server, {"field": "bicycle"})
+        assert_equal(post_query(self.server, query)["cached"], False)
+
+        # the constrain values are coerced to the types of the columns
+        assert_equal(post_query(self.server, {**query, "constrains": {"speedLimit": "100"}})["values"], expected_output)
+
+        for proc_query in [
+            {"field": "truck"},
+            {**query, "regions": ["Aukland"]},
+            {**query, "years": [2018, 2030]},
+            {**query, "years": {"start": 0, "end": 10**10}},
+            {**query, "years": {"start": 2019, "end": 2018}},
+            {**query, "constrains": {"speedLimit": "fast"}},
+            {**query, "constrains": {"region": 100}},
+        ]:
+            with self.assertRaises(HTTPError) as query_error:
+                post_query(self.server, proc_query)
+            assert_equal(query_error.exception.code, 400)
+
+    def test_content_length(self):
+        for proc_headers, expected_status in [
+            ({}, 411),
+            ({"Content-Length": "abc"}, 400),
+            ({"Content-Length": "-1"}, 400),
+            ({"Content-Length": str(10**9)}, 413),
+        ]:
+            connection = HTTPConnection("127.0.0.1", self.server.server_address[1], timeout=10)
+            connection.putrequest("POST", "/query")
+            for header_name, header_value in proc_headers.items():
+                connection.putheader(header_name, header_value)
+            connection.endheaders()
+            assert_equal(connection.getresponse().status, expected_status)
+            connection.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
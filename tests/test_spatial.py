@@ -0,0 +1,44 @@
+import unittest
+
+from data_process.spatial import create_spatial
+from numpy.testing import assert_almost_equal, assert_equal
+from pandas import DataFrame
+
+
+class TestSpatial(unittest.TestCase):
+    def test_create_spatial(self):
+        data = DataFrame(
+            {
+                "region": ["Auckland Region", "Auckland Region", "Otago Region"],
+                "crashYear": [2018, 2018, 2018],
+                "motorcycle": [1.0, 3.0, 2.0],
+            }
+        )
+        population = DataFrame(
+            {
+                "Census year": ["2013", "2018", "2018", "2018", "2013–18"],
+                "Region": ["Auckland", "Auckland", "Otago", "Otago", "Otago"],
+                "Measure": [
+                    "Census usually resident population count",
+                    "Census usually resident population count",
+                    "Census usually resident population count",
+                    "Change in resident population count",
+                    "Census usually resident population count",
+                ],
+                "Value": [1000.0, 2000.0, 100.0, 5.0, 7.0],
+            }
+        )
+        cfg = {"region": ["Auckland", "Otago"], "year": [2018], "analysis_fields": {"field1": {"motorcycle": None}}}
+
+        output = create_spatial(data, None, cfg)
+        assert_equal(output, {"field1": {"motorcycle": {"Auckland": {2018: 4.0}, "Otago": {2018: 2.0}}}})
+
+        output = create_spatial(data, population, cfg)
+        assert_almost_equal(output["field1"]["motorcycle"]["Auckland"][2018], 4.0 / 2000.0)
+        assert_almost_equal(output["field1"]["motorcycle"]["Otago"][2018], 2.0 / 100.0)
+
+        assert_equal(create_spatial(data, population, cfg, engine="dask", scheduler="synchronous"), output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from data_process.store import (get_cells_column_sets, get_columns_key,
+                                get_year_fingerprints, load_aggregate_store,
+                                update_aggregate_store)
+from data_process.spatial import create_spatial
+from data_process.temporal import create_time_series
+from numpy.testing import assert_equal
+from pandas import DataFrame
+from pandas.util import hash_pandas_object
+
+
+class TestStore(unittest.TestCase):
+    def setUp(self):
+        self.data = DataFrame(
+            {
+                "region": ["Auckland Region", "Auckland Region", "Otago Region", "Otago Region"],
+                "crashYear": [2018, 2019, 2018, 2019],
+                "speedLimit": [100, 50, 100, 100],
+                "bicycle": [1.0, 2.0, 4.0, 3.0],
+            }
+        )
+        self.cfg = {
+            "region": ["Auckland", "Otago"],
+            "year": [2018, 2019],
+            "analysis_fields": {"field1": {"bicycle": {"speedLimit": 100}}, "field2": {"bicycle": None}},
+        }
+
+    def test_get_year_fingerprints(self):
+        column_sets = get_cells_column_sets(self.cfg)
+        assert_equal(
+            column_sets,
+            [["bicycle", "crashYear", "region", "speedLimit"], ["bicycle", "crashYear", "region"]],
+        )
+        columns_key = get_columns_key(column_sets[0])
+
+        year_fingerprints = get_year_fingerprints(self.data, column_sets)
+        shuffled_year_fingerprints = get_year_fingerprints(self.data.iloc[::-1], column_sets)
+        assert_equal(year_fingerprints, shuffled_year_fingerprints)
+
+        # the sum of the row hashes is kept exact (not rounded to a float)
+        row_hashes = hash_pandas_object(self.data.loc[self.data["crashYear"] == 2018, column_sets[0]], index=False)
+        assert_equal(year_fingerprints[columns_key]["2018"], f"2-{int(row_hashes.sum()):016x}")
+
+        changed_data = self.data.copy()
+        changed_data.loc[1, "bicycle"] = 5.0
+        changed_year_fingerprints = get_year_fingerprints(changed_data, column_sets)
+        assert_equal(changed_year_fingerprints[columns_key]["2018"], year_fingerprints[columns_key]["2018"])
+        assert_equal(changed_year_fingerprints[columns_key]["2019"] != year_fingerprints[columns_key]["2019"], True)
+
+        # the values moved between the regions change the fingerprint
+        swapped_data = self.data.copy()
+        swapped_data["bicycle"] = [4.0, 2.0, 1.0, 3.0]
+        swapped_year_fingerprints = get_year_fingerprints(swapped_data, column_sets)
+        assert_equal(swapped_year_fingerprints[columns_key]["2018"] != year_fingerprints[columns_key]["2018"], True)
+
+    def test_update_aggregate_store(self):
+        with TemporaryDirectory() as work_dir:
+            data_path = join(work_dir, "cas.csv")
+            self.data.to_csv(data_path, index=False)
+
+            store = update_aggregate_store(work_dir, data_path, self.cfg)
+            assert_equal(
+                create_time_series(None, self.cfg, store=store), create_time_series(self.data, self.cfg)
+            )
+
+            # the sums are taken from the store with any engine
+            assert_equal(
+                create_time_series(None, self.cfg, engine="dask", store=store), create_time_series(self.data, self.cfg)
+            )
+            assert_equal(
+                create_spatial(None, None, self.cfg, engine="dask", store=store),
+                create_spatial(self.data, None, self.cfg),
+            )
+            with self.assertRaises(Exception):
+                create_time_series(None, self.cfg, engine="spark", store=store)
+            with self.assertRaises(Exception):
+                create_spatial(None, None, self.cfg, engine="spark", store=store)
+
+            # only the cells of 2019 are aggregated again
+            changed_data = self.data.copy()
+            changed_data.loc[1, "bicycle"] = 5.0
+            changed_data.to_csv(data_path, index=False)
+            stored_cells = load_aggregate_store(work_dir).set_index(["field", "constrain_key", "region", "crashYear"])
+
+            store = update_aggregate_store(work_dir, data_path, self.cfg)
+            updated_cells = store.set_index(["field", "constrain_key", "region", "crashYear"])
+            assert_equal(
+                (updated_cells["fingerprint"] != stored_cells["fingerprint"].reindex(updated_cells.index))
+                .groupby(level="crashYear")
+                .sum()
+                .to_dict(),
+                {2018: 0, 2019: 4},
+            )
+            assert_equal(
+                create_time_series(None, self.cfg, store=store), create_time_series(changed_data, self.cfg)
+            )
+
+            # the values of 2018 are swapped between the regions
+            swapped_data = changed_data.copy()
+            swapped_data["bicycle"] = [4.0, 5.0, 1.0, 3.0]
+            swapped_data.to_csv(data_path, index=False)
+            store = update_aggregate_store(work_dir, data_path, self.cfg)
+            assert_equal(
+                create_time_series(None, self.cfg, store=store), create_time_series(swapped_data, self.cfg)
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+
+from data_process import DASK_ENGINE_KEY, GROUPBY_ENGINE_KEY
+from data_process.cube import build_crash_cube
+from data_process.temporal import (create_time_series, fit_temporal_trend,
+                                   obtain_temporal_trend)
+from data_process.utils import get_query_keys
+from numpy.random import default_rng
+from numpy.testing import assert_almost_equal, assert_equal
+from pandas import DataFrame
+from scipy.stats import linregress
+
+
+class TestTemporal(unittest.TestCase):
+    def setUp(self):
+        self.data = DataFrame(
+            {
+                "region": ["Auckland Region", "Auckland Region", "Otago Region", "Otago Region", None],
+                "crashYear": [2018, 2019, 2018, 2018, 2018],
+                "speedLimit": [100, 50, 100, 100, 100],
+                "bicycle": [1.0, 2.0, None, 3.0, 5.0],
+                "truck": [0.0, 1.0, 1.0, 2.0, 5.0],
+            }
+        )
+        self.cfg = {
+            "region": ["Auckland", "Otago", "Nelson"],
+            "year": [2018, 2019],
+            "analysis_fields": {
+                "field1": {"bicycle": {"speedLimit": 100}},
+                "field2": {"bicycle": None},
+                "field3": {"truck": {"speedLimit": 100}},
+            },
+        }
+
+    def test_create_time_series(self):
+        output = create_time_series(self.data, self.cfg, engine=GROUPBY_ENGINE_KEY)
+        assert_equal(list(output.keys()), ["field1", "field2", "field3"])
+        assert_equal(output["field1"], {"Auckland": [1.0, 0.0], "Otago": [3.0, 0.0], "Nelson": [0.0, 0.0]})
+        assert_equal(output["field3"]["Otago"], [3.0, 0.0])
+
+        output_dask = create_time_series(self.data, self.cfg, num_workers=1, engine=DASK_ENGINE_KEY)
+        for field_name in output:
+            for proc_region in output[field_name]:
+                assert_almost_equal(output[field_name][proc_region], output_dask[field_name][proc_region])
+
+    def test_create_time_series_with_constrains(self):
+        data = self.data.assign(weatherA=["Fine", "Snow", None, "Heavy rain", "Fine"])
+        cfg = {
+            "region": ["Auckland", "Otago"],
+            "year": [2018, 2019],
+            "analysis_fields": {
+                "field1": {"truck": {"speedLimit": {">=": 80}}},
+                "field2": {"truck": {"weatherA": ["Snow", "Heavy rain"]}},
+                "field3": {"truck": {"weatherA": {"not_in": ["Fine"]}}},
+                "field4": {"truck": {"weatherA": None}},
+                "field5": {"truck": {"weatherA": {"not": {"==": "Fine"}}}},
+                "field6": {"truck": {"speedLimit": {">": 50, "<=": 100}, "weatherA": {"is_null": False}}},
+            },
+        }
+        expected_output = {
+            "field1": {"Auckland": [0.0, 0.0], "Otago": [3.0, 0.0]},
+            "field2": {"Auckland": [0.0, 1.0], "Otago": [2.0, 0.0]},
+            "field3": {"Auckland": [0.0, 1.0], "Otago": [2.0, 0.0]},
+            "field4": {"Auckland": [0.0, 0.0], "Otago": [1.0, 0.0]},
+            "field5": {"Auckland": [0.0, 1.0], "Otago": [3.0, 0.0]},
+            "field6": {"Auckland": [0.0, 0.0], "Otago": [2.0, 0.0]},
+        }
+        for proc_engine in [GROUPBY_ENGINE_KEY, DASK_ENGINE_KEY]:
+            assert_equal(create_time_series(data, cfg, num_workers=1, engine=proc_engine), expected_output)
+
+        # the equality constrains keep their canonical form
+        assert_equal(
+            get_query_keys({"truck": {"speedLimit": {"==": 100}}}), get_query_keys({"truck": {"speedLimit": 100}})
+        )
+
+        with self.assertRaises(Exception):
+            get_query_keys({"truck": {"speedLimit": {"~": 100}}})
+
+    def test_create_time_series_from_cube(self):
+        cube = build_crash_cube(self.data, dimensions=["speedLimit"], measures=["bicycle", "truck"])
+        assert_equal(len(cube), 4)
+        assert_equal(create_time_series(cube, self.cfg), create_time_series(self.data, self.cfg))
+
+    def test_fit_temporal_trend(self):
+        ts_data = default_rng(1).poisson(10.0, size=(5, 8)).astype(float)
+        x = [0, 1, 2, 3, 5, 6, 7, 9]
+        trend = fit_temporal_trend(ts_data, x=x)
+
+        for i in range(ts_data.shape[0]):
+            expected_trend = linregress(x, ts_data[i])
+            assert_almost_equal(trend["slope"][i], expected_trend.slope)
+            assert_almost_equal(trend["intercept"][i], expected_trend.intercept)
+            assert_almost_equal(trend["stderr"][i], expected_trend.stderr)
+            assert_almost_equal(trend["p_value"][i], expected_trend.pvalue)
+
+    def test_obtain_temporal_trend(self):
+        cfg = {"region": ["Auckland", "Otago"], "year": [2017, 2018, 2019]}
+        timeseries_data = {"field1": {"Auckland": [1.0, 2.0, 3.0], "Otago": [2.0, 2.0, 2.0]}}
+        trend_table = obtain_temporal_trend(timeseries_data, cfg)
+
+        assert_equal(trend_table["region"].tolist(), ["Auckland", "Otago", "total"])
+        assert_almost_equal(trend_table["slope"].to_numpy(), [1.0, 0.0, 1.0])
+        assert_almost_equal(trend_table["intercept"].to_numpy(), [1.0, 2.0, 3.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import unittest
+from os.path import exists, join
+from tempfile import mkdtemp
+
+from data_process.geojson import iter_geojson_chunks, iter_geojson_features
+from data_process.utils import get_dataset_cache_paths, read_dataset
+from numpy.testing import assert_equal
+from pandas import DataFrame
+
+
+class TestUtils(unittest.TestCase):
+    def test_read_dataset_cache(self):
+        data_path = join(mkdtemp(), "cas.csv")
+        DataFrame(
+            {
+                "region": ["Auckland Region", "Otago Region", "Otago Region"],
+                "crashYear": [2018, 2019, 2019],
+                "weatherA": ["Fine", "Null", "Snow"],
+                "bicycle": [1.0, None, 0.0],
+            }
+        ).to_csv(data_path, index=False)
+
+        output = read_dataset(data_path, use_cache=True)
+        assert_equal(exists(get_dataset_cache_paths(data_path)["data"]), True)
+        assert_equal(str(output["region"].dtype), "category")
+        assert_equal(str(output["bicycle"].dtype), "float32")
+
+        output = read_dataset(data_path, use_cache=True)
+        assert_equal(output["crashYear"].tolist(), [2018, 2019, 2019])
+
+        # the cache is invalidated once the source dataset changes
+        DataFrame({"region": ["Auckland Region"], "crashYear": [2020]}).to_csv(data_path, index=False)
+        output = read_dataset(data_path, use_cache=True)
+        assert_equal(output["crashYear"].tolist(), [2020])
+
+    def test_read_dataset_in_chunks(self):
+        data_path = join(mkdtemp(), "cas.csv")
+        DataFrame(
+            {
+                "region": ["Auckland Region", "Otago Region", "Otago Region", "Otago Region"],
+                "crashYear": [2018, 2019, 2019, 2020],
+                "bicycle": [1.0, None, 2.0, 4.0],
+                "truck": [1.0, 1.0, 1.0, 1.0],
+            }
+        ).to_csv(data_path, index=False)
+
+        output = read_dataset(
+            data_path,
+            columns=["region", "crashYear", "bicycle"],
+            chunksize=1,
+            filters={"crashYear": [2018, 2019]},
+            aggregate_by=["region", "crashYear"],
+        )
+        assert_equal(output.columns.tolist(), ["region", "crashYear", "bicycle"])
+        assert_equal(output["region"].tolist(), ["Auckland Region", "Otago Region"])
+        assert_equal(output["bicycle"].tolist(), [1.0, 2.0])
+
+    def test_read_dataset_in_sparse_chunks(self):
+        data_path = join(mkdtemp(), "cas.csv")
+        DataFrame(
+            {
+                "region": ["Auckland Region", "Otago Region", "Auckland Region", "Otago Region"],
+                "crashYear": [2018, 2018, 2019, 2019],
+                "weatherA": [None, None, "Fine", "Snow"],
+            }
+        ).to_csv(data_path, index=False)
+
+        # weatherA is all missing in the first chunk
+        output = read_dataset(data_path, chunksize=2)
+        assert_equal(output["weatherA"].dtype.name, "category")
+        assert_equal(output["weatherA"].tolist()[2:], ["Fine", "Snow"])
+        assert_equal(output["weatherA"].isna().tolist(), [True, True, False, False])
+
+    def test_read_dataset_geojson(self):
+        data_path = join(mkdtemp(), "cas.geojson")
+        with open(data_path, "w") as fout:
+            fout.write(
+                '{"type": "FeatureCollection", "name": "cas", "features": [\n'
+                '{"type": "Feature", "properties": {"region": "Otago Region", "crashYear": 2018, "bicycle": 1}, '
+                '"geometry": {"type": "Point", "coordinates": [170.5, -45.8]}},\n'
+                '{"type": "Feature", "properties": {"region": "Otago Region", "crashYear": 2019, "bicycle": null}, '
+                '"geometry": null}\n'
+                "]}"
+            )
+
+        assert_equal(len(list(iter_geojson_features(data_path, block_size=7))), 2)
+
+        output = read_dataset(data_path, use_cache=True)
+        assert_equal(output.columns.tolist(), ["X", "Y", "region", "crashYear", "bicycle"])
+        assert_equal(output["X"].tolist()[0], 170.5)
+        assert_equal(output["crashYear"].tolist(), [2018, 2019])
+        assert_equal(exists(get_dataset_cache_paths(data_path)["data"]), True)
+
+    def test_read_dataset_geojson_in_batches(self):
+        data_path = join(mkdtemp(), "cas.geojson")
+        with open(data_path, "w") as fout:
+            fout.write(
+                '{"type": "FeatureCollection", "name": "cas", "features": [\n'
+                '{"type": "Feature", "properties": {"region": "Otago Region", "crashYear": 2018, "weatherA": null, '
+                '"bicycle": null}, "geometry": null},\n'
+                '{"type": "Feature", "properties": {"region": "Otago Region", "crashYear": 2019, "weatherA": "Fine", '
+                '"bicycle": 1}, "geometry": null}\n'
+                "]}"
+            )
+
+        # the sparse properties are all missing in the first batch, only the numbers are typed as float
+        first_chunk = next(iter_geojson_chunks(data_path, chunksize=1, columns=["weatherA", "bicycle"]))
+        assert_equal([str(first_chunk["weatherA"].dtype), str(first_chunk["bicycle"].dtype)], ["object", "float64"])
+
+        output = read_dataset(data_path, columns=["region", "crashYear", "weatherA", "bicycle"], chunksize=1)
+        assert_equal(output["weatherA"].dtype.name, "category")
+        assert_equal(output["weatherA"].tolist()[1], "Fine")
+        assert_equal(output["bicycle"].tolist()[1], 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+from os import chmod, listdir, makedirs
+from os.path import exists, join
+from tempfile import TemporaryDirectory
+
+from data_process import MAP_CFG
+from data_process.vis import (_MAP_MEMO, generate_map, get_map_key,
+                              load_map, plot_spatial)
+from matplotlib import use
+from matplotlib.pyplot import close, figure
+from numpy.testing import assert_equal
+from pandas import DataFrame
+
+use("Agg")
+
+
+class TestVis(unittest.TestCase):
+    def test_generate_map(self):
+        map_cfg = {**MAP_CFG, "resolution": "c"}
+
+        with TemporaryDirectory() as cache_dir:
+            for _ in range(2):
+                figure()
+                map_obj = generate_map(map_cfg=map_cfg, cache_dir=cache_dir)
+                close()
+
+            assert_equal(listdir(cache_dir), [f"basemap_{get_map_key(map_cfg)}.npz"])
+
+            # the map background is loaded from the cache directory when it is not in the memory
+            _MAP_MEMO.clear()
+            figure()
+            cached_map_obj = generate_map(map_cfg=map_cfg, cache_dir=cache_dir)
+            close()
+
+        assert_equal(cached_map_obj(175.0, -40.0), map_obj(175.0, -40.0))
+
+        # a cache directory which can be written by the other users is refused
+        with TemporaryDirectory() as work_dir:
+            cache_dir = join(work_dir, "map_cache")
+            makedirs(cache_dir)
+            chmod(cache_dir, 0o777)
+            _MAP_MEMO.clear()
+            with self.assertRaises(Exception):
+                load_map(map_cfg=map_cfg, cache_dir=cache_dir)
+
+    def test_plot_spatial(self):
+        latlon = DataFrame({"Region": ["Otago", "Auckland"], "lat": [-45.0, -36.8], "lon": [170.5, 174.7]})
+        spatial_data = {"field1": {"motorcycle": {"Auckland": {2017: 3.0, 2018: 4.0}, "Otago": {2017: 1.0, 2018: 2.0}}}}
+
+        with TemporaryDirectory() as work_dir:
+            plot_spatial(work_dir, spatial_data, latlon, 1.0, False, render_workers=1)
+            assert_equal(exists(join(work_dir, "spatial_field1.png")), True)
+
+
+if __name__ == "__main__":
+    unittest.main()